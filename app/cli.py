@@ -0,0 +1,183 @@
+# econ-rag command line
+# One entry point for the pipeline: econ-rag harvest | process | embed | data |
+# index | query | serve; data runs the first three with a stage cache. Only the
+# standard library is imported up front; a subcommand imports its module when it
+# runs, so `econ-rag --help` does not load polars, torch or nltk. Options after
+# the subcommand go to the stage, e.g. econ-rag embed --backend onnx-int8,
+# econ-rag index bm25 --help
+# Options before the subcommand are for the run itself: --report writes run
+# metrics (see app.profiling) to data/runs, --profile adds a profile, e.g.
+# econ-rag --report process
+import sys
+from argparse import ArgumentParser
+from importlib import import_module
+from pathlib import Path
+
+from app import profiling
+
+proj_dir = Path(__file__).parents[1]
+
+# Subcommand -> ("module:function" called with the remaining argv, help)
+COMMANDS = {
+    "harvest": ("app.data_prep.get_data:main", "Harvest Crossref metadata"),
+    "records": (
+        "app.data_prep.record_store:main",
+        "Stats of the record store, data/records.sqlite",
+    ),
+    "process": (
+        "app.data_prep.process_data:main",
+        "Clean abstracts into data/abstracts_clean.parquet",
+    ),
+    "embed": ("app.embeddings.shards:main", "Embed abstracts in resumable shards"),
+    "data": (
+        "app.pipeline:main",
+        "Harvest, process and embed, skipping unchanged stages",
+    ),
+    "index": ("app.cli:index", "Build an index: artifact, ann, bm25 or quantize"),
+    "query": ("app.cli:query", "Search the abstracts"),
+    "serve": ("app.retrieval.server:main", "Serve retrieval queries over HTTP"),
+}
+
+# econ-rag index <kind> -> module:function
+INDEXES = {
+    "artifact": "app.embeddings.artifact:main",
+    "ann": "app.retrieval.ann:main",
+    "bm25": "app.retrieval.bm25:main",
+    "quantize": "app.retrieval.quantize:main",
+}
+
+
+def _run(target: str, argv: list[str], prog: str):
+    # Stage parsers take their usage name from sys.argv[0]
+    sys.argv[0] = prog
+    module, function = target.split(":")
+    return getattr(import_module(module), function)(argv)
+
+
+def index(argv: list[str] | None = None):
+    parser = ArgumentParser(
+        prog="econ-rag index",
+        description="Build an index of the abstracts or of an embedding artifact",
+        add_help=False,
+    )
+    parser.add_argument("kind", choices=list(INDEXES))
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        parser.print_help()
+        return
+    args, rest = parser.parse_known_args(argv)
+    return _run(INDEXES[args.kind], rest, f"econ-rag index {args.kind}")
+
+
+def query(argv: list[str] | None = None):
+    """Prints the top k abstracts of each query"""
+    from app.embeddings.encoders import BACKENDS, load_encoder
+
+    parser = ArgumentParser(prog="econ-rag query", description="Search abstracts")
+    parser.add_argument("texts", nargs="+", metavar="query")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--backend", default="torch", choices=BACKENDS)
+    parser.add_argument(
+        "--index",
+        default="flat",
+        choices=["flat", "ivf", "int8", "binary"],
+        help="flat scans the embeddings; ivf scores the closest lists of econ-rag "
+        "index ann; int8 and binary scan the quantized codes of econ-rag index "
+        "quantize and rescore a shortlist",
+    )
+    parser.add_argument(
+        "--nprobe", type=int, default=8, help="Lists scored per query with ivf"
+    )
+    parser.add_argument(
+        "--rescore", type=int, default=10, help="Shortlist of int8/binary, x k"
+    )
+    parser.add_argument("--hybrid", action="store_true", help="Fuse with BM25")
+    parser.add_argument("--journal", action="append", help="Repeat for several")
+    parser.add_argument("--author", action="append", help="Repeat for several")
+    parser.add_argument("--year-from", type=int)
+    parser.add_argument("--year-to", type=int)
+    args = parser.parse_args(argv)
+
+    import polars as pl
+
+    from app.embeddings.artifact import artifact_dir
+    from app.retrieval.bm25 import load_bm25
+    from app.retrieval.dense import load_retriever
+    from app.retrieval.hybrid import HybridRetriever, MetadataFilter
+
+    filters = MetadataFilter(
+        journals=tuple(args.journal) if args.journal else None,
+        year_from=args.year_from,
+        year_to=args.year_to,
+        authors=tuple(args.author) if args.author else None,
+    )
+    if filters == MetadataFilter():
+        filters = None
+    encoder = load_encoder(args.model, args.backend)
+    retriever = load_retriever(
+        artifact_dir(proj_dir, args.model),
+        encoder,
+        args.index,
+        rescore=args.rescore,
+        nprobe=args.nprobe,
+    )
+    if args.hybrid:
+        bm25 = load_bm25(proj_dir / "data" / "bm25")
+        results = HybridRetriever(retriever, bm25, retriever.rows).search(
+            args.texts, args.k, filters
+        )
+    else:
+        candidates = filters.row_ids(retriever.rows) if filters else None
+        results = retriever.query(args.texts, args.k, candidates)
+
+    columns = ["rank", "score", "year", "journal", "title", "doi"]
+    with pl.Config(tbl_rows=args.k, fmt_str_lengths=80, tbl_hide_dataframe_shape=True):
+        for text, df in zip(args.texts, results):
+            print(text)
+            print(df.select(c for c in columns if c in df.columns))
+
+
+def main(argv: list[str] | None = None):
+    parser = ArgumentParser(
+        prog="econ-rag",
+        description="Retrieval over abstracts of economics journals",
+        epilog="Run econ-rag <command> --help for the options of a command",
+    )
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help="Write a JSON report of time, memory and counters of the run",
+    )
+    parser.add_argument(
+        "--runs-dir",
+        type=Path,
+        default=proj_dir / "data" / "runs",
+        help="Where --report writes (default data/runs)",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=profiling.PROFILERS,
+        help="Also profile the run, implies --report",
+    )
+    commands = parser.add_subparsers(dest="command", metavar="command", required=True)
+    for name, (_, help) in COMMANDS.items():
+        # The stage parses its own options, including --help
+        commands.add_parser(name, help=help, add_help=False)
+    args, rest = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+    target, prog = COMMANDS[args.command][0], f"econ-rag {args.command}"
+    if not (args.report or args.profile):
+        return _run(target, rest, prog)
+
+    profiler = profiling.Profiler(args.command, args.profile)
+    try:
+        with profiler:
+            return _run(target, rest, prog)
+    finally:
+        path = profiler.save(args.runs_dir)
+        print(profiling.format_report(profiler.report()), file=sys.stderr)
+        print(f"Run report: {path}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
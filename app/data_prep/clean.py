@@ -0,0 +1,172 @@
+# Batched versions of `clean_text` for whole columns
+# * clean_text_expr: the NLTK word tokenizer rewritten as polars regex expressions,
+#   runs in Rust across all rows and needs no punkt download
+# * clean_texts_parallel: exact NLTK results, rows split across a process pool
+# It runs inside a multithreaded polars plan, so the pool spawns its workers
+# (forking a process with running threads can deadlock the child), and a run
+# starts one pool (clean_pool) for all of its batches
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from multiprocessing import get_context
+
+import polars as pl
+
+from app.data_prep.process_data import clean_text
+
+# Punkt does not end a sentence after these (lowercased) abbreviations
+ABBREVIATIONS = [
+    "al",
+    "cf",
+    "dr",
+    "eq",
+    "eqs",
+    "etc",
+    "fig",
+    "figs",
+    "inc",
+    "jr",
+    "mr",
+    "mrs",
+    "ms",
+    "no",
+    "pp",
+    "prof",
+    "sec",
+    "st",
+    "vol",
+    "vs",
+]
+
+# Rules of nltk.tokenize.NLTKWordTokenizer in the same order, with the
+# lookarounds rewritten for the Rust regex engine
+STARTING_QUOTES = [
+    (r"([«“‘„]|[`]+)", " ${1} "),
+    (r'^"', r"``"),
+    (r"(``)", " ${1} "),
+    (r"([ \(\[{<])(\"|'{2})", "${1} `` "),
+    # (?!re|ve|ll|m|t|s|d|n)(\w)\b can only ever match a single letter
+    (r"(?i)(')([\w&&[^mtsdnMTSDN]])\b", "${1} ${2}"),
+]
+PUNCTUATION = [
+    (r'([^\.])(\.)([\]\)}>"\'»”’ ]*)\s*$', "${1} ${2} ${3} "),
+    (r"([:,])([^\d])", " ${1} ${2}"),
+    (r"([:,])$", " ${1} "),
+    (r"\.{2,}", " ${0} "),
+    (r"[;@#$%&]", " ${0} "),
+    (r'([^\.])(\.)([\]\)}>"\']*)\s*$', "${1} ${2}${3} "),
+    (r"[?!]", " ${0} "),
+    (r"([^'])' ", "${1} ' "),
+    (r"[*]", " ${0} "),
+]
+PARENS_BRACKETS = (r"[\]\[\(\)\{\}<>]", " ${0} ")
+DOUBLE_DASHES = (r"--", " -- ")
+ENDING_QUOTES = [
+    (r"([»”’])", " ${1} "),
+    (r"''", " '' "),
+    (r'"', " '' "),
+    (r"\s+", " "),
+    (r"([^' ])('[sS]|'[mM]|'[dD]|') ", "${1} ${2} "),
+    (r"([^' ])('ll|'LL|'re|'RE|'ve|'VE|n't|N'T) ", "${1} ${2} "),
+]
+CONTRACTIONS = [
+    (r"(?i)\b(can)(not)\b", " ${1} ${2} "),
+    (r"(?i)\b(d)('ye)\b", " ${1} ${2} "),
+    (r"(?i)\b(gim)(me)\b", " ${1} ${2} "),
+    (r"(?i)\b(gon)(na)\b", " ${1} ${2} "),
+    (r"(?i)\b(got)(ta)\b", " ${1} ${2} "),
+    (r"(?i)\b(lem)(me)\b", " ${1} ${2} "),
+    (r"(?i)\b(more)('n)\b", " ${1} ${2} "),
+    (r"(?i)\b(wan)(na)(\s)", " ${1} ${2} ${3}"),
+    (r"(?i) ('t)(is)\b", " ${1} ${2} "),
+    (r"(?i) ('t)(was)\b", " ${1} ${2} "),
+]
+
+
+def _apply(expr: pl.Expr, rules: list[tuple[str, str]]) -> pl.Expr:
+    for pattern, replacement in rules:
+        expr = expr.str.replace_all(pattern, replacement)
+    return expr
+
+
+def _split_sentences(expr: pl.Expr) -> pl.Expr:
+    """
+    Approximates punkt: a word of 2+ characters without inner periods that ends
+    with a period (before closing brackets/quotes) and is followed by whitespace
+    ends a sentence, unless it is a known abbreviation. The period becomes its
+    own token, like the final period of each sentence in NLTK.
+    """
+    sentence_end = r"(^|\s)([^\s.]{2,})\.([\]\)}>\"'»”’]*)(\s)"
+    # Run twice: neighbouring matches share the whitespace between them
+    for _ in range(2):
+        expr = expr.str.replace_all(sentence_end, "${1}${2} .${3}${4}")
+    abbreviation = r"(^|\s)(" + "|".join(ABBREVIATIONS) + r") \."
+    for _ in range(2):
+        expr = expr.str.replace_all(abbreviation, "${1}${2}.")
+    return expr
+
+
+def clean_text_expr(expr: pl.Expr | str, remove_abstract: bool = False) -> pl.Expr:
+    """
+    Polars expression with the semantics of `clean_text`: lowercases, strips
+    tags and tokenizes like `nltk.word_tokenize`, returning space separated tokens.
+
+    Sentence splitting only approximates punkt (see `_split_sentences`), so a
+    few abstracts with unusual abbreviations tokenize differently. Use
+    `clean_texts_parallel` where exact parity matters.
+    """
+    if isinstance(expr, str):
+        expr = pl.col(expr)
+    text = expr.str.to_lowercase().str.replace_all(r"<[^>]+>", "")
+    text = _split_sentences(text)
+    text = _apply(text, STARTING_QUOTES)
+    text = _apply(text, PUNCTUATION)
+    text = _apply(text, [PARENS_BRACKETS, DOUBLE_DASHES])
+    text = text.str.replace(r"(?s)^(.*)$", " ${1} ")
+    text = _apply(text, ENDING_QUOTES)
+    text = _apply(text, CONTRACTIONS)
+    text = text.str.replace_all(r"\s+", " ").str.strip_chars()
+    if remove_abstract:
+        # Drops a leading "abstract" token, or the "abstract" prefix of the first token
+        text = text.str.replace(r"^abstract ?", "")
+    return text
+
+
+def _clean_chunk(args: tuple[list[str], bool]) -> list[str]:
+    texts, remove_abstract = args
+    return [clean_text(t, remove_abstract) for t in texts]
+
+
+def clean_pool(n_workers: int | None = None) -> ProcessPoolExecutor:
+    """Spawned worker processes for `clean_texts_parallel`, all cores by default"""
+    return ProcessPoolExecutor(
+        max_workers=n_workers or os.cpu_count() or 1, mp_context=get_context("spawn")
+    )
+
+
+def clean_texts_parallel(
+    texts: list[str],
+    remove_abstract: bool = False,
+    n_workers: int | None = None,
+    chunk_size: int = 2000,
+    pool: Executor | None = None,
+) -> list[str]:
+    """
+    Exact `clean_text` over many texts, with chunks of rows spread over a
+    process pool. Needs the punkt corpus like `clean_text`.
+
+    Args:
+        pool (Executor, optional): Pool to run the chunks on, e.g. `clean_pool`,
+            shared by the calls of a run; without one, a pool of `n_workers`
+            is started for this call.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    chunks = [
+        (texts[i : i + chunk_size], remove_abstract)
+        for i in range(0, len(texts), chunk_size)
+    ]
+    if len(chunks) <= 1 or (pool is None and n_workers == 1):
+        return [t for chunk in map(_clean_chunk, chunks) for t in chunk]
+    if pool is not None:
+        return [t for chunk in pool.map(_clean_chunk, chunks) for t in chunk]
+    with clean_pool(n_workers) as pool:
+        return [t for chunk in pool.map(_clean_chunk, chunks) for t in chunk]
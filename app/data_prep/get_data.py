@@ -1,21 +1,36 @@
 # Gets the abstract and other information of articles in top 5
-# Stores results in cache
+# Stores results in the record store, data/records.sqlite
+# A full harvest runs the plan of app.data_prep.planner, one query per journal
+# and date window; --dry-run only writes the plan to data/harvest_plan.json. The
+# windows of past years in that file are reused, so their pages keep their cache
+# keys; --replan plans every year again
+from argparse import ArgumentParser
 from datetime import date
 from os import getenv
 from pathlib import Path
 from typing import Dict, List
 
-import requests
 from diskcache import Cache
 from dotenv import load_dotenv
-from tqdm import tqdm
-from utils import get_issns, make_hive_cache_key
+
+from app.data_prep.harvest import CrossrefHarvester, CrossrefQuery
+from app.data_prep.incremental import (
+    HarvestManifest,
+    advance_watermarks,
+    plan_incremental_queries,
+)
+from app.data_prep.planner import (
+    HarvestPlan,
+    fetch_year_counts,
+    plan_harvest,
+    reusable_queries,
+)
+from app.data_prep.record_store import open_record_store
+from app.data_prep.utils import get_issns
 
 proj_dir = Path(__file__).parents[2]
-cache = Cache(proj_dir / "data" / "cache")
 
-load_dotenv()
-user_email = getenv("USER_EMAIL")
+START_YEAR = 2000
 
 
 def fetch_crossref_metadata(
@@ -31,65 +46,11 @@ def fetch_crossref_metadata(
     Fetch metadata from Crossref API for a journal in a date range,
     including the journal title (container-title).
     """
-    base_url = "https://api.crossref.org/works"
-    headers = {"User-Agent": f"MyCrossrefClient/1.0 (mailto:{user_email})"}
-
-    # Filters
-    common = [
-        "type:journal-article",
-        f"from-pub-date:{date_from}",
-        f"until-pub-date:{date_to}",
-        "has-abstract:true",
-    ]
-    if prefix:
-        key_filter = f"prefix:{prefix}"
-    elif issn:
-        key_filter = f"issn:{issn}"
-    else:
-        raise ValueError("You must supply either an ISSN or a DOI prefix")
-    filters = [key_filter] + common
-
-    params = {
-        "filter": ",".join(filters),
-        "rows": 1000,
-        "select": "DOI,title,author,issued,abstract,container-title",
-        "sort": "published",
-        "order": "desc",
-        "mailto": user_email,
-        "cursor": "*",
-    }
-
-    all_items = []
-    while True:
-        cache_key = make_hive_cache_key(
-            issn=issn,
-            date_from=date_from,
-            date_to=date_to,
-            cursor=params["cursor"],
-            prefix=prefix,
-        )
-        if cache_key in cache:
-            data = cache[cache_key]
-        else:
-            resp = requests.get(base_url, headers=headers, params=params)
-            resp.raise_for_status()
-            if verbose:
-                print("REQUEST ▶", resp.url)
-                print("STATUS  ▶", resp.status_code)
-                print("HEADERS ▶", resp.headers.get("Retry-After", "none"))
-                print("BODY    ▶", resp.text[:200], "…")
-            data = resp.json()["message"]
-            cache[cache_key] = data
-
-        items = data.get("items", [])
-        all_items.extend(items)
-
-        if len(items) < params["rows"]:
-            break
-
-        params["cursor"] = data["next-cursor"]
-
-    return all_items
+    harvester = CrossrefHarvester(cache, user_email, max_workers=1, verbose=verbose)
+    query = CrossrefQuery(
+        date_from=date_from, date_to=date_to, issn=issn, prefix=prefix
+    )
+    return harvester.fetch(query)
 
 
 def generate_yearly_date_ranges(start_year: int) -> list[dict]:
@@ -114,42 +75,98 @@ def generate_yearly_date_ranges(start_year: int) -> list[dict]:
     return ranges
 
 
-if __name__ == "__main__":
-    START_YEAR = 2000
-    date_ranges = generate_yearly_date_ranges(START_YEAR)
+def main(argv: list[str] | None = None):
+    """Harvests all journals, or only what is new with --incremental"""
+    parser = ArgumentParser(description="Harvest abstracts from Crossref")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only fetch records indexed since the last run (see harvest_manifest.json)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Write the plan of a full harvest to data/harvest_plan.json and stop",
+    )
+    parser.add_argument(
+        "--plan",
+        type=Path,
+        help="Run this saved plan instead of planning again (e.g. to resume)",
+    )
+    parser.add_argument(
+        "--replan",
+        action="store_true",
+        help="Plan every year again instead of reusing the windows of past years "
+        "in data/harvest_plan.json (their pages are then fetched again)",
+    )
+    parser.add_argument(
+        "--start-year",
+        type=int,
+        default=START_YEAR,
+        help=f"First year harvested (default {START_YEAR})",
+    )
+    args = parser.parse_args(argv)
+
+    MAX_WORKERS = 8
+    date_ranges = generate_yearly_date_ranges(args.start_year)
     issns = get_issns()
     DOI_PREFIX = {
         # "American Economic Review": "10.1257/aer",
         "Journal of Political Economy": "10.1086",  # JPE
     }
 
-    for date_range in tqdm(date_ranges):
-        for journal in issns:
-            prefix = DOI_PREFIX.get(journal)
-            print_issn = issns[journal]["print"]
-            online_issn = issns[journal]["online"]
-            date_range["journal"] = journal
-            items_print = fetch_crossref_metadata(
-                date_from=date_range["date_from"],
-                date_to=date_range["date_to"],
-                issn=print_issn,
-                cache=cache,
-                user_email=user_email,
-                prefix=prefix,
+    load_dotenv()
+    store = open_record_store(proj_dir)
+    harvester = CrossrefHarvester(store, getenv("USER_EMAIL"), max_workers=MAX_WORKERS)
+    manifest = HarvestManifest(proj_dir / "data" / "harvest_manifest.json")
+    if args.incremental:
+        queries = plan_incremental_queries(manifest, issns, date_ranges, DOI_PREFIX)
+    else:
+        if args.plan:
+            plan = HarvestPlan.load(args.plan)
+        else:
+            plan_file = proj_dir / "data" / "harvest_plan.json"
+            saved = None
+            if plan_file.exists() and not args.replan:
+                saved = HarvestPlan.load(plan_file)
+            # Counts only for the journals with years left to plan
+            todo = reusable_queries(saved, issns, date_ranges, DOI_PREFIX)
+            to_count = {j: issns[j] for j, (_, ranges) in todo.items() if ranges}
+            year_counts = fetch_year_counts(
+                harvester, to_count, date_ranges, DOI_PREFIX
+            )
+            plan = plan_harvest(
+                issns,
+                date_ranges,
+                DOI_PREFIX,
+                year_counts,
+                rows=harvester.rows,
+                reuse=saved,
             )
-            if not items_print:
-                msg = f"No print items for {journal} in {date_range}"
-                print(msg)
-            items_online = fetch_crossref_metadata(
-                date_from=date_range["date_from"],
-                date_to=date_range["date_to"],
-                issn=online_issn,
-                cache=cache,
-                user_email=user_email,
-                prefix=prefix,
+            plan.save(plan_file)
+            print(f"Plan written to {plan_file}")
+        print(plan.summary())
+        if args.dry_run:
+            return
+        queries = plan.to_queries()
+
+    counts = harvester.harvest(queries, progress=True)
+    for query, n_items in counts.items():
+        if not n_items:
+            journal, _, issn = queries[query]
+            msg = (
+                f"No items for {journal} ({issn}) in {query.date_from} - "
+                f"{query.date_to}"
             )
-            if not items_online:
-                msg = f"No online items for {journal} in {date_range}"
-                print(msg)
+            print(msg)
 
+    # A full run covers everything up to today as well
+    advance_watermarks(manifest, queries)
+    manifest.save()
+
+    print(harvester.stats.summary())
     print("Got raw abstracts")
+
+
+if __name__ == "__main__":
+    main()
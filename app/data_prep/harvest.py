@@ -0,0 +1,333 @@
+# Concurrent Crossref harvester
+# Runs many (journal, date range) queries in a bounded thread pool that shares one
+# HTTP connection pool and one rate limit, and stores every page in a page store:
+# the record store (data/records.sqlite) or a diskcache
+import threading
+import time
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+
+import requests
+from diskcache import Cache
+from requests.adapters import HTTPAdapter
+
+from app import profiling
+from app.data_prep.record_store import RecordStore
+from app.data_prep.utils import make_hive_cache_key
+
+CROSSREF_URL = "https://api.crossref.org/works"
+SELECT_FIELDS = "DOI,title,author,issued,abstract,container-title"
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+@dataclass(frozen=True)
+class CrossrefQuery:
+    """
+    One Crossref query: a journal (ISSN or DOI prefix) in a date range.
+    `issn` may hold several ISSNs joined by commas, which Crossref ORs.
+    `date_field` is "pub" for the publication date (full harvest) or "index"
+    for the index date, which also moves when a record is updated (incremental).
+    """
+
+    date_from: str
+    date_to: str
+    issn: str | None = None
+    prefix: str | None = None
+    date_field: str = "pub"
+
+    def filters(self) -> list[str]:
+        if self.prefix:
+            key_filters = [f"prefix:{self.prefix}"]
+        elif self.issn:
+            key_filters = [f"issn:{issn}" for issn in self.issn.split(",")]
+        else:
+            raise ValueError("You must supply either an ISSN or a DOI prefix")
+        return [
+            *key_filters,
+            "type:journal-article",
+            f"from-{self.date_field}-date:{self.date_from}",
+            f"until-{self.date_field}-date:{self.date_to}",
+            "has-abstract:true",
+        ]
+
+    def cache_key(self, cursor: str) -> str:
+        fields = dict(
+            issn=self.issn,
+            date_from=self.date_from,
+            date_to=self.date_to,
+            cursor=cursor,
+            prefix=self.prefix,
+        )
+        # Publication date keys stay as they always were
+        if self.date_field != "pub":
+            fields["date_field"] = self.date_field
+        return make_hive_cache_key(**fields)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Parses a Retry-After header, which is either seconds or an HTTP date.
+    Returns the number of seconds to wait, or None if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_rate_limit(headers) -> float | None:
+    """
+    Returns the allowed requests per second from Crossref's
+    X-Rate-Limit-Limit / X-Rate-Limit-Interval headers (e.g. "50" and "1s").
+    """
+    limit = headers.get("X-Rate-Limit-Limit")
+    interval = headers.get("X-Rate-Limit-Interval")
+    if not limit or not interval:
+        return None
+    try:
+        seconds = float(interval.rstrip("s"))
+        return float(limit) / seconds if seconds > 0 else None
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    """Spaces out requests across threads and supports a global pause (Retry-After)"""
+
+    def __init__(self, rate: float = 10.0):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1.0 / self.rate
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def update(self, rate: float | None):
+        if rate:
+            with self._lock:
+                self.rate = rate
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+
+@dataclass
+class HarvestStats:
+    pages_fetched: int = 0
+    cache_hits: int = 0
+    retries: int = 0
+    items: int = 0
+    started: float = field(default_factory=time.perf_counter)
+    finished: float | None = None
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, **counts):
+        with self._lock:
+            for k, v in counts.items():
+                setattr(self, k, getattr(self, k) + v)
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def pages_per_sec(self) -> float:
+        return self.pages_fetched / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"Fetched {self.pages_fetched} pages ({self.cache_hits} from cache, "
+            f"{self.retries} retries, {self.items} items) in {self.elapsed:.1f}s "
+            f"-> {self.pages_per_sec:.2f} pages/sec"
+        )
+
+
+class CrossrefHarvester:
+    """
+    Fetches Crossref queries concurrently and writes each page to the cache under
+    the same `make_hive_cache_key` keys that `fetch_crossref_metadata` always used.
+
+    Args:
+        cache (RecordStore | Cache): Page store to read pages from and write
+            pages to.
+        user_email (str): Sent in the User-Agent and `mailto` for the polite pool.
+        max_workers (int): Size of the thread pool and of the HTTP connection pool.
+        rate (float): Initial requests per second, adjusted from X-Rate-Limit-* headers.
+        max_retries (int): Retries on 429/5xx/connection errors before giving up.
+        backoff (float): Base seconds for exponential backoff if no Retry-After is sent.
+    """
+
+    def __init__(
+        self,
+        cache: RecordStore | Cache,
+        user_email: str,
+        max_workers: int = 8,
+        rate: float = 10.0,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        rows: int = 1000,
+        base_url: str = CROSSREF_URL,
+        timeout: float = 60.0,
+        verbose: bool = False,
+    ):
+        self.cache = cache
+        self.user_email = user_email
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.rows = rows
+        self.base_url = base_url
+        self.timeout = timeout
+        self.verbose = verbose
+        self.limiter = RateLimiter(rate)
+        self.stats = HarvestStats()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["User-Agent"] = (
+            f"MyCrossrefClient/1.0 (mailto:{user_email})"
+        )
+
+    def _get(self, params: dict) -> dict:
+        """GETs one page, honoring rate limits and retrying with exponential backoff"""
+        for attempt in range(self.max_retries + 1):
+            self.limiter.wait()
+            profiling.count(requests=1)
+            try:
+                with profiling.span("harvest.http"):
+                    resp = self.session.get(
+                        self.base_url, params=params, timeout=self.timeout
+                    )
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                self.stats.add(retries=1)
+                profiling.count(retries=1)
+                time.sleep(self.backoff * 2**attempt)
+                continue
+
+            self.limiter.update(parse_rate_limit(resp.headers))
+            if self.verbose:
+                print("REQUEST ▶", resp.url)
+                print("STATUS  ▶", resp.status_code)
+                print("HEADERS ▶", resp.headers.get("Retry-After", "none"))
+                print("BODY    ▶", resp.text[:200], "…")
+
+            if resp.status_code in RETRY_STATUS and attempt < self.max_retries:
+                delay = parse_retry_after(resp.headers.get("Retry-After"))
+                if delay is None:
+                    delay = self.backoff * 2**attempt
+                if resp.status_code == 429:
+                    # Everybody waits, not only this thread
+                    self.limiter.pause(delay)
+                self.stats.add(retries=1)
+                profiling.count(retries=1)
+                time.sleep(delay)
+                continue
+
+            resp.raise_for_status()
+            with profiling.span("harvest.decode"):
+                return resp.json()["message"]
+
+        raise RuntimeError("unreachable")
+
+    def fetch(self, query: CrossrefQuery) -> list[dict]:
+        """Fetches all pages of a query (following the cursor), using the cache"""
+        params = {
+            "filter": ",".join(query.filters()),
+            "rows": self.rows,
+            "select": SELECT_FIELDS,
+            "sort": "published",
+            "order": "desc",
+            "mailto": self.user_email,
+            "cursor": "*",
+        }
+
+        all_items = []
+        while True:
+            cache_key = query.cache_key(params["cursor"])
+            with profiling.span("harvest.cache_read"):
+                data = self.cache.get(cache_key)
+            if data is not None:
+                self.stats.add(cache_hits=1)
+                profiling.count(cache_hits=1)
+            else:
+                data = self._get(params)
+                with profiling.span("harvest.cache_write"):
+                    self.cache[cache_key] = data
+                self.stats.add(pages_fetched=1)
+                profiling.count(cache_misses=1)
+
+            items = data.get("items", [])
+            profiling.count(items=len(items))
+            all_items.extend(items)
+
+            if len(items) < params["rows"]:
+                break
+
+            params["cursor"] = data["next-cursor"]
+
+        self.stats.add(items=len(all_items))
+        return all_items
+
+    def count_by_year(self, query: CrossrefQuery) -> dict[int, int]:
+        """
+        Number of works per publication year that match the query, from one
+        request without items (Crossref's `published` facet)
+        """
+        params = {
+            "filter": ",".join(query.filters()),
+            "rows": 0,
+            "facet": "published:*",
+            "mailto": self.user_email,
+        }
+        message = self._get(params)
+        values = message.get("facets", {}).get("published", {}).get("values", {})
+        return {int(year): n for year, n in values.items()}
+
+    def _count(self, query: CrossrefQuery) -> int:
+        return len(self.fetch(query))
+
+    def harvest(
+        self, queries: Iterable[CrossrefQuery], progress: bool = False
+    ) -> dict[CrossrefQuery, int]:
+        """
+        Runs all queries in the thread pool.
+
+        Returns:
+            Dict[CrossrefQuery, int]: Number of items per query. Items themselves
+            are only kept in the cache.
+        """
+        queries = list(queries)
+        self.stats = HarvestStats()
+        counts = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            # Workers return counts: a future holding the items of its query
+            # until the harvest ends would keep the whole corpus in memory
+            futures = {pool.submit(self._count, q): q for q in queries}
+            done = as_completed(futures)
+            if progress:
+                from tqdm import tqdm
+
+                done = tqdm(done, total=len(futures))
+            for fut in done:
+                counts[futures.pop(fut)] = fut.result()
+        self.stats.finished = time.perf_counter()
+        return counts
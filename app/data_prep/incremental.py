@@ -0,0 +1,98 @@
+# Incremental harvesting
+# Keeps a high-water mark per journal and ISSN so that a refresh only asks Crossref
+# for records indexed (i.e. added or updated) since the last successful run
+import json
+import os
+from datetime import date
+from pathlib import Path
+
+from app.data_prep.harvest import CrossrefQuery
+
+
+class HarvestManifest:
+    """
+    JSON manifest of the last harvested index date per journal and ISSN:
+    {"Econometrica": {"0012-9682": "2025-05-01", ...}, ...}
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        if self.path.exists():
+            self.watermarks = json.loads(self.path.read_text())
+        else:
+            self.watermarks = {}
+
+    def get(self, journal: str, issn: str) -> str | None:
+        return self.watermarks.get(journal, {}).get(issn)
+
+    def set(self, journal: str, issn: str, watermark: str):
+        self.watermarks.setdefault(journal, {})[issn] = watermark
+
+    def save(self):
+        """Writes the manifest atomically"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.watermarks, indent=2, sort_keys=True))
+        os.replace(tmp, self.path)
+
+
+def plan_incremental_queries(
+    manifest: HarvestManifest,
+    issns: dict,
+    date_ranges: list[dict],
+    prefixes: dict | None = None,
+    today: date | None = None,
+) -> dict[CrossrefQuery, tuple[str, str, str]]:
+    """
+    Plans the queries for an incremental run.
+
+    ISSNs with a watermark get a single delta query on the index date
+    (from the watermark until today); ISSNs without one get the full
+    publication date backfill over `date_ranges`.
+
+    Returns:
+        Dict mapping each query to (journal, kind, issn), kind being "print"/"online".
+    """
+    prefixes = prefixes or {}
+    today = (today or date.today()).isoformat()
+
+    queries = {}
+    for journal, kinds in issns.items():
+        prefix = prefixes.get(journal)
+        for kind, issn in kinds.items():
+            watermark = manifest.get(journal, issn)
+            if watermark:
+                query = CrossrefQuery(
+                    date_from=watermark,
+                    date_to=today,
+                    issn=issn,
+                    prefix=prefix,
+                    date_field="index",
+                )
+                queries[query] = (journal, kind, issn)
+                continue
+            for date_range in date_ranges:
+                query = CrossrefQuery(
+                    date_from=date_range["date_from"],
+                    date_to=date_range["date_to"],
+                    issn=issn,
+                    prefix=prefix,
+                )
+                queries[query] = (journal, kind, issn)
+
+    return queries
+
+
+def advance_watermarks(
+    manifest: HarvestManifest,
+    queries: dict[CrossrefQuery, tuple[str, str, str]],
+    today: date | None = None,
+):
+    """
+    Moves the watermark of every harvested (journal, ISSN) to today. Queries
+    of several ISSNs (joined by commas) advance each of them.
+    """
+    today = (today or date.today()).isoformat()
+    for journal, _, issns in queries.values():
+        for issn in issns.split(","):
+            manifest.set(journal, issn, today)
@@ -0,0 +1,316 @@
+# Near-duplicate abstracts with MinHash and LSH
+# process_data drops exact duplicates (same DOI, same title and abstract), but the
+# same paper with different JATS markup or whitespace, or from the print and the
+# online feed under two DOIs, survives and is embedded and retrieved twice.
+# Abstracts are compared by the Jaccard similarity of their word shingles, which
+# MinHash signatures estimate. LSH banding only pairs rows that agree on a whole
+# band of their signatures, so the work grows with the rows, not with their pairs
+# * minhash_signatures: shingles hashed by polars, MinHashes by numpy, in threads
+# * candidate_pairs: rows that share a bucket in any band
+# * find_near_duplicates: verified pairs -> clusters -> one canonical row each
+# * remove_near_duplicates: the same for abstracts_clean.parquet, in place
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from app import profiling
+
+# Words per shingle; small edits change few shingles of 3 words
+SHINGLE_SIZE = 3
+NUM_PERM = 128
+# 16 bands of 8 values: pairs from a Jaccard similarity of about 0.7 become
+# candidates, (1 / 16) ** (1 / 8)
+BANDS = 16
+THRESHOLD = 0.8
+# Rows hashed at once; their shingles x NUM_PERM hash values are held in memory
+BLOCK_ROWS = 512
+# Rows per task of the thread pool, one row group of abstracts_clean.parquet
+CHUNK_ROWS = 10_000
+
+
+@dataclass
+class NearDuplicateStats:
+    rows: int = 0
+    candidate_pairs: int = 0
+    similar_pairs: int = 0
+    # Clusters of two or more rows
+    clusters: int = 0
+    removed: int = 0
+    largest_cluster: int = 0
+    seconds: float = 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.removed} near-duplicates removed from {self.rows} rows: "
+            f"{self.clusters} clusters (largest {self.largest_cluster}), "
+            f"{self.similar_pairs} of {self.candidate_pairs} candidate pairs "
+            f"similar, {self.seconds:.1f}s"
+        )
+
+
+def _hash_params(num_perm: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Multipliers and offsets of h(x) = (a * x + b) mod 2**32. With an odd `a`
+    each function permutes the 32-bit shingle hashes, which are random already.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 2**32, (num_perm, 1), dtype=np.uint32) | 1
+    b = rng.integers(0, 2**32, (num_perm, 1), dtype=np.uint32)
+    return a, b
+
+
+def shingle_hashes(texts: pl.Series, shingle_size: int = SHINGLE_SIZE) -> pl.Series:
+    """
+    32-bit hashes of the word shingles of space separated tokens. Texts with
+    fewer words than a shingle are one shingle; empty texts have none.
+    """
+    words = (
+        texts.fill_null("")
+        .str.split(" ")
+        .list.eval(pl.element().filter(pl.element() != ""))
+    )
+    shingles = words.list.eval(
+        pl.concat_str(
+            [pl.element().shift(-i) for i in range(shingle_size)], separator=" "
+        ).drop_nulls()
+    )
+    short = words.list.join(" ")
+    shingles = (
+        pl.select(
+            pl.when((shingles.list.len() == 0) & (short != ""))
+            .then(pl.concat_list(short))
+            .otherwise(shingles)
+        )
+        .to_series()
+        .list.eval(pl.element().hash())
+    )
+    # Folded to 32 bits
+    return shingles.list.eval((pl.element() ^ (pl.element() // 2**32)) % 2**32)
+
+
+def minhash_signatures(
+    texts: pl.Series,
+    num_perm: int = NUM_PERM,
+    shingle_size: int = SHINGLE_SIZE,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    MinHash signatures of tokenized texts, one row of `num_perm` uint32 values
+    per text. A text without shingles gets the maximum value everywhere.
+    """
+    a, b = _hash_params(num_perm, seed)
+    signatures = np.full((len(texts), num_perm), np.iinfo(np.uint32).max, np.uint32)
+    for start in range(0, len(texts), BLOCK_ROWS):
+        hashes = shingle_hashes(texts.slice(start, BLOCK_ROWS), shingle_size)
+        lengths = hashes.list.len().to_numpy().astype(np.int64)
+        values = hashes.explode().drop_nulls().to_numpy().astype(np.uint32)
+        if not len(values):
+            continue
+        # One row per hash function, so that the minimum over the shingles of a
+        # text reduces contiguous memory
+        hashed = a * values
+        hashed += b
+        has_shingles = lengths > 0
+        starts = (np.cumsum(lengths) - lengths)[has_shingles]
+        rows = start + np.flatnonzero(has_shingles)
+        signatures[rows] = np.minimum.reduceat(hashed, starts, axis=1).T
+    return signatures
+
+
+def parallel_signatures(
+    texts: pl.Series | Path,
+    column: str = "tokenized_abstract",
+    num_perm: int = NUM_PERM,
+    shingle_size: int = SHINGLE_SIZE,
+    n_threads: int | None = None,
+) -> np.ndarray:
+    """
+    `minhash_signatures` of a Series or of a column of a Parquet file, a chunk
+    of rows per thread; polars and numpy run without the GIL
+    """
+    if isinstance(texts, pl.Series):
+        n_rows = len(texts)
+
+        def read(start: int) -> pl.Series:
+            return texts.slice(start, CHUNK_ROWS)
+    else:
+        n_rows = pl.scan_parquet(texts).select(pl.len()).collect().item()
+
+        def read(start: int) -> pl.Series:
+            chunk = pl.scan_parquet(texts).select(column).slice(start, CHUNK_ROWS)
+            return chunk.collect()[column]
+
+    def signatures(start: int) -> np.ndarray:
+        return minhash_signatures(read(start), num_perm, shingle_size)
+
+    n_threads = n_threads or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        chunks = list(pool.map(signatures, range(0, n_rows, CHUNK_ROWS)))
+    return np.concatenate(chunks) if chunks else np.empty((0, num_perm), np.uint32)
+
+
+def candidate_pairs(signatures: np.ndarray, bands: int = BANDS) -> np.ndarray:
+    """
+    Pairs of rows (i < j) whose signatures are equal in at least one band.
+    Each bucket links its rows to its first row, so a bucket of k rows gives
+    k - 1 pairs and the clusters are still connected.
+    """
+    _, num_perm = signatures.shape
+    if num_perm % bands:
+        raise ValueError(f"{bands} bands do not divide {num_perm} hash values")
+    width = num_perm // bands
+    # Rows without shingles are nobody's duplicate
+    rows = np.flatnonzero((signatures != np.iinfo(np.uint32).max).any(axis=1))
+    pairs = []
+    for band in range(bands):
+        block = signatures[rows, band * width : (band + 1) * width].astype(np.uint64)
+        key = block[:, 0]
+        for j in range(1, width):
+            key = key * np.uint64(0x100000001B3) ^ block[:, j]
+        buckets = (
+            pl.DataFrame({"key": key, "row": rows})
+            .group_by("key")
+            .agg(pl.col("row").min().alias("first"), "row")
+            .filter(pl.col("row").list.len() > 1)
+            .explode("row")
+            .filter(pl.col("row") != pl.col("first"))
+        )
+        pairs.append(buckets.select("first", "row"))
+    if not pairs:
+        return np.empty((0, 2), np.int64)
+    return pl.concat(pairs).unique().sort("first", "row").to_numpy().astype(np.int64)
+
+
+def similarities(signatures: np.ndarray, pairs: np.ndarray) -> np.ndarray:
+    """Estimated Jaccard similarity of each pair: the share of equal MinHashes"""
+    out = np.empty(len(pairs), np.float32)
+    for start in range(0, len(pairs), 100_000):
+        i, j = pairs[start : start + 100_000].T
+        out[start : start + len(i)] = (signatures[i] == signatures[j]).mean(axis=1)
+    return out
+
+
+def find_near_duplicates(
+    df: pl.DataFrame,
+    signatures: np.ndarray,
+    threshold: float = THRESHOLD,
+    bands: int = BANDS,
+) -> tuple[pl.DataFrame, NearDuplicateStats]:
+    """
+    Clusters the rows of `df` whose similarity chains reach `threshold` and
+    picks the canonical row of each cluster: a row with a DOI first, then one
+    whose Crossref journal is the journal queried, then the first row.
+
+    Args:
+        df (pl.DataFrame): doi, journal and desired_journal of each row.
+        signatures (np.ndarray): MinHash signatures of the rows.
+
+    Returns:
+        pl.DataFrame: row, cluster, canonical (row index) and keep of each row
+            in a cluster of two or more rows.
+        NearDuplicateStats: Counts of the pairs and clusters.
+    """
+    start = time.perf_counter()
+    n_rows = len(signatures)
+    with profiling.span("near_duplicates.lsh"):
+        pairs = candidate_pairs(signatures, bands)
+    with profiling.span("near_duplicates.verify"):
+        similar = pairs[similarities(signatures, pairs) >= threshold]
+    graph = sparse.coo_matrix(
+        (np.ones(len(similar), np.int8), (similar[:, 0], similar[:, 1])),
+        shape=(n_rows, n_rows),
+    )
+    _, labels = connected_components(graph, directed=False)
+    sizes = np.bincount(labels)
+    in_cluster = np.flatnonzero(sizes[labels] > 1)
+    clusters = (
+        df[in_cluster]
+        .select(
+            pl.Series("row", in_cluster),
+            pl.Series("cluster", labels[in_cluster]),
+            (pl.col("doi").fill_null("") != "").alias("has_doi"),
+            (pl.col("journal") == pl.col("desired_journal"))
+            .fill_null(False)
+            .alias("journal_match"),
+        )
+        .sort(
+            "cluster",
+            "has_doi",
+            "journal_match",
+            "row",
+            descending=[False, True, True, False],
+        )
+        .with_columns(pl.col("row").first().over("cluster").alias("canonical"))
+        .with_columns((pl.col("row") == pl.col("canonical")).alias("keep"))
+        .select("row", "cluster", "canonical", "keep")
+    )
+    n_clusters = int((sizes > 1).sum())
+    stats = NearDuplicateStats(
+        rows=n_rows,
+        candidate_pairs=len(pairs),
+        similar_pairs=len(similar),
+        clusters=n_clusters,
+        removed=len(in_cluster) - n_clusters,
+        largest_cluster=int(sizes.max()) if n_clusters else 0,
+        seconds=time.perf_counter() - start,
+    )
+    return clusters, stats
+
+
+def remove_near_duplicates(
+    parquet_file: Path,
+    clusters_file: Path | None = None,
+    threshold: float = THRESHOLD,
+    n_threads: int | None = None,
+) -> NearDuplicateStats:
+    """
+    Keeps one row per near-duplicate cluster of abstracts_clean.parquet,
+    comparing `tokenized_abstract`. The file is rewritten in place.
+
+    Args:
+        parquet_file (Path): The output of `process_data.sink_clean_abstracts`.
+        clusters_file (Path, optional): Where to write the clusters (row,
+            cluster, canonical, keep, doi, title) for inspection.
+        threshold (float): Least estimated Jaccard similarity of a pair.
+        n_threads (int, optional): Threads computing signatures, all cores
+            by default.
+    """
+    from app.data_prep.process_data import ROW_GROUP_SIZE
+
+    start = time.perf_counter()
+    parquet_file = Path(parquet_file)
+    with profiling.span("near_duplicates.minhash"):
+        signatures = parallel_signatures(parquet_file, n_threads=n_threads)
+    keys = pl.read_parquet(
+        parquet_file, columns=["doi", "title", "journal", "desired_journal"]
+    )
+    clusters, stats = find_near_duplicates(keys, signatures, threshold)
+    stats.seconds = time.perf_counter() - start
+    profiling.count(**{f"near_duplicates_{k}": v for k, v in asdict(stats).items()})
+    if clusters_file is not None:
+        tmp = Path(clusters_file).with_suffix(".tmp.parquet")
+        clusters.with_columns(
+            keys[clusters["row"]].select("doi", "title")
+        ).write_parquet(tmp)
+        os.replace(tmp, clusters_file)
+    if not stats.removed:
+        return stats
+
+    dropped = clusters.filter(~pl.col("keep")).select(pl.col("row").cast(pl.UInt32))
+    tmp = parquet_file.with_suffix(".tmp.parquet")
+    (
+        pl.scan_parquet(parquet_file)
+        .with_row_index("row")
+        .join(dropped.lazy(), on="row", how="anti", maintain_order="left")
+        .drop("row")
+        .sink_parquet(tmp, row_group_size=ROW_GROUP_SIZE, engine="streaming")
+    )
+    os.replace(tmp, parquet_file)
+    return stats
@@ -0,0 +1,177 @@
+# Streams cached Crossref pages into a hive-partitioned Parquet dataset
+# data/raw/journal=<journal>/year=<year>/part-<hash>.parquet
+# One page is held in memory at a time, so peak memory does not grow with the corpus
+# The record store (`RecordStore`) is read the same way, a batch of records at a time
+import hashlib
+import os
+import shutil
+from collections.abc import Iterator
+from pathlib import Path
+
+import polars as pl
+from diskcache import Cache
+
+from app import profiling
+from app.data_prep.process_data import (
+    cache_key_order,
+    parse_crossref_page,
+    read_crossref_items,
+    select_crossref_fields,
+)
+from app.data_prep.record_store import RecordStore
+from app.data_prep.utils import (
+    get_journals_by_issn,
+    journal_for_issn,
+    make_hive_cache_key,
+    parse_hive_cache_key,
+)
+
+# Stored in the files; journal and year are encoded in the directory names
+RAW_SCHEMA = {
+    "title": pl.String,
+    "doi": pl.String,
+    "authors": pl.List(pl.String),
+    "abstract": pl.String,
+    "desired_journal": pl.String,
+    "harvested_until": pl.String,
+}
+# Hive partitions can't hold nulls reliably, so a missing year is stored as 0
+NULL_YEAR = 0
+
+
+def make_hive_path(**kwargs) -> Path:
+    """Like `make_hive_cache_key`, but as nested directories: a=1/b=2"""
+    return Path(*make_hive_cache_key(**kwargs).split("|"))
+
+
+def page_file_name(cache_key: str) -> str:
+    """Deterministic file name per cache page so re-runs overwrite instead of duplicate"""
+    digest = hashlib.sha1(cache_key.encode()).hexdigest()[:16]
+    return f"part-{digest}.parquet"
+
+
+def page_to_frame(page: dict, cache_key: str, journal: str) -> pl.DataFrame:
+    """
+    Parses one cached Crossref page. `harvested_until` is set for incremental
+    (index date) pages so that later updates can win when merging by DOI.
+    """
+    key = parse_hive_cache_key(cache_key)
+    is_delta = key.get("date_field", "pub") != "pub"
+    harvested_until = key["date_to"] if is_delta else None
+    return _raw_columns(parse_crossref_page(page, journal), harvested_until)
+
+
+def _raw_columns(
+    df: pl.DataFrame, harvested_until: str | pl.Series | None
+) -> pl.DataFrame:
+    return df.with_columns(
+        pl.lit(harvested_until, pl.String).alias("harvested_until"),
+        # Fall back to the journal we asked for if Crossref has no container-title
+        pl.when(pl.col("journal") == "")
+        .then(pl.col("desired_journal"))
+        .otherwise(pl.col("journal"))
+        .alias("journal"),
+        pl.col("year").fill_null(NULL_YEAR),
+    )
+
+
+def write_page(df: pl.DataFrame, out_dir: Path, cache_key: str) -> list[Path]:
+    """Writes the rows of one page into their journal/year partitions"""
+    paths = []
+    file_name = page_file_name(cache_key)
+    for (journal, year), part in df.group_by("journal", "year"):
+        part_dir = Path(out_dir) / make_hive_path(journal=journal, year=year)
+        part_dir.mkdir(parents=True, exist_ok=True)
+        path = part_dir / file_name
+        tmp = path.with_suffix(".tmp")
+        part.select(RAW_SCHEMA).write_parquet(tmp)
+        os.replace(tmp, path)
+        paths.append(path)
+    return paths
+
+
+def iter_cache_pages(cache: Cache) -> Iterator[tuple[str, dict]]:
+    """Yields (key, page) one at a time, full harvest pages first"""
+    for key in sorted(cache.iterkeys(), key=cache_key_order):
+        yield key, cache[key]
+
+
+def stream_cache_to_parquet(
+    cache: Cache, out_dir: Path, journals_by_issn: dict | None = None
+) -> int:
+    """
+    Converts every cached page to Parquet, one page at a time.
+
+    Returns:
+        int: Number of rows written.
+    """
+    journals_by_issn = journals_by_issn or get_journals_by_issn()
+    n_rows = 0
+    for key, page in iter_cache_pages(cache):
+        journal = journal_for_issn(journals_by_issn, parse_hive_cache_key(key)["issn"])
+        df = page_to_frame(page, key, journal)
+        if df.is_empty():
+            continue
+        write_page(df, out_dir, key)
+        n_rows += df.height
+    return n_rows
+
+
+def stream_records_to_parquet(
+    store: RecordStore,
+    out_dir: Path,
+    journals_by_issn: dict | None = None,
+    batch_size: int = 10_000,
+) -> int:
+    """
+    Converts every record of the store to Parquet, one batch at a time. Each
+    DOI is stored once, so nothing is parsed twice. The dataset is written
+    next to `out_dir` and then replaces it.
+
+    Returns:
+        int: Number of rows written.
+    """
+    journals_by_issn = journals_by_issn or get_journals_by_issn()
+    out_dir = Path(out_dir)
+    tmp_dir = out_dir.with_name(f"{out_dir.name}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    n_rows = 0
+    for i, batch in enumerate(store.iter_records(batch_size)):
+        with profiling.span("raw.parse"):
+            # One JSON array per batch, parsed by polars
+            json_array = b"[" + b",".join(r.item for r in batch) + b"]"
+            items = read_crossref_items(json_array)
+            journals = [journal_for_issn(journals_by_issn, r.issn) for r in batch]
+            df = select_crossref_fields(items).with_columns(
+                pl.Series("desired_journal", journals, pl.String)
+            )
+            until = pl.Series([r.harvested_until for r in batch], dtype=pl.String)
+        with profiling.span("raw.write"):
+            write_page(_raw_columns(df, until), tmp_dir, f"records-{i}")
+        profiling.count(raw_batches=1, raw_rows=df.height)
+        n_rows += df.height
+    old_dir = out_dir.with_name(f"{out_dir.name}.old")
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if out_dir.exists():
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return n_rows
+
+
+def scan_raw(out_dir: Path) -> pl.LazyFrame:
+    """
+    Lazily scans the raw dataset. Filters on journal/year prune whole directories.
+    Note that a missing year shows up as NULL_YEAR.
+    """
+    return pl.scan_parquet(Path(out_dir) / "**" / "*.parquet", hive_partitioning=True)
+
+
+if __name__ == "__main__":
+    proj_dir = Path(__file__).parents[2]
+    cache = Cache(proj_dir / "data" / "cache")
+    out_dir = proj_dir / "data" / "raw"
+    n_rows = stream_cache_to_parquet(cache, out_dir)
+    print(f"Wrote {n_rows} rows to {out_dir}")
+    print(scan_raw(out_dir).group_by("journal").len().collect())
@@ -0,0 +1,331 @@
+# Harvest planner
+# A full harvest used to send one query series per journal, year and ISSN: print
+# and online ISSN return mostly the same articles, and prefix journals (JPE) sent
+# the identical prefix query twice. The planner sends one query per journal and
+# date window that filters on all ISSNs of the journal (issn:a,issn:b, which
+# Crossref ORs), and sizes the windows from the number of works per year:
+# * sparse years are packed into one window that fits a single page
+# * dense years are split, so that their pages are fetched concurrently
+# The plan is saved as JSON (data/harvest_plan.json) to be read, or rerun, before
+# anything is fetched: econ-rag harvest --dry-run, econ-rag harvest --plan FILE
+# Windows are part of the cache keys of their pages, so the next full harvest
+# reuses the saved windows of years that had ended when they were planned and
+# only plans the years they do not cover (the current year, new journals, an
+# earlier start year). Counts of past years still move as Crossref indexes late
+# works; re-packing them would shift every window and refetch every page. The
+# current year is never packed with past years, so its window can not hold them.
+import json
+import math
+import os
+from dataclasses import asdict, dataclass
+from datetime import date
+from pathlib import Path
+
+import requests
+
+from app.data_prep.harvest import CrossrefHarvester, CrossrefQuery
+
+# A dense year is split when it needs more pages than this
+MAX_PAGES_PER_WINDOW = 4
+
+
+@dataclass(frozen=True)
+class PlannedQuery:
+    journal: str
+    query: CrossrefQuery
+    # Works expected from the year counts, None if they are unknown
+    expected_items: int | None = None
+
+
+def pages_needed(n_items: int | None, rows: int) -> int:
+    """
+    Requests for a query of n items: the harvester stops at the first page
+    with fewer than `rows` items, which may be empty
+    """
+    return 1 if n_items is None else n_items // rows + 1
+
+
+def split_year(date_range: dict, parts: int) -> list[tuple[str, str]]:
+    """Splits a year into `parts` (at most 12) windows of whole months"""
+    year, parts = date_range["year"], min(parts, 12)
+    starts = [1 + i * 12 // parts for i in range(parts)]
+    windows = []
+    for i, month in enumerate(starts):
+        date_from = date(year, month, 1).isoformat()
+        if i + 1 < parts:
+            next_month = date(year, starts[i + 1], 1)
+            date_to = date.fromordinal(next_month.toordinal() - 1).isoformat()
+        else:
+            date_to = date_range["date_to"]
+        if date_from <= date_range["date_to"]:
+            windows.append((date_from, min(date_to, date_range["date_to"])))
+    return windows
+
+
+def plan_windows(
+    date_ranges: list[dict],
+    year_counts: dict[int, int] | None,
+    rows: int = 1000,
+    max_pages: int = MAX_PAGES_PER_WINDOW,
+) -> list[tuple[str, str, int | None]]:
+    """
+    Date windows that cover `date_ranges` without gaps.
+
+    Consecutive whole years are merged while their works fit in one page (fewer
+    than `rows`); a year that has not ended (date_to before Dec 31) is not. A
+    year with more than `max_pages` pages of works is split into windows of
+    whole months. Without counts every year is its own window.
+
+    Returns:
+        list[tuple[str, str, int | None]]: (date_from, date_to, expected items)
+    """
+    windows = []
+    pending = None
+    for i, date_range in enumerate(date_ranges):
+        n = None if year_counts is None else year_counts.get(date_range["year"], 0)
+        # Only whole years that follow the pending window are merged into it
+        mergeable = (
+            i > 0
+            and date_range["year"] == date_ranges[i - 1]["year"] + 1
+            and date_range["date_to"] == f"{date_range['year']}-12-31"
+        )
+        if pending and mergeable and n is not None and pending[2] + n < rows:
+            pending = (pending[0], date_range["date_to"], pending[2] + n)
+            continue
+        if pending:
+            windows.append(pending)
+            pending = None
+        if n is None:
+            windows.append((date_range["date_from"], date_range["date_to"], None))
+        elif n > max_pages * rows:
+            parts = split_year(date_range, math.ceil(n / (max_pages * rows)))
+            windows.extend((a, b, n // len(parts)) for a, b in parts)
+        else:
+            pending = (date_range["date_from"], date_range["date_to"], n)
+    if pending:
+        windows.append(pending)
+    return windows
+
+
+def journal_query(
+    issns: dict[str, str], prefix: str | None, date_from: str, date_to: str
+) -> CrossrefQuery:
+    """One query for all ISSNs of a journal (print, online), or for its prefix"""
+    return CrossrefQuery(
+        date_from=date_from,
+        date_to=date_to,
+        issn=",".join(dict.fromkeys(issns.values())),
+        prefix=prefix,
+    )
+
+
+def _source(query: CrossrefQuery) -> str:
+    """What a query filters on besides dates, see `CrossrefQuery.filters`"""
+    return f"prefix:{query.prefix}" if query.prefix else f"issn:{query.issn}"
+
+
+def _months(date_from: str, date_to: str) -> set[tuple[int, int]]:
+    start, end = date.fromisoformat(date_from), date.fromisoformat(date_to)
+    return {
+        (year, month)
+        for year in range(start.year, end.year + 1)
+        for month in range(1, 13)
+        if (start.year, start.month) <= (year, month) <= (end.year, end.month)
+    }
+
+
+def reusable_queries(
+    plan: "HarvestPlan | None",
+    issns: dict,
+    date_ranges: list[dict],
+    prefixes: dict | None = None,
+) -> dict[str, tuple[list[PlannedQuery], list[dict]]]:
+    """
+    Splits the years of each journal into those covered by saved windows of
+    `plan` and those to plan again. A saved window is reused if it ended before
+    the plan was made, lies within `date_ranges` and all the years it touches
+    are covered by reused windows.
+
+    Returns:
+        dict: {journal: (reused queries, date ranges not covered by them)}
+    """
+    prefixes = prefixes or {}
+    first = date_ranges[0]["date_from"] if date_ranges else ""
+    closed = [
+        p
+        for p in (plan.queries if plan and plan.planned_on else [])
+        if p.query.date_to < plan.planned_on and p.query.date_from >= first
+    ]
+    out = {}
+    for journal, kinds in issns.items():
+        source = _source(journal_query(kinds, prefixes.get(journal), "", ""))
+        mine = [p for p in closed if _source(p.query) == source]
+        months = set().union(
+            *(_months(p.query.date_from, p.query.date_to) for p in mine)
+        )
+        covered = {
+            r["year"]
+            for r in date_ranges
+            if all((r["year"], month) in months for month in range(1, 13))
+        }
+        reused = [
+            p
+            for p in mine
+            if all(
+                year in covered
+                for year, _ in _months(p.query.date_from, p.query.date_to)
+            )
+        ]
+        out[journal] = (reused, [r for r in date_ranges if r["year"] not in covered])
+    return out
+
+
+def fetch_year_counts(
+    harvester: CrossrefHarvester,
+    issns: dict,
+    date_ranges: list[dict],
+    prefixes: dict | None = None,
+) -> dict[str, dict[int, int] | None]:
+    """
+    Works per year of each journal, one request per journal. A journal whose
+    counts cannot be fetched gets None, i.e. yearly windows.
+    """
+    prefixes = prefixes or {}
+    first, last = date_ranges[0]["date_from"], date_ranges[-1]["date_to"]
+    counts = {}
+    for journal, kinds in issns.items():
+        query = journal_query(kinds, prefixes.get(journal), first, last)
+        try:
+            counts[journal] = harvester.count_by_year(query)
+        except requests.RequestException as e:
+            print(f"No year counts for {journal}, planning yearly windows: {e}")
+            counts[journal] = None
+    return counts
+
+
+@dataclass
+class HarvestPlan:
+    """
+    The queries of a full harvest, with the requests they are expected to take
+    and the requests of one query series per ISSN and year (the baseline)
+    """
+
+    queries: list[PlannedQuery]
+    rows: int = 1000
+    # Count requests spent on planning, included in `expected_requests`
+    planning_requests: int = 0
+    # Of the years planned now; reused windows have their pages in the store
+    baseline_requests: int = 0
+    # Day the plan was made (ISO date); windows that ended before are reusable
+    planned_on: str | None = None
+    # Queries taken over from the previous plan
+    reused: int = 0
+
+    @property
+    def expected_requests(self) -> int:
+        return self.planning_requests + sum(
+            pages_needed(q.expected_items, self.rows) for q in self.queries
+        )
+
+    def to_queries(self) -> dict[CrossrefQuery, tuple[str, str, str]]:
+        """Queries mapped to (journal, kind, issn) like `plan_incremental_queries`"""
+        return {p.query: (p.journal, "all", p.query.issn) for p in self.queries}
+
+    def summary(self) -> str:
+        reused = f", {self.reused} reused from the saved plan" if self.reused else ""
+        return (
+            f"{len(self.queries)} queries{reused}, about {self.expected_requests} "
+            f"requests (one query per ISSN and year: about {self.baseline_requests})"
+        )
+
+    def save(self, path: Path):
+        """Writes the plan atomically"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "rows": self.rows,
+            "planned_on": self.planned_on,
+            "planning_requests": self.planning_requests,
+            "baseline_requests": self.baseline_requests,
+            "expected_requests": self.expected_requests,
+            "queries": [
+                {"journal": p.journal, "expected_items": p.expected_items}
+                | asdict(p.query)
+                for p in self.queries
+            ],
+        }
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data, indent=2))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "HarvestPlan":
+        data = json.loads(Path(path).read_text())
+        queries = []
+        for q in data["queries"]:
+            journal, expected = q.pop("journal"), q.pop("expected_items")
+            queries.append(PlannedQuery(journal, CrossrefQuery(**q), expected))
+        return cls(
+            queries,
+            rows=data["rows"],
+            planning_requests=data["planning_requests"],
+            baseline_requests=data["baseline_requests"],
+            planned_on=data.get("planned_on"),
+        )
+
+
+def plan_harvest(
+    issns: dict,
+    date_ranges: list[dict],
+    prefixes: dict | None = None,
+    year_counts: dict[str, dict[int, int] | None] | None = None,
+    rows: int = 1000,
+    max_pages: int = MAX_PAGES_PER_WINDOW,
+    reuse: HarvestPlan | None = None,
+    today: date | None = None,
+) -> HarvestPlan:
+    """
+    Plans a full harvest: per journal, one query per window of `plan_windows`.
+    Queries with the same filters (e.g. two journals under one prefix) are
+    planned once.
+
+    Args:
+        issns (dict): {journal: {"print": issn, "online": issn}}, see `get_issns`.
+        date_ranges (list[dict]): Yearly ranges, see `generate_yearly_date_ranges`.
+        prefixes (dict, optional): {journal: DOI prefix} queried instead of ISSNs.
+        year_counts (dict, optional): {journal: {year: works}}, see
+            `fetch_year_counts`; journals without counts get yearly windows.
+        rows (int): Items per page.
+        max_pages (int): Pages above which a year is split.
+        reuse (HarvestPlan, optional): The previous plan, whose windows of
+            past years are kept (see `reusable_queries`); only the years they
+            do not cover are planned.
+        today (date, optional): Day of the plan, today by default.
+    """
+    prefixes = prefixes or {}
+    year_counts = year_counts or {}
+    planned = {}
+    baseline = 0
+    reused = 0
+    sources = reusable_queries(reuse, issns, date_ranges, prefixes)
+    for journal, kinds in issns.items():
+        kept, ranges = sources[journal]
+        for p in kept:
+            reused += tuple(p.query.filters()) not in planned
+            planned.setdefault(tuple(p.query.filters()), p)
+        counts = year_counts.get(journal)
+        for date_range in ranges:
+            n = None if counts is None else counts.get(date_range["year"], 0)
+            # Each ISSN returns (about) all works of the journal
+            baseline += len(kinds) * pages_needed(n, rows)
+        for date_from, date_to, n in plan_windows(ranges, counts, rows, max_pages):
+            query = journal_query(kinds, prefixes.get(journal), date_from, date_to)
+            planned.setdefault(tuple(query.filters()), PlannedQuery(journal, query, n))
+    return HarvestPlan(
+        list(planned.values()),
+        rows=rows,
+        planning_requests=sum(counts is not None for counts in year_counts.values()),
+        baseline_requests=baseline,
+        planned_on=(today or date.today()).isoformat(),
+        reused=reused,
+    )
@@ -1,16 +1,21 @@
 # Processes the abstracts in a form amendable for RAG
+# Exact duplicates are dropped while cleaning, near-duplicates afterwards (see
+# app.data_prep.near_duplicates)
+import io
+import os
 import re
+from argparse import ArgumentParser
+from concurrent.futures import Executor
+from contextlib import nullcontext
 from pathlib import Path
 
-import nltk
 import polars as pl
-from diskcache import Cache
-from app.data_prep.utils import get_issns, get_journals_by_issn, parse_hive_cache_key
+import pyarrow as pa
 
-from nltk.tokenize import word_tokenize
+from app import profiling
+from app.data_prep.utils import parse_hive_cache_key
 
 proj_dir = Path(__file__).parents[2]
-cache = Cache(proj_dir / "data" / "cache")
 
 
 def parse_crossref_cache_entry(entry: dict, journal: str = None) -> list[dict]:
@@ -32,7 +37,7 @@ def parse_crossref_cache_entry(entry: dict, journal: str = None) -> list[dict]:
 
     results = []
     for item in items:
-        doi = (item.get("DOI") or [""])[0]
+        doi = item.get("DOI") or ""
         title = (item.get("title") or [""])[0]
         year = (item.get("issued", {}).get("date-parts", [[None]])[0] or [None])[0]
         authors = [
@@ -58,8 +63,92 @@ def parse_crossref_cache_entry(entry: dict, journal: str = None) -> list[dict]:
     return results
 
 
+# Raw Crossref fields that the parsers use, as polars nested types
+CROSSREF_ITEM_SCHEMA = {
+    "DOI": pl.String,
+    "title": pl.List(pl.String),
+    "author": pl.List(pl.Struct({"given": pl.String, "family": pl.String})),
+    "issued": pl.Struct({"date-parts": pl.List(pl.List(pl.Int64))}),
+    "abstract": pl.String,
+    "container-title": pl.List(pl.String),
+}
+
+
+CROSSREF_ITEM_TYPE = pa.struct(
+    list(pl.DataFrame(schema=CROSSREF_ITEM_SCHEMA).to_arrow().schema)
+)
+
+
+def read_crossref_items(items: list[dict] | bytes | str) -> pl.DataFrame:
+    """
+    Loads Crossref items into a DataFrame with nested columns (CROSSREF_ITEM_SCHEMA).
+    Python dicts are converted by Arrow in one call, which is several times
+    faster than building a polars DataFrame from dicts. Raw JSON (a JSON array
+    of items) is parsed by polars directly.
+    """
+    if isinstance(items, list):
+        if not items:
+            return pl.DataFrame(schema=CROSSREF_ITEM_SCHEMA)
+        arr = pa.array(items, type=CROSSREF_ITEM_TYPE)
+        return pl.from_arrow(pa.RecordBatch.from_struct_array(arr))
+    if isinstance(items, str):
+        items = items.encode()
+    return pl.read_json(io.BytesIO(items), schema=CROSSREF_ITEM_SCHEMA)
+
+
+def select_crossref_fields(
+    items: pl.DataFrame | pl.LazyFrame, journal: str = None
+) -> pl.DataFrame | pl.LazyFrame:
+    """
+    Columnar version of `parse_crossref_cache_entry`: extracts the same fields
+    from items loaded with `read_crossref_items` using struct/list expressions.
+    """
+    author = pl.element().struct
+    # Like " ".join(filter(None, ...)): empty and missing names are skipped
+    given = pl.when(author.field("given") != "").then(author.field("given"))
+    family = pl.when(author.field("family") != "").then(author.field("family"))
+    return items.select(
+        pl.col("title").list.first().fill_null("").alias("title"),
+        pl.col("issued")
+        .struct.field("date-parts")
+        .list.first()
+        .list.first()
+        .alias("year"),
+        pl.col("DOI").fill_null("").alias("doi"),
+        pl.col("author")
+        .list.eval(pl.concat_str(given, family, separator=" ", ignore_nulls=True))
+        .fill_null(pl.lit([], pl.List(pl.String)))
+        .alias("authors"),
+        pl.col("abstract").fill_null("").alias("abstract"),
+        pl.col("container-title").list.first().fill_null("").alias("journal"),
+        pl.lit(journal, pl.String).alias("desired_journal"),
+    )
+
+
+def parse_crossref_page(entry: dict, journal: str = None) -> pl.DataFrame:
+    """
+    Same as `parse_crossref_cache_entry`, but returns a DataFrame built with
+    polars expressions instead of a Python loop over the items.
+    """
+    if not isinstance(entry, dict):
+        raise ValueError("Cache entry must be a dictionary.")
+    return select_crossref_fields(read_crossref_items(entry.get("items", [])), journal)
+
+
+def cache_key_order(cache_key: str) -> tuple:
+    """
+    Sort key for cache keys: full harvest pages first, then incremental pages
+    by the date they were harvested up to.
+    """
+    data = parse_hive_cache_key(cache_key)
+    is_delta = data.get("date_field", "pub") != "pub"
+    return (is_delta, data.get("date_to", "") if is_delta else "", cache_key)
+
+
 def clean_text(text: str, remove_abstract=False) -> str:
     """Cleans text -> lowers and tokenizes. Needs downloaded corpus"""
+    # nltk takes a second to import, only pay for it when tokenizing
+    from nltk.tokenize import word_tokenize
 
     assert isinstance(text, str)
 
@@ -83,50 +172,206 @@ def clean_text(text: str, remove_abstract=False) -> str:
     return " ".join(tokens[start:])
 
 
-if __name__ == "__main__":
-    nltk.download("punkt")
-    keys = list(cache)
-    issns = get_issns()
-    issns_inv = get_journals_by_issn()
-
-    dfs = []
-    for k in keys:
-        # Figure out journal
-        print(k)
-        data = parse_hive_cache_key(k)
-        journal = issns_inv[data["issn"]]
-        v = cache[k]
-        vp = parse_crossref_cache_entry(v, journal)
-
-        tmp = pl.DataFrame(vp)
-        if not tmp.is_empty():
-            dfs.append(tmp)
-
-    df = pl.concat(dfs)
-    df = df.sort("journal", "year").filter(
-        pl.col("authors").list.len() > 0, pl.col("abstract") != ""
-    )
+JOURNAL_NAMES = {"The Review of Economic Studies": "Review of Economic Studies"}
+# The Parquet sink holds a row group in memory until it is written
+ROW_GROUP_SIZE = 10_000
+
 
-    df = df.with_columns(
-        pl.col("abstract").alias("abstract_original"),
-        pl.col("abstract")
-        .str.replace_all(r"<[^>]+>", "")
+def strip_abstract(expr: pl.Expr) -> pl.Expr:
+    """Removes tags and a leading "Abstract" heading"""
+    return (
+        expr.str.replace_all(r"<[^>]+>", "")
         .str.strip_chars()
         .str.replace(r"^\s*Abstract\b", "")
         .str.replace(r"^\s*Abstract", "")
-        .str.replace(r"^\s*ABSTRACT\b", ""),
+        .str.replace(r"^\s*ABSTRACT\b", "")
+    )
+
+
+def kept_rows(raw: pl.LazyFrame) -> pl.DataFrame:
+    """
+    Row indices of `raw` that survive deduplication: per DOI the row of the
+    latest incremental page (or the last full harvest row), then the first row
+    of each distinct title and cleaned abstract. Rows without a DOI are not
+    versions of one another and only go through the second step. Only small
+    key columns are collected, and abstracts are compared by hash.
+    """
+    keys = (
+        raw.with_row_index("row")
+        .select(
+            "row",
+            # Records without a DOI are each their own key
+            pl.when(pl.col("doi") != "")
+            .then(pl.format("doi:{}", "doi"))
+            .otherwise(pl.format("row:{}", "row"))
+            .alias("doi"),
+            # Full harvest pages (null) lose against any incremental page
+            pl.col("harvested_until").fill_null(""),
+            ((pl.col("authors").list.len() > 0) & (pl.col("abstract") != "")).alias(
+                "usable"
+            ),
+            pl.format("{}\n{}", "title", strip_abstract(pl.col("abstract")))
+            .hash()
+            .alias("abstract_hash"),
+        )
+        .collect(engine="streaming")
+    )
+    return (
+        keys.sort("harvested_until", "row")
+        .group_by("doi")
+        .agg(pl.all().last())
+        # The latest record of a DOI is dropped if it lacks authors or abstract
+        .filter("usable")
+        .group_by("abstract_hash")
+        .agg(pl.col("row").min())
+        .select("row")
+    )
+
+
+def clean_abstracts(
+    raw: pl.LazyFrame, tokenizer: str = "nltk", pool: Executor | None = None
+) -> pl.LazyFrame:
+    """
+    The cleaning as one lazy plan from the raw dataset (see
+    `parquet_sink.scan_raw`) to the rows of abstracts_clean.parquet. Duplicates
+    are resolved first on key columns (`kept_rows`), so the plan has no sort or
+    unique over the abstracts: the streaming engine cleans and tokenizes
+    batches of rows and polars fuses the string operations.
+
+    Args:
+        raw (pl.LazyFrame): Raw rows, incremental pages included.
+        tokenizer (str): "nltk" for the exact `clean_texts_parallel`, which
+            runs batches through Python, or "regex" for the faster
+            `clean_text_expr`. Its sentence splitting only approximates punkt,
+            so a few abstracts tokenize differently (experiments/check_clean_text).
+        pool (Executor, optional): Process pool of the nltk tokenizer for all
+            batches (see `clean_pool`); without one, every batch starts its own.
+
+    Returns:
+        pl.LazyFrame: One row per DOI and abstract, in the order of the raw
+            dataset, i.e. by journal and year partition.
+    """
+    from app.data_prep.clean import clean_text_expr, clean_texts_parallel
+    from app.data_prep.parquet_sink import NULL_YEAR
+
+    if tokenizer == "nltk":
+        tokenized = pl.col("abstract").map_batches(
+            lambda s: pl.Series(
+                clean_texts_parallel(s.to_list(), remove_abstract=True, pool=pool),
+                dtype=pl.String,
+            ),
+            return_dtype=pl.String,
+            is_elementwise=True,
+        )
+    else:
+        tokenized = clean_text_expr("abstract", remove_abstract=True)
+
+    keep = kept_rows(raw).lazy()
+    return (
+        raw.with_row_index("row")
+        .join(keep, on="row", how="semi", maintain_order="left")
+        .select(
+            "title",
+            pl.col("year").replace(NULL_YEAR, None),
+            "doi",
+            "authors",
+            strip_abstract(pl.col("abstract")),
+            pl.col("journal").replace(JOURNAL_NAMES),
+            "desired_journal",
+            pl.col("abstract").alias("abstract_original"),
+        )
+        .with_columns(tokenized.alias("tokenized_abstract"))
+        .with_columns(pl.format("{}\n{}", "title", "abstract").alias("abstract"))
+    )
+
+
+def sink_clean_abstracts(
+    raw: pl.LazyFrame, out_file: Path, tokenizer: str = "nltk"
+) -> Path:
+    """
+    Runs `clean_abstracts` with the streaming engine straight into a Parquet
+    file; the nltk tokenizer starts its process pool once for the run
+    """
+    from app.data_prep.clean import clean_pool
+
+    out_file = Path(out_file)
+    tmp = out_file.with_suffix(".tmp.parquet")
+    with clean_pool() if tokenizer == "nltk" else nullcontext() as pool:
+        clean_abstracts(raw, tokenizer, pool).sink_parquet(
+            tmp, row_group_size=ROW_GROUP_SIZE, engine="streaming"
+        )
+    os.replace(tmp, out_file)
+    return out_file
+
+
+def main(argv: list[str] | None = None):
+    """Cleans the harvested abstracts into abstracts_clean.parquet"""
+    parser = ArgumentParser(description="Clean abstracts into abstracts_clean.parquet")
+    parser.add_argument(
+        "--tokenizer",
+        choices=["regex", "nltk"],
+        default="nltk",
+        help="nltk: exact, on all cores; regex: faster polars port of the nltk "
+        "tokenizer, whose sentence splitting only approximates punkt",
     )
-    df = df.with_columns(
-        pl.col("abstract")
-        .map_elements(lambda x: clean_text(x, True), return_dtype=str)
-        .alias("tokenized_abstract"),
-        pl.col("journal")
-        .replace("The Review of Economic Studies", "Review of Economic Studies")
-        .alias("journal"),
-    ).with_columns(pl.format("{}\n{}", "title", "abstract").alias("abstract"))
-    df = df.unique(subset=["abstract"])
-    counts = df.group_by("journal", "desired_journal").len()
+    parser.add_argument(
+        "--near-duplicate-threshold",
+        type=float,
+        default=0.8,
+        help="Least Jaccard similarity of the word shingles of two abstracts "
+        "that are kept once",
+    )
+    parser.add_argument(
+        "--keep-near-duplicates",
+        action="store_true",
+        help="Only drop exact duplicates",
+    )
+    args = parser.parse_args(argv)
+
+    from app.data_prep.near_duplicates import remove_near_duplicates
+    from app.data_prep.parquet_sink import scan_raw, stream_records_to_parquet
+    from app.data_prep.record_store import open_record_store
+
+    # Unique records are streamed to data/raw a batch at a time, then cleaned in
+    # one lazy plan
+    raw_dir = proj_dir / "data" / "raw"
+    with profiling.span("process.records_to_raw"):
+        stream_records_to_parquet(open_record_store(proj_dir), raw_dir)
+    if args.tokenizer == "nltk":
+        import nltk
+
+        nltk.download("punkt")
+    with profiling.span("process.clean"):
+        out_file = sink_clean_abstracts(
+            scan_raw(raw_dir),
+            proj_dir / "data" / "abstracts_clean.parquet",
+            args.tokenizer,
+        )
+    if not args.keep_near_duplicates:
+        # data/near_duplicates.parquet lists the clusters and the row kept of each
+        stats = remove_near_duplicates(
+            out_file,
+            proj_dir / "data" / "near_duplicates.parquet",
+            args.near_duplicate_threshold,
+        )
+        print(stats.summary())
+
+    df = pl.scan_parquet(out_file)
+    if profiling.active():
+        rows, tokens = (
+            df.select(
+                pl.len(),
+                pl.col("tokenized_abstract").str.count_matches(r"\S+").sum(),
+            )
+            .collect()
+            .row(0)
+        )
+        profiling.count(clean_rows=rows, tokens=tokens)
+    counts = df.group_by("journal", "desired_journal").len().collect()
     print("Counts by journal", counts)
     with pl.Config(tbl_cols=20):
-        print("Data", df.head())
-    df.write_parquet(proj_dir / "data" / "abstracts_clean.parquet")
+        print("Data", df.head().collect())
+
+
+if __name__ == "__main__":
+    main()
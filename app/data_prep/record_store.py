@@ -0,0 +1,323 @@
+# Raw Crossref records in SQLite, one row per DOI
+# Print and online ISSN queries mostly return the same articles, and diskcache
+# pickled every page whole, so each article was stored and parsed twice. Here a
+# page is split into its items: every DOI is stored once as compressed JSON (zstd
+# with the zstd extra, zlib otherwise), and the page keeps its cursor and the DOIs
+# it returned, which is all the harvester needs to resume
+# Tables of data/records.sqlite:
+# * records(doi, issn, harvested_until, sha1, codec, item)
+# * pages(key, next_cursor, n_items), page_refs(page_key, position, doi)
+import hashlib
+import json
+import sqlite3
+import threading
+import zlib
+from argparse import ArgumentParser
+from collections.abc import Iterator
+from pathlib import Path
+from typing import NamedTuple
+
+from app import profiling
+from app.data_prep.utils import parse_hive_cache_key
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    doi TEXT PRIMARY KEY,
+    issn TEXT,
+    harvested_until TEXT,
+    sha1 TEXT NOT NULL,
+    codec TEXT NOT NULL,
+    item BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    key TEXT PRIMARY KEY,
+    next_cursor TEXT,
+    n_items INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS page_refs (
+    page_key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    doi TEXT NOT NULL,
+    PRIMARY KEY (page_key, position)
+) WITHOUT ROWID;
+"""
+
+# DOIs bound per lookup query; SQLite before 3.32 allows at most 999 variables
+# and a page can hold up to 1000 items
+MAX_VARIABLES = 500
+
+# Incremental (index date) versions replace older ones; between two full harvest
+# pages the later write wins. Unchanged items are not rewritten.
+UPSERT = """
+INSERT INTO records (doi, issn, harvested_until, sha1, codec, item)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (doi) DO UPDATE SET
+    issn = excluded.issn,
+    harvested_until = excluded.harvested_until,
+    sha1 = excluded.sha1,
+    codec = excluded.codec,
+    item = excluded.item
+WHERE coalesce(excluded.harvested_until, '') >= coalesce(records.harvested_until, '')
+    AND excluded.sha1 != records.sha1
+"""
+
+
+def default_codec() -> str:
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return "zlib"
+    return "zstd"
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor().compress(data)
+    return zlib.compress(data, 6)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                "Records are zstd compressed, install the extra: uv sync --extra zstd"
+            ) from None
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class StoredRecord(NamedTuple):
+    doi: str
+    # ISSN of the page that wrote this version
+    issn: str | None
+    # Date an incremental page was harvested up to; None from a full harvest
+    harvested_until: str | None
+    # The Crossref item as JSON
+    item: bytes
+
+
+class RecordStore:
+    """
+    Crossref pages stored as deduplicated records. Reads and writes pages like
+    the diskcache it replaces (`key in store`, `store[key]`, `store[key] = page`),
+    so `CrossrefHarvester` can use either.
+
+    Args:
+        path (Path): SQLite file, created if missing.
+        codec (str, optional): "zstd" or "zlib" for new records; zstd if the
+            zstandard package is installed. Stored records keep their codec.
+    """
+
+    def __init__(self, path: Path, codec: str | None = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.codec = codec or default_codec()
+        # Harvester threads share the connection, one statement at a time
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            found = self._db.execute("SELECT 1 FROM pages WHERE key = ?", (key,))
+            return found.fetchone() is not None
+
+    def __getitem__(self, key: str) -> dict:
+        """The page as Crossref returned it, with the current version of each item"""
+        with self._lock:
+            page = self._db.execute(
+                "SELECT next_cursor FROM pages WHERE key = ?", (key,)
+            ).fetchone()
+            if page is None:
+                raise KeyError(key)
+            rows = self._db.execute(
+                "SELECT r.codec, r.item FROM page_refs p JOIN records r USING (doi) "
+                "WHERE p.page_key = ? ORDER BY p.position",
+                (key,),
+            ).fetchall()
+        items = [json.loads(decompress(item, codec)) for codec, item in rows]
+        return {"items": items, "next-cursor": page[0]}
+
+    def __setitem__(self, key: str, page: dict):
+        self.put_page(key, page)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def put_page(self, key: str, page: dict) -> int:
+        """
+        Stores the items of a page under their DOIs, and the page's references.
+        Items without a DOI are keyed by a hash of their content.
+
+        Returns:
+            int: Number of new or changed records.
+        """
+        fields = parse_hive_cache_key(key)
+        is_delta = fields.get("date_field", "pub") != "pub"
+        harvested_until = fields["date_to"] if is_delta else None
+        issn = fields.get("issn")
+        items = {}
+        for item in page.get("items", []):
+            data = json.dumps(item, separators=(",", ":"), sort_keys=True).encode()
+            sha1 = hashlib.sha1(data).hexdigest()
+            items[item.get("DOI") or f"sha1:{sha1}"] = (sha1, data)
+        dois = list(items)
+        stored = {}
+        with self._lock:
+            for start in range(0, len(dois), MAX_VARIABLES):
+                chunk = dois[start : start + MAX_VARIABLES]
+                stored.update(
+                    self._db.execute(
+                        "SELECT doi, sha1 FROM records "
+                        f"WHERE doi IN ({','.join('?' * len(chunk))})",
+                        chunk,
+                    )
+                )
+        # Only new and changed items are compressed; the other ISSN of a journal
+        # mostly returns records that are already stored
+        with profiling.span("records.compress"):
+            records = [
+                (
+                    doi,
+                    issn,
+                    harvested_until,
+                    sha1,
+                    self.codec,
+                    compress(data, self.codec),
+                )
+                for doi, (sha1, data) in items.items()
+                if stored.get(doi) != sha1
+            ]
+        profiling.count(records_written=len(records))
+        with self._lock, self._db:
+            self._db.executemany(UPSERT, records)
+            self._db.execute("DELETE FROM page_refs WHERE page_key = ?", (key,))
+            self._db.executemany(
+                "INSERT INTO page_refs VALUES (?, ?, ?)",
+                [(key, i, doi) for i, doi in enumerate(dois)],
+            )
+            # Page last: a page in the table is complete
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?)",
+                (key, page.get("next-cursor"), len(dois)),
+            )
+        return len(records)
+
+    def iterkeys(self) -> Iterator[str]:
+        """Page keys, like `Cache.iterkeys`"""
+        with self._lock:
+            keys = [k for (k,) in self._db.execute("SELECT key FROM pages")]
+        yield from keys
+
+    def iter_records(self, batch_size: int = 10_000) -> Iterator[list[StoredRecord]]:
+        """
+        Every record once, in batches. Rows are read in rowid order, which is
+        the order of the table on disk.
+        """
+        last = 0
+        while True:
+            with profiling.span("records.read"), self._lock:
+                rows = self._db.execute(
+                    "SELECT rowid, doi, issn, harvested_until, codec, item "
+                    "FROM records WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            with profiling.span("records.decompress"):
+                batch = [
+                    StoredRecord(doi, issn, until, decompress(item, codec))
+                    for _, doi, issn, until, codec, item in rows
+                ]
+            yield batch
+
+    def digest(self) -> str:
+        """
+        SHA-256 of the DOI, ISSN and content hash of every record: changes when
+        a record is added or changed, not when pages are only re-fetched
+        """
+        digest = hashlib.sha256()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT doi, coalesce(issn, ''), sha1 FROM records ORDER BY doi"
+            )
+            for row in rows:
+                digest.update("\t".join(row).encode() + b"\n")
+        return digest.hexdigest()
+
+    def stats(self) -> dict:
+        with self._lock:
+            n_records, n_bytes = self._db.execute(
+                "SELECT count(*), coalesce(sum(length(item)), 0) FROM records"
+            ).fetchone()
+            n_pages, n_items = self._db.execute(
+                "SELECT count(*), coalesce(sum(n_items), 0) FROM pages"
+            ).fetchone()
+        return {
+            "pages": n_pages,
+            "page_items": n_items,
+            "records": n_records,
+            "compressed_mb": round(n_bytes / 2**20, 2),
+        }
+
+    def import_cache(self, cache) -> int:
+        """
+        Copies the pages of a diskcache, full harvest pages first so that
+        incremental versions win. Returns the number of pages.
+        """
+        from app.data_prep.process_data import cache_key_order
+
+        keys = sorted(cache.iterkeys(), key=cache_key_order)
+        for key in keys:
+            self.put_page(key, cache[key])
+        return len(keys)
+
+
+def open_record_store(proj_dir: Path) -> RecordStore:
+    """
+    data/records.sqlite; an empty store first imports the pages of the
+    diskcache in data/cache, if there is one.
+    """
+    store = RecordStore(Path(proj_dir) / "data" / "records.sqlite")
+    cache_dir = Path(proj_dir) / "data" / "cache"
+    if (cache_dir / "cache.db").exists() and not store.stats()["pages"]:
+        from diskcache import Cache
+
+        store.import_cache(Cache(cache_dir))
+    return store
+
+
+def main(argv: list[str] | None = None):
+    parser = ArgumentParser(description="Size of the record store")
+    parser.add_argument(
+        "--import-cache",
+        action="store_true",
+        help="Copy the pages of data/cache (diskcache) into the store again",
+    )
+    args = parser.parse_args(argv)
+
+    proj_dir = Path(__file__).parents[2]
+    store = open_record_store(proj_dir)
+    if args.import_cache:
+        from diskcache import Cache
+
+        n_pages = store.import_cache(Cache(proj_dir / "data" / "cache"))
+        print(f"Imported {n_pages} pages")
+    print(store.stats())
+
+
+if __name__ == "__main__":
+    main()
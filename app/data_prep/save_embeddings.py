@@ -1,39 +1,45 @@
 # Computes and saves embeddings in data/
-# %%
 from pathlib import Path
 
 import polars as pl
-import torch
-from diskcache import Cache
-from sentence_transformers import SentenceTransformer
+
+from app.embeddings.artifact import artifact_dir, save_artifact
+from app.embeddings.store import EmbeddingStore
 
 proj_dir = Path(__file__).parents[2]
-cache = Cache(proj_dir / "data" / "cache")
-parq_file = proj_dir / "data" / "abstracts_clean.parquet"
-df = pl.read_parquet(parq_file)
-print(df)
-# %%
-device = (
-    torch.device("mps") if torch.backends.mps.is_available() else torch.device("cpu")
-)
-print(f"Using device: {device}")
-# %%
-model_name = "all-MiniLM-L6-v2"
-model = SentenceTransformer(model_name, device=device)
-# %%
-print("Building embeddings")
-abstracts = df.get_column("abstract").to_list()
-embeddings = model.encode(abstracts, convert_to_tensor=False, show_progress_bar=True)
-print(embeddings.shape)
-print(embeddings)
-# %%
-emb_series = pl.Series(
-    "embedding",
-    embeddings.tolist(),
-    pl.Array(pl.Float32, embeddings.shape[1]),
-)
-df = df.with_columns(emb_series, pl.lit(model_name).alias("model"))
-# %%
-print("df with embeddings:", df)
-# %%
-df.write_parquet(proj_dir / "data" / f"embeddings_{model_name}.parquet")
+
+
+def main(model_name: str = "all-MiniLM-L6-v2"):
+    # torch loads with the model, not on import
+    from sentence_transformers import SentenceTransformer
+
+    parq_file = proj_dir / "data" / "abstracts_clean.parquet"
+    df = pl.read_parquet(parq_file)
+    print(df)
+    # Inference runs on CPU; see app.embeddings.onnx_backend for a faster CPU path
+    model = SentenceTransformer(model_name, device="cpu")
+
+    print("Building embeddings")
+    abstracts = df.get_column("abstract").to_list()
+    # Only abstracts that are new or changed since the last run are encoded
+    store = EmbeddingStore(proj_dir / "data" / "embedding_store", model_name)
+    embeddings = store.embed(
+        abstracts,
+        lambda batch: model.encode(batch, convert_to_tensor=False),
+    )
+    print(f"Embeddings from store: {store.hits}, newly encoded: {store.misses}")
+    if store.evicted:
+        print(f"Evicted {store.evicted} embeddings of an older model revision")
+    print(embeddings.shape)
+    print(embeddings)
+
+    emb_series = pl.Series("embedding", embeddings.astype("float32"))
+    df = df.with_columns(emb_series, pl.lit(model_name).alias("model"))
+    print("df with embeddings:", df)
+
+    df.write_parquet(proj_dir / "data" / f"embeddings_{model_name}.parquet")
+    save_artifact(artifact_dir(proj_dir, model_name), embeddings, df, model_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,80 +1,117 @@
 # Computes and saves embeddings in data/
 # %%
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List
-import polars as pl
-import torch
-from diskcache import Cache
-from sentence_transformers import SentenceTransformer
-from transformers import AutoTokenizer
-from adapters import AutoAdapterModel
+
 import numpy as np
+import polars as pl
 from tqdm import tqdm
 
+from app.embeddings.artifact import artifact_dir, save_artifact
+from app.embeddings.batching import length_batches
+from app.embeddings.store import EmbeddingStore
+
 # %%
 
+ADAPTER = "allenai/specter2"
+
 
 class SpecterEmbeddings:
-    def __init__(self, batch_size: int = 32):
+    """
+    SPECTER2 (base model + proximity adapter) CLS embeddings.
+
+    Args:
+        batch_size (int): Maximum number of texts per forward pass.
+        max_tokens (int): Budget of padded tokens per forward pass. Texts are
+            sorted by length so that short abstracts share large batches.
+        prefetch (bool): Pad the next batch in a thread while the model runs.
+    """
+
+    def __init__(
+        self, batch_size: int = 32, max_tokens: int = 8192, prefetch: bool = True
+    ):
+        # torch, transformers and adapters load only with the model
+        from adapters import AutoAdapterModel
+        from transformers import AutoTokenizer
+
         # load model and tokenizer
         name = "allenai/specter2_base"
         self.tokenizer = AutoTokenizer.from_pretrained(name)
         self.model = AutoAdapterModel.from_pretrained(name)
         self.name = name.replace("/", "-")
         self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.prefetch = prefetch
 
         self.model.load_adapter(
-            "allenai/specter2", source="hf", load_as="specter2", set_active=True
+            ADAPTER, source="hf", load_as="specter2", set_active=True
+        )
+        self.model.eval()
+
+    def _pad(self, encodings: dict, idx: np.ndarray) -> dict:
+        return self.tokenizer.pad(
+            {k: [encodings[k][i] for i in idx] for k in encodings},
+            return_tensors="pt",
         )
 
     def embed(self, text_batch: List[str]) -> np.array:
-        all_embeddings = []
-        for i in tqdm(
-            range(0, len(text_batch), self.batch_size), desc="Processing batches"
-        ):
-            batch = text_batch[i : i + self.batch_size]
-            inputs = self.tokenizer(
-                batch,
-                padding=True,
-                truncation=True,
-                return_tensors="pt",
-                return_token_type_ids=False,
-                max_length=512,
-            )
-            output = self.model(**inputs)
-            embeddings = output.last_hidden_state[:, 0, :]
-            all_embeddings.append(embeddings.detach().numpy())
-
-        return np.vstack(all_embeddings)
+        """Embeds texts in length-sorted batches; rows keep the input order"""
+        import torch
+
+        # Tokenize everything once, unpadded, to know the lengths
+        encodings = self.tokenizer(
+            text_batch,
+            truncation=True,
+            return_token_type_ids=False,
+            max_length=512,
+        )
+        lengths = [len(ids) for ids in encodings["input_ids"]]
+        batches = length_batches(lengths, self.max_tokens, self.batch_size)
+
+        out = np.empty((len(text_batch), self.model.config.hidden_size), np.float32)
+        if not batches:
+            return out
+        with ThreadPoolExecutor(max_workers=1) as pool, torch.inference_mode():
+            if self.prefetch:
+                next_inputs = pool.submit(self._pad, encodings, batches[0])
+            for i, idx in enumerate(tqdm(batches, desc="Processing batches")):
+                if self.prefetch:
+                    inputs = next_inputs.result()
+                    if i + 1 < len(batches):
+                        next_inputs = pool.submit(self._pad, encodings, batches[i + 1])
+                else:
+                    inputs = self._pad(encodings, idx)
+                output = self.model(**inputs)
+                out[idx] = output.last_hidden_state[:, 0, :].numpy()
+
+        return out
 
 
 if __name__ == "__main__":
     proj_dir = Path(__file__).parents[2]
-    cache = Cache(proj_dir / "data" / "cache")
     parq_file = proj_dir / "data" / "abstracts_clean.parquet"
     df = pl.read_parquet(parq_file)
     print(df)
-    # %%
-    device = (
-        torch.device("mps")
-        if torch.backends.mps.is_available()
-        else torch.device("cpu")
-    )
-    print(f"Using device: {device}")
-    model = SpecterEmbeddings(6)
+    # Never more padded tokens per forward pass than the old 6 x 512
+    model = SpecterEmbeddings(batch_size=64, max_tokens=6 * 512)
     model_name = model.name
     # %%
     print("Building embeddings")
     abstracts = df.get_column("abstract").to_list()
-    embeddings = model.embed(abstracts)
+    # Only abstracts that are new or changed since the last run are encoded
+    # Keyed on model_revision, so an update of either the base model or the
+    # adapter is a new revision
+    store = EmbeddingStore(proj_dir / "data" / "embedding_store", model_name)
+    embeddings = store.embed(abstracts, model.embed, batch_size=1024)
+    print(f"Embeddings from store: {store.hits}, newly encoded: {store.misses}")
+    if store.evicted:
+        print(f"Evicted {store.evicted} embeddings of an older model revision")
     # %%
-    emb_series = pl.Series(
-        "embedding",
-        embeddings.tolist(),
-        pl.Array(pl.Float32, embeddings.shape[1]),
-    )
+    emb_series = pl.Series("embedding", embeddings.astype("float32"))
     df = df.with_columns(emb_series)
     # %%
     print("df with embeddings:", df)
     # %%
     df.write_parquet(proj_dir / "data" / f"embeddings_{model_name}.parquet")
+    save_artifact(artifact_dir(proj_dir, model_name), embeddings, df, model_name)
@@ -68,3 +68,14 @@ def get_journals_by_issn() -> dict:
         result[issn_dict["online"]] = journal_name
 
     return result
+
+
+def journal_for_issn(journals_by_issn: dict, issn: str | None) -> str | None:
+    """
+    Journal of the `issn` of a cache key: one ISSN, or all ISSNs of a journal
+    joined by commas for queries of the harvest planner
+    """
+    for single in (issn or "").split(","):
+        if single in journals_by_issn:
+            return journals_by_issn[single]
+    return None
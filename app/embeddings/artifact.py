@@ -0,0 +1,172 @@
+# Embedding artifacts: data/embeddings/<model>/
+# * embeddings.npy: contiguous float32 or float16 matrix, loaded as np.memmap
+# * rows.parquet: row_id and the metadata of each row (title, doi, journal, ...)
+# * manifest.json: model name, dim, number of rows, dtype and whether the rows are
+#   L2-normalized
+# Loading maps the matrix instead of reading it, so startup is instant and
+# processes serving the same artifact share the OS page cache. Rows are normalized
+# when the artifact is written, so a retriever can score the memmap as it is
+import hashlib
+import json
+import os
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+MATRIX_FILE = "embeddings.npy"
+ROWS_FILE = "rows.parquet"
+MANIFEST_FILE = "manifest.json"
+
+
+@dataclass
+class EmbeddingArtifact:
+    matrix: np.ndarray
+    rows: pl.DataFrame | None
+    manifest: dict
+
+    @property
+    def model(self) -> str:
+        return self.manifest["model"]
+
+    @property
+    def dim(self) -> int:
+        return self.manifest["dim"]
+
+
+def l2_normalize(x: np.ndarray) -> np.ndarray:
+    """Row-wise L2 normalization as float32; zero rows stay zero"""
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.where(norms == 0, 1, norms)
+
+
+def artifact_dir(proj_dir: Path, model_name: str) -> Path:
+    return Path(proj_dir) / "data" / "embeddings" / model_name
+
+
+def save_artifact(
+    out_dir: Path,
+    embeddings: np.ndarray,
+    rows: pl.DataFrame,
+    model_name: str,
+    dtype: str = "float32",
+) -> Path:
+    """
+    Writes an embedding artifact. Row i of the matrix belongs to row_id i of
+    rows.parquet; an `embedding` column in `rows` is dropped. Rows are stored
+    L2-normalized.
+    """
+    if len(rows) != len(embeddings):
+        raise ValueError(f"{len(rows)} rows but {len(embeddings)} embeddings")
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    matrix = np.ascontiguousarray(l2_normalize(embeddings), dtype=dtype)
+    tmp = out_dir / f"{MATRIX_FILE}.tmp.npy"
+    np.save(tmp, matrix)
+    os.replace(tmp, out_dir / MATRIX_FILE)
+
+    rows = rows.drop("embedding", strict=False).with_row_index("row_id")
+    tmp = out_dir / f"{ROWS_FILE}.tmp"
+    rows.write_parquet(tmp)
+    os.replace(tmp, out_dir / ROWS_FILE)
+
+    # Manifest last: an artifact with a manifest is complete
+    manifest = {
+        "model": model_name,
+        "dim": int(matrix.shape[1]),
+        "n_rows": int(matrix.shape[0]),
+        "dtype": dtype,
+        "normalized": True,
+        "matrix": MATRIX_FILE,
+        "rows": ROWS_FILE,
+        "created": datetime.now(timezone.utc).isoformat(),
+    }
+    tmp = out_dir / f"{MANIFEST_FILE}.tmp"
+    tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp, out_dir / MANIFEST_FILE)
+    return out_dir
+
+
+def load_artifact(directory: Path, with_rows: bool = True) -> EmbeddingArtifact:
+    """Maps the matrix read-only (no copy) and reads the row metadata"""
+    directory = Path(directory)
+    manifest = json.loads((directory / MANIFEST_FILE).read_text())
+    matrix = np.load(directory / manifest["matrix"], mmap_mode="r")
+    if matrix.shape != (manifest["n_rows"], manifest["dim"]):
+        raise ValueError(f"Matrix shape {matrix.shape} does not match {manifest}")
+    rows = pl.read_parquet(directory / manifest["rows"]) if with_rows else None
+    return EmbeddingArtifact(matrix=matrix, rows=rows, manifest=manifest)
+
+
+def artifact_fingerprint(directory: Path) -> str:
+    """
+    SHA-256 of the manifest, which changes every time the artifact is written
+    (it records when), for indexes built from the artifact to detect it
+    """
+    return hashlib.sha256((Path(directory) / MANIFEST_FILE).read_bytes()).hexdigest()
+
+
+def artifact_meta(directory: Path) -> dict:
+    """What the manifest of an index records of the artifact it is built from"""
+    manifest = json.loads((Path(directory) / MANIFEST_FILE).read_text())
+    return {
+        "model": manifest["model"],
+        "artifact_rows": manifest["n_rows"],
+        "artifact": artifact_fingerprint(directory),
+    }
+
+
+def check_built_from(index_dir: Path, directory: Path, name: str, kind: str):
+    """
+    Raises a ValueError if the index in `index_dir`, saved with `artifact_meta`
+    in its manifest.json, was built from another version of the artifact.
+    `name` describes the index in the message, `kind` is its `econ-rag index`
+    command.
+    """
+    manifest = json.loads((Path(index_dir) / MANIFEST_FILE).read_text())
+    current = artifact_meta(directory)
+    # Indexes saved before the fingerprint was recorded only have their n_rows
+    built_from = {
+        "artifact_rows": manifest.get("artifact_rows", manifest["n_rows"]),
+        "artifact": manifest.get("artifact", current["artifact"]),
+    }
+    if any(built_from[key] != current[key] for key in built_from):
+        raise ValueError(
+            f"The {name} in {index_dir} is stale: the embedding artifact was "
+            "rewritten since it was built. Rebuild it with "
+            f"`econ-rag index {kind} --model {current['model']}`"
+        )
+
+
+def artifact_from_parquet(
+    parquet_file: Path, out_dir: Path, model_name: str, dtype: str = "float32"
+) -> Path:
+    """Converts an embeddings_<model>.parquet file with an `embedding` column"""
+    df = pl.read_parquet(parquet_file)
+    embeddings = df["embedding"].to_numpy()
+    return save_artifact(out_dir, embeddings, df, model_name, dtype)
+
+
+def main(argv: list[str] | None = None):
+    parser = ArgumentParser(description="Convert embeddings parquet to an artifact")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--float16", action="store_true", help="Half the size")
+    args = parser.parse_args(argv)
+
+    proj_dir = Path(__file__).parents[2]
+    out_dir = artifact_from_parquet(
+        proj_dir / "data" / f"embeddings_{args.model}.parquet",
+        artifact_dir(proj_dir, args.model),
+        args.model,
+        dtype="float16" if args.float16 else "float32",
+    )
+    print(f"Wrote {out_dir}:", load_artifact(out_dir, with_rows=False).manifest)
+
+
+if __name__ == "__main__":
+    main()
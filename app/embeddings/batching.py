@@ -0,0 +1,47 @@
+# Length-bucketed batching for transformer encoders
+# Sorting by token length before batching means each batch is padded to a length
+# close to that of its members instead of to the longest text of a random slice
+from collections.abc import Sequence
+
+import numpy as np
+
+
+def length_batches(
+    lengths: Sequence[int], max_tokens: int, max_batch_size: int | None = None
+) -> list[np.ndarray]:
+    """
+    Groups indices into batches of similar length, longest first.
+
+    A batch is padded to its longest member, so it costs
+    len(batch) * longest tokens; batches are filled up to `max_tokens` of
+    that cost (but always hold at least one text).
+
+    Args:
+        lengths: Token count of each text.
+        max_tokens: Budget of padded tokens per batch.
+        max_batch_size: Optional cap on the number of texts per batch.
+
+    Returns:
+        List of index arrays into `lengths`. Together they cover every index once.
+    """
+    lengths = np.asarray(lengths)
+    # Stable, so texts of equal length keep their input order
+    order = np.argsort(-lengths, kind="stable")
+
+    batches = []
+    start = 0
+    while start < len(order):
+        longest = max(int(lengths[order[start]]), 1)
+        size = max(1, max_tokens // longest)
+        if max_batch_size:
+            size = min(size, max_batch_size)
+        batches.append(order[start : start + size])
+        start += size
+    return batches
+
+
+def padding_waste(lengths: Sequence[int], batches: list[np.ndarray]) -> float:
+    """Share of padded tokens that are padding"""
+    lengths = np.asarray(lengths)
+    padded = sum(len(b) * lengths[b].max() for b in batches if len(b))
+    return 1 - lengths.sum() / padded if padded else 0.0
@@ -0,0 +1,57 @@
+# Encoders by name, as plain `embed(list[str]) -> np.ndarray` callables
+# Heavy libraries are only imported when an encoder is loaded; the module itself
+# only needs the standard library, so the cli and the pipeline can validate
+# --backend against BACKENDS without importing numpy
+from collections.abc import Callable
+from importlib import import_module
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+Encoder = Callable[[list[str]], "np.ndarray"]
+
+
+def _minilm() -> Encoder:
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer("all-MiniLM-L6-v2", device="cpu")
+    return lambda texts: model.encode(texts, convert_to_numpy=True)
+
+
+def _specter2() -> Encoder:
+    from app.data_prep.save_embeddings2 import SpecterEmbeddings
+
+    return SpecterEmbeddings(batch_size=64, max_tokens=6 * 512).embed
+
+
+# Keys are the model names used in data/embeddings_<model>.parquet
+ENCODERS = {
+    "all-MiniLM-L6-v2": _minilm,
+    "allenai-specter2_base": _specter2,
+}
+
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def load_encoder(name: str, backend: str = "torch") -> Encoder:
+    """
+    Loads an encoder by model name, or from a "package.module:factory" path
+    for encoders defined elsewhere. The onnx backends run the model exported by
+    `app.embeddings.onnx_backend` with ONNX Runtime.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, choose one of {BACKENDS}")
+    if backend != "torch":
+        from app.embeddings.onnx_backend import OnnxEncoder, onnx_dir
+
+        directory = onnx_dir(Path(__file__).parents[2], name)
+        return OnnxEncoder(directory, int8=backend == "onnx-int8")
+    if name in ENCODERS:
+        return ENCODERS[name]()
+    if ":" in name:
+        module, factory = name.split(":")
+        return getattr(import_module(module), factory)()
+    raise ValueError(f"Unknown encoder {name}, choose one of {list(ENCODERS)}")
@@ -0,0 +1,220 @@
+# ONNX Runtime backend for the CPU encoders
+# Exports all-MiniLM-L6-v2 and SPECTER2 (base model + proximity adapter) with
+# their pooling inside the graph, so inference is tokenize -> session.run, and
+# optionally quantizes the weights to int8 (dynamic quantization). Models go to
+# data/onnx/<model>/: model.onnx, model.int8.onnx, tokenizer files, manifest.json
+# Needs the onnx extra: uv sync --extra onnx
+import json
+import os
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+
+from app.embeddings.batching import length_batches
+
+MODEL_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+MANIFEST_FILE = "manifest.json"
+
+
+def onnx_dir(proj_dir: Path, model_name: str) -> Path:
+    return Path(proj_dir) / "data" / "onnx" / model_name
+
+
+def _minilm_module():
+    """Mean pooling and L2 normalization, as SentenceTransformer.encode does"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    st = SentenceTransformer("all-MiniLM-L6-v2", device="cpu")
+
+    class MeanPooled(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            hidden = self.model(
+                input_ids=input_ids, attention_mask=attention_mask
+            ).last_hidden_state
+            mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+            return torch.nn.functional.normalize(pooled, dim=-1)
+
+    return MeanPooled(st[0].auto_model), st.tokenizer, st.max_seq_length
+
+
+def _specter2_module():
+    """CLS token of the adapter model, as SpecterEmbeddings.embed does"""
+    import torch
+
+    from app.data_prep.save_embeddings2 import SpecterEmbeddings
+
+    specter = SpecterEmbeddings()
+
+    class CLS(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            output = self.model(input_ids=input_ids, attention_mask=attention_mask)
+            return output.last_hidden_state[:, 0]
+
+    return CLS(specter.model), specter.tokenizer, 512
+
+
+# Keys are the model names of encoders.ENCODERS
+EXPORTS = {
+    "all-MiniLM-L6-v2": _minilm_module,
+    "allenai-specter2_base": _specter2_module,
+}
+
+
+def export_onnx(model_name: str, out_dir: Path, quantize: bool = True) -> Path:
+    """Exports the model with dynamic batch and sequence axes, then quantizes it"""
+    import torch
+
+    if model_name not in EXPORTS:
+        raise ValueError(f"Unknown model {model_name}, choose one of {list(EXPORTS)}")
+    module, tokenizer, max_length = EXPORTS[model_name]()
+    module.eval()
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    example = tokenizer(
+        ["An example abstract", "Another one"],
+        padding=True,
+        return_tensors="pt",
+        return_token_type_ids=False,
+    )
+    inputs = (example["input_ids"], example["attention_mask"])
+    # Until the new manifest is written, the directory is an incomplete export
+    (out_dir / MANIFEST_FILE).unlink(missing_ok=True)
+    with torch.inference_mode():
+        dim = module(*inputs).shape[1]
+        torch.onnx.export(
+            module,
+            inputs,
+            out_dir / MODEL_FILE,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["sentence_embedding"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "sentence_embedding": {0: "batch"},
+            },
+            opset_version=17,
+        )
+    tokenizer.save_pretrained(out_dir)
+    if quantize:
+        quantize_int8(out_dir / MODEL_FILE, out_dir / INT8_FILE)
+
+    # Manifest last: an export with a manifest is complete
+    manifest = {
+        "model": model_name,
+        "dim": int(dim),
+        "max_length": int(max_length),
+        "int8": quantize,
+    }
+    (out_dir / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2))
+    return out_dir
+
+
+def quantize_int8(model_file: Path, out_file: Path) -> Path:
+    """Dynamic quantization: int8 weights, activations quantized at run time"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    tmp = Path(f"{out_file}.tmp")
+    quantize_dynamic(model_file, tmp, weight_type=QuantType.QInt8)
+    os.replace(tmp, out_file)
+    return out_file
+
+
+class OnnxEncoder:
+    """
+    Drop-in encoder running an exported model with ONNX Runtime on CPU.
+
+    Args:
+        directory (Path): Output directory of `export_onnx`.
+        int8 (bool): Use the int8 model.
+        batch_size (int): Maximum number of texts per run.
+        max_tokens (int): Budget of padded tokens per run; texts are batched by
+            length like in `SpecterEmbeddings`.
+        threads (int, optional): Intra-op threads, all cores by default.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        int8: bool = True,
+        batch_size: int = 64,
+        max_tokens: int = 8192,
+        threads: int | None = None,
+    ):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        directory = Path(directory)
+        manifest = json.loads((directory / MANIFEST_FILE).read_text())
+        if int8 and not manifest["int8"]:
+            raise ValueError(f"{directory} has no int8 model, export with quantize")
+        self.dim = manifest["dim"]
+        self.max_length = manifest["max_length"]
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.tokenizer = AutoTokenizer.from_pretrained(directory)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            str(directory / (INT8_FILE if int8 else MODEL_FILE)),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Embeds texts in length-sorted batches; rows keep the input order"""
+        encodings = self.tokenizer(
+            texts,
+            truncation=True,
+            max_length=self.max_length,
+            return_token_type_ids=False,
+        )
+        lengths = [len(ids) for ids in encodings["input_ids"]]
+        out = np.empty((len(texts), self.dim), np.float32)
+        for idx in length_batches(lengths, self.max_tokens, self.batch_size):
+            inputs = self.tokenizer.pad(
+                {k: [encodings[k][i] for i in idx] for k in encodings},
+                return_tensors="np",
+            )
+            feed = {
+                k: inputs[k].astype(np.int64) for k in ("input_ids", "attention_mask")
+            }
+            out[idx] = self.session.run(None, feed)[0]
+        return out
+
+    __call__ = embed
+
+
+def main(argv: list[str] | None = None):
+    parser = ArgumentParser(description="Export an encoder to ONNX")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2", choices=list(EXPORTS))
+    parser.add_argument("--no-int8", action="store_true")
+    args = parser.parse_args(argv)
+
+    proj_dir = Path(__file__).parents[2]
+    out_dir = export_onnx(
+        args.model, onnx_dir(proj_dir, args.model), quantize=not args.no_int8
+    )
+    sizes = {
+        f.name: f"{f.stat().st_size / 2**20:.1f} MB" for f in out_dir.glob("*.onnx")
+    }
+    print(f"Exported {args.model} to {out_dir}: {sizes}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# Query embedding cache
+# Wraps an encoder: query vectors are kept in an in-memory LRU and optionally in
+# a diskcache that survives restarts, keyed by model, backend, model revision and
+# normalized text, so a repeated question skips the forward pass. The lock only
+# guards the in-memory LRU; disk reads and writes happen outside of it, so one
+# slow disk lookup does not hold up the queries of other threads
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from diskcache import Cache
+
+from app.data_prep.utils import make_hive_cache_key
+from app.embeddings.encoders import Encoder
+from app.embeddings.revisions import model_revision
+from app.embeddings.store import text_hash
+
+
+def normalize_query(text: str, lowercase: bool = False) -> str:
+    """NFKC, single spaces, no surrounding whitespace; optionally lowercased"""
+    text = " ".join(unicodedata.normalize("NFKC", text).split())
+    return text.lower() if lowercase else text
+
+
+class CachedEncoder:
+    """
+    Encoder with a query cache, callable like the encoder it wraps.
+
+    Args:
+        encoder (Encoder): The model, `list[str] -> np.ndarray`.
+        model (str): Model name, e.g. "all-MiniLM-L6-v2".
+        max_size (int): Number of vectors kept in memory.
+        directory (Path, optional): Directory of the disk tier, none if not given.
+        lowercase (bool): Also lowercase queries before lookup; only right for
+            uncased models.
+        backend (str): Backend of the encoder, see `load_encoder`; vectors of
+            the int8 model are not those of the torch model.
+        revision (str | None): Model revision; defaults to `model_revision` of
+            `model`. Vectors of an updated model are not reused.
+    """
+
+    def __init__(
+        self,
+        encoder: Encoder,
+        model: str,
+        max_size: int = 10_000,
+        directory: Path | None = None,
+        lowercase: bool = False,
+        backend: str = "torch",
+        revision: str | None = None,
+    ):
+        self.encoder = encoder
+        self.model = model
+        self.backend = backend
+        self.revision = revision or model_revision(model)
+        self.max_size = max_size
+        self.lowercase = lowercase
+        self.disk = (
+            Cache(directory, eviction_policy="least-recently-used")
+            if directory
+            else None
+        )
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, text: str) -> str:
+        query = normalize_query(text, self.lowercase)
+        return make_hive_cache_key(
+            model=self.model,
+            backend=self.backend,
+            revision=self.revision,
+            sha=text_hash(query),
+        )
+
+    def __call__(self, texts: list[str]) -> np.ndarray:
+        keys = [self.key(t) for t in texts]
+        found = {}
+        not_in_memory = {}
+        with self._lock:
+            for key, text in zip(keys, texts):
+                if key in found or key in not_in_memory:
+                    continue
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                    self.hits += 1
+                else:
+                    not_in_memory[key] = text
+
+        on_disk = {}
+        if self.disk is not None:
+            for key in not_in_memory:
+                value = self.disk.get(key)
+                if value is not None:
+                    on_disk[key] = np.frombuffer(value, dtype=np.float32)
+        missing = {k: t for k, t in not_in_memory.items() if k not in on_disk}
+        with self._lock:
+            for key, vector in on_disk.items():
+                self._remember(key, vector)
+            self.disk_hits += len(on_disk)
+            self.misses += len(missing)
+        found.update(on_disk)
+
+        if missing:
+            # One forward pass for all misses of the batch
+            vectors = np.asarray(self.encoder(list(missing.values())), np.float32)
+            new = dict(zip(missing, vectors))
+            with self._lock:
+                for key, vector in new.items():
+                    self._remember(key, vector)
+            if self.disk is not None:
+                for key, vector in new.items():
+                    self.disk[key] = vector.tobytes()
+            found.update(new)
+        return np.stack([found[k] for k in keys])
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "size": len(self._memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4)
+            if lookups
+            else 0.0,
+        }
@@ -0,0 +1,42 @@
+# Model revisions from the huggingface cache
+# The commit a model loads from is the one its refs/main points to in the hub
+# cache. This is the one place a revision is derived: the embedding store, the
+# query cache and the pipeline all key on `model_revision`. Reading the ref takes
+# no model load and only the standard library, so none of them imports torch
+import os
+from pathlib import Path
+
+# Hub repos of the encoders of app.embeddings.encoders; an update of any of them
+# is a new revision of the encoder
+HUB_REPOS = {
+    "all-MiniLM-L6-v2": ("sentence-transformers/all-MiniLM-L6-v2",),
+    "allenai-specter2_base": ("allenai/specter2_base", "allenai/specter2"),
+}
+
+
+def hub_cache_dir() -> Path:
+    """The huggingface hub cache, where huggingface_hub looks for it"""
+    if os.environ.get("HF_HUB_CACHE"):
+        return Path(os.environ["HF_HUB_CACHE"])
+    hf_home = os.environ.get("HF_HOME") or Path.home() / ".cache" / "huggingface"
+    return Path(hf_home) / "hub"
+
+
+def cached_revision(repo_id: str, ref: str = "main") -> str:
+    """Commit hash `ref` of a cached hub repo points to; "unknown" if not cached"""
+    path = hub_cache_dir() / f"models--{repo_id.replace('/', '--')}" / "refs" / ref
+    try:
+        return path.read_text().strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def model_revision(name: str) -> str:
+    """
+    Revision of an encoder of `load_encoder` by name, e.g. "<base>+<adapter>"
+    for SPECTER2; "unknown" for encoders that are not on the hub
+    """
+    repos = HUB_REPOS.get(name)
+    if not repos:
+        return "unknown"
+    return "+".join(cached_revision(repo) for repo in repos)
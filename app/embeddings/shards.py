@@ -0,0 +1,238 @@
+# Sharded, resumable embedding on CPU
+# abstracts_clean.parquet is split into row ranges that a pool of worker processes
+# embeds; each shard is saved as .npy as soon as it is done, so a restart only
+# embeds the shards that are missing
+import json
+import os
+import time
+from argparse import ArgumentParser
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from app import profiling
+from app.embeddings.artifact import artifact_dir, save_artifact
+from app.embeddings.encoders import BACKENDS, load_encoder
+
+_encoder = None
+
+# Thread pools of the libraries a worker loads, sized once when each is imported
+THREAD_VARS = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "POLARS_MAX_THREADS",
+)
+
+
+def plan_shards(n_rows: int, shard_size: int) -> list[tuple[int, int]]:
+    """Row ranges [start, stop) of at most shard_size rows"""
+    return [(i, min(i + shard_size, n_rows)) for i in range(0, n_rows, shard_size)]
+
+
+def shard_path(out_dir: Path, start: int, stop: int) -> Path:
+    return Path(out_dir) / f"shard-{start:09d}-{stop:09d}.npy"
+
+
+def _source_manifest(
+    parquet_file: Path, encoder: str, shard_size: int, backend: str = "torch"
+) -> dict:
+    stat = Path(parquet_file).stat()
+    return {
+        "source": str(parquet_file),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "encoder": encoder,
+        "backend": backend,
+        "shard_size": shard_size,
+    }
+
+
+def prepare_out_dir(out_dir: Path, manifest: dict):
+    """Removes shards of a different input file, encoder or shard size"""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_file = out_dir / "manifest.json"
+    if manifest_file.exists() and json.loads(manifest_file.read_text()) != manifest:
+        for f in out_dir.glob("shard-*.npy"):
+            f.unlink()
+    manifest_file.write_text(json.dumps(manifest, indent=2))
+
+
+@contextmanager
+def _worker_env(n_threads: int) -> Iterator[None]:
+    """
+    Thread counts for the worker processes started inside the block. A spawned
+    worker imports numpy and polars (with this module) before its initializer
+    runs, so the variables have to be in the environment it starts with.
+    """
+    saved = {var: os.environ.get(var) for var in THREAD_VARS}
+    os.environ.update({var: str(n_threads) for var in THREAD_VARS})
+    try:
+        yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+
+def _init_worker(encoder: str, n_threads: int, backend: str = "torch"):
+    try:
+        import torch
+
+        torch.set_num_threads(n_threads)
+    except ImportError:
+        pass
+    global _encoder
+    _encoder = load_encoder(encoder, backend)
+
+
+def _embed_shard(
+    parquet_file: Path, column: str, start: int, stop: int, out_dir: Path
+) -> tuple[Path, dict[str, tuple[float, float]]]:
+    """
+    Returns the shard's path and the (wall, CPU) seconds of its steps, which
+    the parent adds to its run report
+    """
+    timings = {}
+    clock = time.perf_counter(), time.process_time()
+
+    def lap(step: str):
+        nonlocal clock
+        now = time.perf_counter(), time.process_time()
+        timings[step] = (now[0] - clock[0], now[1] - clock[1])
+        clock = now
+
+    texts = (
+        pl.scan_parquet(parquet_file)
+        .slice(start, stop - start)
+        .select(column)
+        .collect()[column]
+        .to_list()
+    )
+    lap("embed.read")
+    vectors = np.asarray(_encoder(texts), dtype=np.float32)
+    lap("embed.forward")
+    path = shard_path(out_dir, start, stop)
+    # Write then rename, so a crash never leaves a partial shard behind
+    tmp = path.with_suffix(".tmp.npy")
+    np.save(tmp, vectors)
+    os.replace(tmp, path)
+    lap("embed.save")
+    return path, timings
+
+
+def run_sharded(
+    parquet_file: Path,
+    out_dir: Path,
+    encoder: str,
+    column: str = "abstract",
+    shard_size: int = 2048,
+    n_workers: int | None = None,
+    threads_per_worker: int | None = None,
+    backend: str = "torch",
+) -> list[tuple[int, int]]:
+    """
+    Embeds `column` of `parquet_file` shard by shard in worker processes.
+    Shards already in `out_dir` are skipped. `backend` is passed to `load_encoder`.
+
+    Returns:
+        All shards of the file, done or not.
+    """
+    n_workers = n_workers or max(1, (os.cpu_count() or 1) // 2)
+    threads_per_worker = threads_per_worker or max(
+        1, (os.cpu_count() or 1) // n_workers
+    )
+    n_rows = pl.scan_parquet(parquet_file).select(pl.len()).collect().item()
+    shards = plan_shards(n_rows, shard_size)
+    manifest = _source_manifest(parquet_file, encoder, shard_size, backend)
+    prepare_out_dir(out_dir, manifest)
+    todo = [s for s in shards if not shard_path(out_dir, *s).exists()]
+    print(f"{len(shards) - len(todo)} of {len(shards)} shards done already")
+    if not todo:
+        return shards
+
+    # Workers start on submit, all of them inside the block
+    with (
+        _worker_env(threads_per_worker),
+        ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(encoder, threads_per_worker, backend),
+        ) as pool,
+    ):
+        futures = [
+            pool.submit(_embed_shard, parquet_file, column, start, stop, out_dir)
+            for start, stop in todo
+        ]
+        for i, fut in enumerate(as_completed(futures), start=1):
+            path, timings = fut.result()
+            for step, (seconds, cpu_seconds) in timings.items():
+                profiling.record(step, seconds, cpu_seconds)
+            profiling.count(shards=1)
+            print(f"[{i}/{len(todo)}] {path.name}")
+    profiling.count(rows=sum(stop - start for start, stop in todo))
+    return shards
+
+
+def stitch_shards(
+    out_dir: Path, shards: list[tuple[int, int]], dim: int = 0
+) -> np.ndarray:
+    """
+    Copies the shards into one float32 matrix, reading each shard memory-mapped.
+    No shards (an empty input file) give an empty (0, dim) matrix.
+    """
+    if not shards:
+        return np.empty((0, dim), dtype=np.float32)
+    first = np.load(shard_path(out_dir, *shards[0]), mmap_mode="r")
+    out = np.empty((shards[-1][1], first.shape[1]), dtype=np.float32)
+    for start, stop in shards:
+        out[start:stop] = np.load(shard_path(out_dir, start, stop), mmap_mode="r")
+    return out
+
+
+def main(argv: list[str] | None = None):
+    parser = ArgumentParser(description="Embed abstracts in resumable shards")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--threads-per-worker", type=int, default=None)
+    parser.add_argument("--shard-size", type=int, default=2048)
+    parser.add_argument("--backend", default="torch", choices=BACKENDS)
+    args = parser.parse_args(argv)
+
+    proj_dir = Path(__file__).parents[2]
+    parq_file = proj_dir / "data" / "abstracts_clean.parquet"
+    out_dir = proj_dir / "data" / "shards" / args.model
+    shards = run_sharded(
+        parq_file,
+        out_dir,
+        args.model,
+        shard_size=args.shard_size,
+        n_workers=args.workers,
+        threads_per_worker=args.threads_per_worker,
+        backend=args.backend,
+    )
+    with profiling.span("embed.stitch"):
+        embeddings = stitch_shards(out_dir, shards)
+    # A 2D array becomes an Array column directly, no Python lists in between
+    df = pl.read_parquet(parq_file).with_columns(
+        pl.Series("embedding", embeddings), pl.lit(args.model).alias("model")
+    )
+    print("df with embeddings:", df)
+    out_file = proj_dir / "data" / f"embeddings_{args.model}.parquet"
+    tmp = out_file.with_suffix(".tmp.parquet")
+    df.write_parquet(tmp)
+    os.replace(tmp, out_file)
+    save_artifact(artifact_dir(proj_dir, args.model), embeddings, df, args.model)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Persistent embedding store
+# Vectors are keyed by (model name, model revision, sha256 of the exact input text),
+# so a run only encodes texts it has not seen with this exact model before
+import hashlib
+from collections.abc import Callable
+from pathlib import Path
+
+import numpy as np
+from diskcache import Cache
+
+from app import profiling
+from app.data_prep.utils import make_hive_cache_key
+from app.embeddings.revisions import model_revision
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Embeddings on disk for one model revision. Entries of other revisions of the
+    same model are evicted when the store is opened with a new revision; their
+    number is in `evicted`.
+
+    Args:
+        directory (Path): Directory of the diskcache.
+        model_name (str): e.g. "all-MiniLM-L6-v2".
+        revision (str | None): Model version; defaults to `model_revision` of
+            `model_name`, the same revision the query cache and pipeline key on.
+    """
+
+    def __init__(self, directory: Path, model_name: str, revision: str | None = None):
+        self.cache = Cache(directory, tag_index=True)
+        self.model_name = model_name
+        self.revision = revision or model_revision(model_name)
+        self.tag = f"{model_name}@{self.revision}"
+        self.hits = 0
+        self.misses = 0
+        self.evicted = self._evict_stale()
+
+    def _evict_stale(self) -> int:
+        """Evicts the entries of an older revision, returns their number"""
+        meta_key = make_hive_cache_key(model=self.model_name, meta="revision")
+        old_revision = self.cache.get(meta_key)
+        n = 0
+        if old_revision is not None and old_revision != self.revision:
+            n = self.cache.evict(f"{self.model_name}@{old_revision}")
+        self.cache[meta_key] = self.revision
+        return n
+
+    def key(self, text: str) -> str:
+        return make_hive_cache_key(
+            model=self.model_name, revision=self.revision, sha=text_hash(text)
+        )
+
+    def embed(
+        self,
+        texts: list[str],
+        encode: Callable[[list[str]], np.ndarray],
+        batch_size: int = 256,
+    ) -> np.ndarray:
+        """
+        Returns the embeddings of `texts` as a float32 matrix, calling `encode`
+        only on batches of texts that are not stored yet.
+        """
+        keys = [self.key(t) for t in texts]
+        vectors = {}
+        missing = {}
+        with profiling.span("embed.store_read"):
+            for key, text in zip(keys, texts):
+                if key in vectors or key in missing:
+                    continue
+                value = self.cache.get(key)
+                if value is None:
+                    missing[key] = text
+                else:
+                    vectors[key] = np.frombuffer(value, dtype=np.float32)
+        self.hits += len(vectors)
+        self.misses += len(missing)
+        profiling.count(embedding_hits=len(vectors), embedding_misses=len(missing))
+
+        missing_keys = list(missing)
+        for i in range(0, len(missing_keys), batch_size):
+            batch_keys = missing_keys[i : i + batch_size]
+            with profiling.span("embed.forward"):
+                batch = np.asarray(
+                    encode([missing[k] for k in batch_keys]), dtype=np.float32
+                )
+            profiling.count(batches=1)
+            with profiling.span("embed.store_write"), self.cache.transact():
+                for key, vector in zip(batch_keys, batch):
+                    self.cache.set(key, vector.tobytes(), tag=self.tag)
+                    vectors[key] = vector
+
+        if not keys:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack([vectors[k] for k in keys])
@@ -0,0 +1,327 @@
+# Pipeline runner with a content-addressed stage cache
+# `econ-rag data` (just data) runs harvest -> process -> embed and skips a stage
+# whose fingerprint matches its last successful run in data/pipeline_state.json.
+# The fingerprint of a stage is a SHA-256 of:
+# * its code: the source of the modules it runs (constants such as the ISSNs too)
+# * its parameters: its options, the date for the harvest, whose date windows end
+#   today, so it runs at most once a day, and for the embed stage the revision of
+#   the model in the huggingface cache, so an updated model re-embeds
+# * the contents of its inputs: the records of data/records.sqlite, the bytes of
+#   abstracts_clean.parquet
+# Inputs are digested by content, so re-fetched pages with the same records or a
+# rewritten file with the same bytes do not rerun the stages after it. File digests
+# are kept with the size and mtime they were computed for and reused while both
+# match, so a no-op run reads no data. A stage also reruns if one of its outputs is
+# missing. Stages write their outputs atomically (tmp file, then os.replace) and the
+# state is saved after each successful stage, so an interrupted run resumes at the
+# stage that failed. Only the standard library is imported until a stage runs.
+import hashlib
+import json
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from dataclasses import dataclass, field
+from datetime import date
+from importlib import import_module
+from pathlib import Path
+
+from app import profiling
+from app.embeddings.encoders import BACKENDS
+from app.embeddings.revisions import model_revision
+
+proj_dir = Path(__file__).parents[1]
+
+STATE_FILE = "pipeline_state.json"
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    # "module:function" called with `argv`, like the commands of app.cli
+    target: str
+    argv: tuple[str, ...] = ()
+    # Modules whose source is part of the fingerprint
+    modules: tuple[str, ...] = ()
+    # Files (or the record store, *.sqlite) digested by content
+    inputs: tuple[Path, ...] = ()
+    outputs: tuple[Path, ...] = ()
+    # Parameters that are not options of the stage
+    params: dict = field(default_factory=dict)
+
+
+def data_stages(
+    model: str = "all-MiniLM-L6-v2",
+    backend: str = "torch",
+    start_year: int | None = None,
+    root: Path = proj_dir,
+) -> list[Stage]:
+    """The stages of `just data`, in order"""
+    data_dir = Path(root) / "data"
+    records = data_dir / "records.sqlite"
+    clean = data_dir / "abstracts_clean.parquet"
+    harvest_argv = () if start_year is None else ("--start-year", str(start_year))
+    return [
+        Stage(
+            "harvest",
+            "app.data_prep.get_data:main",
+            argv=harvest_argv,
+            modules=(
+                "app.data_prep.get_data",
+                "app.data_prep.harvest",
+                "app.data_prep.planner",
+                "app.data_prep.incremental",
+                "app.data_prep.record_store",
+                "app.data_prep.utils",
+            ),
+            outputs=(records,),
+            params={"date": date.today().isoformat()},
+        ),
+        Stage(
+            "process",
+            "app.data_prep.process_data:main",
+            modules=(
+                "app.data_prep.process_data",
+                "app.data_prep.clean",
+                "app.data_prep.parquet_sink",
+                "app.data_prep.near_duplicates",
+                "app.data_prep.record_store",
+                "app.data_prep.utils",
+            ),
+            inputs=(records,),
+            outputs=(clean,),
+        ),
+        Stage(
+            "embed",
+            "app.embeddings.shards:main",
+            argv=("--model", model, "--backend", backend),
+            modules=(
+                "app.embeddings.shards",
+                "app.embeddings.encoders",
+                "app.embeddings.batching",
+                "app.embeddings.artifact",
+                "app.embeddings.onnx_backend",
+                "app.embeddings.revisions",
+                "app.data_prep.save_embeddings2",
+            ),
+            inputs=(clean,),
+            outputs=(
+                data_dir / f"embeddings_{model}.parquet",
+                data_dir / "embeddings" / model / "manifest.json",
+            ),
+            params={"revision": model_revision(model)},
+        ),
+    ]
+
+
+def _stats(files: list[Path]) -> list[list[int]]:
+    return [[p.stat().st_size, p.stat().st_mtime_ns] for p in files if p.exists()]
+
+
+class PipelineState:
+    """
+    data/pipeline_state.json: the fingerprint of the last successful run of
+    each stage, and the digests of files with the size and mtime they are for
+    """
+
+    def __init__(self, path: Path, root: Path = proj_dir):
+        self.path = Path(path)
+        self.root = Path(root)
+        data = json.loads(self.path.read_text()) if self.path.exists() else {}
+        self.stages: dict[str, dict] = data.get("stages", {})
+        self.files: dict[str, dict] = data.get("files", {})
+
+    def save(self):
+        """Writes the state atomically"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        data = {"stages": self.stages, "files": self.files}
+        tmp.write_text(json.dumps(data, indent=2, sort_keys=True))
+        os.replace(tmp, self.path)
+
+    def relative(self, path: Path) -> str:
+        """Name of a path in the state, relative to the project"""
+        path = Path(path)
+        return str(
+            path.relative_to(self.root) if path.is_relative_to(self.root) else path
+        )
+
+    def digest(self, path: Path) -> str | None:
+        """
+        Content digest of a file, or of the records of a record store; None if
+        it does not exist. Reused while size and mtime are unchanged.
+        """
+        path = Path(path)
+        if not path.exists():
+            return None
+        # The records of a store in WAL mode may be in the -wal file only
+        files = [path, Path(f"{path}-wal")] if path.suffix == ".sqlite" else [path]
+        stats = _stats(files)
+        name = self.relative(path)
+        known = self.files.get(name)
+        if known and known["stat"] == stats:
+            return known["sha256"]
+        with profiling.span("pipeline.digest"):
+            if path.suffix == ".sqlite":
+                from app.data_prep.record_store import RecordStore
+
+                store = RecordStore(path)
+                sha256 = store.digest()
+                store.close()
+                # Closing the last connection checkpoints the WAL into the file
+                stats = _stats(files)
+            else:
+                with open(path, "rb") as f:
+                    sha256 = hashlib.file_digest(f, "sha256").hexdigest()
+        self.files[name] = {"stat": stats, "sha256": sha256}
+        return sha256
+
+
+def code_digest(modules: tuple[str, ...], root: Path = proj_dir) -> str:
+    """SHA-256 of the source files of modules, found without importing them"""
+    digest = hashlib.sha256()
+    for module in sorted(modules):
+        digest.update(module.encode() + b"\n")
+        digest.update((Path(root) / (module.replace(".", "/") + ".py")).read_bytes())
+    return digest.hexdigest()
+
+
+def fingerprint(stage: Stage, state: PipelineState) -> tuple[str, dict]:
+    """
+    Returns:
+        str: SHA-256 of the parts.
+        dict: The parts: code, params and inputs (path -> digest).
+    """
+    parts = {
+        "code": code_digest(stage.modules),
+        "params": {"argv": list(stage.argv), **stage.params},
+        "inputs": {state.relative(p): state.digest(p) for p in stage.inputs},
+    }
+    data = json.dumps(parts, sort_keys=True).encode()
+    return hashlib.sha256(data).hexdigest(), parts
+
+
+def why_run(
+    stage: Stage, key: str, parts: dict, last: dict | None, force: bool
+) -> str | None:
+    """Why a stage has to run, None if it can be skipped"""
+    if force:
+        return "forced"
+    if last is None:
+        return "no successful run yet"
+    missing = [str(p) for p in stage.outputs if not Path(p).exists()]
+    if missing:
+        return f"missing {', '.join(missing)}"
+    if last["fingerprint"] == key:
+        return None
+    changed = [k for k in ("code", "params") if parts[k] != last["parts"][k]]
+    changed += [
+        name
+        for name, digest in parts["inputs"].items()
+        if last["parts"]["inputs"].get(name) != digest
+    ]
+    return f"changed: {', '.join(changed)}"
+
+
+def run_pipeline(
+    stages: list[Stage],
+    state: PipelineState,
+    force: tuple[str, ...] = (),
+    skip: tuple[str, ...] = (),
+    dry_run: bool = False,
+) -> dict[str, str]:
+    """
+    Runs the stages in order, skipping those whose fingerprint is unchanged.
+
+    Args:
+        stages (list[Stage]): See `data_stages`.
+        state (PipelineState): Updated and saved after each stage that runs.
+        force (tuple[str, ...]): Stages that run anyway; "all" for every stage.
+        skip (tuple[str, ...]): Stages that do not run, e.g. harvest offline.
+        dry_run (bool): Only report what would run. Later stages are judged on
+            the current inputs, which an earlier stage may still change.
+
+    Returns:
+        dict[str, str]: Stage name -> "ran", "skipped", "unchanged" or, for a
+            dry run, "would run".
+    """
+    outcome = {}
+    for stage in stages:
+        if stage.name in skip:
+            print(f"{stage.name}: skipped")
+            outcome[stage.name] = "skipped"
+            continue
+        key, parts = fingerprint(stage, state)
+        forced = stage.name in force or "all" in force
+        reason = why_run(stage, key, parts, state.stages.get(stage.name), forced)
+        if reason is None:
+            print(f"{stage.name}: unchanged")
+            outcome[stage.name] = "unchanged"
+            continue
+        print(f"{stage.name}: {'would run' if dry_run else 'running'} ({reason})")
+        if dry_run:
+            outcome[stage.name] = "would run"
+            continue
+
+        module, function = stage.target.split(":")
+        start = time.perf_counter()
+        with profiling.span(f"pipeline.{stage.name}"):
+            getattr(import_module(module), function)(list(stage.argv))
+        # Outputs of this stage are inputs of the next, digested once here
+        for path in stage.outputs:
+            if Path(path).is_file():
+                state.digest(path)
+        state.stages[stage.name] = {
+            "fingerprint": key,
+            "parts": parts,
+            "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seconds": round(time.perf_counter() - start, 1),
+        }
+        state.save()
+        outcome[stage.name] = "ran"
+    return outcome
+
+
+def main(argv: list[str] | None = None):
+    parser = ArgumentParser(
+        description="Harvest, process and embed, skipping stages whose code, "
+        "parameters and inputs are unchanged since their last run"
+    )
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--backend", default="torch", choices=BACKENDS)
+    parser.add_argument("--start-year", type=int, help="First year harvested")
+    parser.add_argument(
+        "--force",
+        action="append",
+        default=[],
+        choices=["harvest", "process", "embed", "all"],
+        help="Run a stage even if unchanged; repeat for several",
+    )
+    parser.add_argument(
+        "--skip",
+        action="append",
+        default=[],
+        choices=["harvest", "process", "embed"],
+        help="Do not run a stage, e.g. --skip harvest offline",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only print which stages would run"
+    )
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    state = PipelineState(proj_dir / "data" / STATE_FILE)
+    stages = data_stages(args.model, args.backend, args.start_year)
+    outcome = run_pipeline(
+        stages, state, tuple(args.force), tuple(args.skip), args.dry_run
+    )
+    ran = [name for name, result in outcome.items() if result == "ran"]
+    print(
+        f"Pipeline done in {time.perf_counter() - start:.1f}s, "
+        f"ran: {', '.join(ran) or 'nothing'}",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
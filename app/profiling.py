@@ -0,0 +1,222 @@
+# Run metrics: where a pipeline run spends its time and memory
+# Stages wrap their steps in `span("stage.step")` and count their work with
+# `count(rows=...)`. Both do nothing unless a `Profiler` is active; the CLI starts
+# one with `econ-rag --report <command>` and writes data/runs/<command>-<time>.json:
+# * per span: calls, wall seconds, CPU seconds of the thread, peak RSS at exit
+# * counters (requests, cache hits, rows, tokens, batches, ...)
+# * wall and CPU time and peak RSS of the run, and of its worker processes
+# With --profile cprofile (or pyinstrument) a profile of the main thread is
+# saved next to the report. Only the standard library is imported here.
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+_active: "Profiler | None" = None
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """
+    Peak resident memory of this process (RUSAGE_SELF) or of its waited-for
+    children (RUSAGE_CHILDREN, the largest child) in MB
+    """
+    rss = resource.getrusage(who).ru_maxrss
+    # Bytes on macOS, kB elsewhere
+    return rss / 2**20 if sys.platform == "darwin" else rss / 1024
+
+
+@dataclass
+class SpanStats:
+    calls: int = 0
+    seconds: float = 0.0
+    # CPU time of the thread: far below `seconds` means waiting (HTTP, I/O, locks)
+    cpu_seconds: float = 0.0
+    max_seconds: float = 0.0
+    peak_rss_mb: float = 0.0
+
+    def add(self, seconds: float, cpu_seconds: float, rss_mb: float):
+        self.calls += 1
+        self.seconds += seconds
+        self.cpu_seconds += cpu_seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.peak_rss_mb = max(self.peak_rss_mb, rss_mb)
+
+
+class Profiler:
+    """
+    Collects the spans and counters of one run. Use it as a context manager,
+    which makes it the target of `span` and `count` in every thread.
+
+    Args:
+        name (str): Name of the run, e.g. the CLI command.
+        profile (str, optional): "cprofile" or "pyinstrument" to also profile
+            the calling thread.
+    """
+
+    def __init__(self, name: str, profile: str | None = None):
+        if profile not in (None, *PROFILERS):
+            raise ValueError(f"profile must be one of {PROFILERS}, got {profile!r}")
+        self.name = name
+        self.profile = profile
+        self.spans: dict[str, SpanStats] = {}
+        self.counters: dict[str, int | float] = {}
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._started_at = datetime.now()
+        self._start = self._start_cpu = self._wall = self._cpu = 0.0
+
+    def __enter__(self) -> "Profiler":
+        global _active
+        if _active is not None:
+            raise RuntimeError(f"Profiler {_active.name!r} is already running")
+        if self.profile == "cprofile":
+            import cProfile
+
+            self._profiler = cProfile.Profile()
+        elif self.profile == "pyinstrument":
+            try:
+                from pyinstrument import Profiler as Pyinstrument
+            except ImportError:
+                raise ImportError(
+                    "pyinstrument is missing, install the extra: "
+                    "uv sync --extra profile"
+                ) from None
+            self._profiler = Pyinstrument()
+        self._started_at = datetime.now()
+        self._start = time.perf_counter()
+        self._start_cpu = time.process_time()
+        _active = self
+        if self.profile == "cprofile":
+            self._profiler.enable()
+        elif self.profile == "pyinstrument":
+            self._profiler.start()
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        if self.profile == "cprofile":
+            self._profiler.disable()
+        elif self.profile == "pyinstrument":
+            self._profiler.stop()
+        self._wall = time.perf_counter() - self._start
+        self._cpu = time.process_time() - self._start_cpu
+        _active = None
+
+    def add_span(self, name: str, seconds: float, cpu_seconds: float = 0.0):
+        """Records a span timed elsewhere, e.g. in a worker process"""
+        rss = peak_rss_mb()
+        with self._lock:
+            self.spans.setdefault(name, SpanStats()).add(seconds, cpu_seconds, rss)
+
+    def count(self, **counts: int | float):
+        with self._lock:
+            for key, value in counts.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def report(self) -> dict:
+        """The run as a JSON-serializable dict, slowest spans first"""
+        with self._lock:
+            spans = sorted(self.spans.items(), key=lambda kv: -kv[1].seconds)
+            counters = dict(sorted(self.counters.items()))
+        return {
+            "name": self.name,
+            "started": self._started_at.isoformat(timespec="seconds"),
+            "argv": sys.argv,
+            "pid": os.getpid(),
+            "cpu_count": os.cpu_count(),
+            "wall_seconds": round(self._wall, 4),
+            "cpu_seconds": round(self._cpu, 4),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "children_peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+            "spans": {
+                name: {k: round(v, 4) for k, v in asdict(stats).items()}
+                for name, stats in spans
+            },
+            "counters": counters,
+        }
+
+    def save(self, out_dir: Path) -> Path:
+        """
+        Writes <name>-<start time>.json to `out_dir`, and the profile next to it
+        (.prof for cprofile, e.g. for snakeviz; .html for pyinstrument).
+
+        Returns:
+            Path: The JSON report.
+        """
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"{self.name}-{self._started_at:%Y%m%d-%H%M%S}"
+        report = self.report()
+        if self.profile == "cprofile":
+            self._profiler.dump_stats(out_dir / f"{stem}.prof")
+            report["profile"] = f"{stem}.prof"
+        elif self.profile == "pyinstrument":
+            (out_dir / f"{stem}.html").write_text(self._profiler.output_html())
+            report["profile"] = f"{stem}.html"
+        path = out_dir / f"{stem}.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(report, indent=2))
+        os.replace(tmp, path)
+        return path
+
+
+def active() -> Profiler | None:
+    return _active
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Times the block as `name` in the active profiler, if any"""
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+    start, start_cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        profiler.add_span(
+            name, time.perf_counter() - start, time.thread_time() - start_cpu
+        )
+
+
+def record(name: str, seconds: float, cpu_seconds: float = 0.0):
+    """Adds a span timed elsewhere (e.g. in a worker process) to the active profiler"""
+    profiler = _active
+    if profiler is not None:
+        profiler.add_span(name, seconds, cpu_seconds)
+
+
+def count(**counts: int | float):
+    """Adds to the counters of the active profiler, if any"""
+    profiler = _active
+    if profiler is not None:
+        profiler.count(**counts)
+
+
+def format_report(report: dict) -> str:
+    """A few lines for the terminal: run totals, then the spans"""
+    lines = [
+        f"{report['name']}: {report['wall_seconds']:.1f}s wall, "
+        f"{report['cpu_seconds']:.1f}s CPU, peak RSS {report['peak_rss_mb']:.0f} MB "
+        f"(workers {report['children_peak_rss_mb']:.0f} MB)"
+    ]
+    for name, stats in report["spans"].items():
+        lines.append(
+            f"  {name:<28} {stats['calls']:>7} calls {stats['seconds']:>9.2f}s "
+            f"({stats['cpu_seconds']:.2f}s CPU)"
+        )
+    if report["counters"]:
+        lines.append(
+            "  " + ", ".join(f"{k}={v:g}" for k, v in report["counters"].items())
+        )
+    return "\n".join(lines)
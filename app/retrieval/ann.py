@@ -0,0 +1,266 @@
+# Approximate nearest neighbours with an inverted file index (IVF-flat)
+# k-means splits the normalized embeddings into n_lists clusters; a query only
+# scores the vectors of its nprobe closest clusters. The vectors are stored
+# reordered by cluster, so every inverted list is one contiguous slice of a
+# memory-mapped matrix. Saved next to the artifact in data/embeddings/<model>/ivf/
+# with the row count and fingerprint of the artifact it was built from; an index
+# whose artifact was rewritten since is refused instead of returning wrong rows
+import json
+import os
+import time
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from app.embeddings.artifact import (
+    artifact_dir,
+    artifact_meta,
+    check_built_from,
+    load_artifact,
+)
+from app.retrieval.dense import Retriever, l2_normalize, topk
+
+IVF_DIR = "ivf"
+IVF_FILES = ("centroids", "offsets", "ids", "vectors")
+
+
+def _assign(x: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    """Closest centroid (by inner product) of each row, in chunks to bound memory"""
+    out = np.empty(len(x), dtype=np.int64)
+    for i in range(0, len(x), chunk):
+        out[i : i + chunk] = np.argmax(l2_normalize(x[i : i + chunk]) @ centroids.T, 1)
+    return out
+
+
+def kmeans(
+    x: np.ndarray, n_clusters: int, n_iter: int = 20, seed: int = 0
+) -> np.ndarray:
+    """
+    Spherical k-means: unit-length centroids, assignment by cosine similarity.
+    Uses faiss when it is installed, NumPy otherwise.
+
+    Returns:
+        (n_clusters, d) float32 centroids.
+    """
+    x = l2_normalize(x)
+    try:
+        import faiss
+
+        km = faiss.Kmeans(
+            x.shape[1], n_clusters, niter=n_iter, seed=seed, spherical=True
+        )
+        km.train(x)
+        return l2_normalize(km.centroids)
+    except ImportError:
+        pass
+
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), n_clusters, replace=False)]
+    for _ in range(n_iter):
+        labels = _assign(x, centroids)
+        # Sum the rows of each cluster: sort by label, then add up each run
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=n_clusters)
+        empty = counts == 0
+        sums = np.zeros_like(centroids)
+        starts = np.cumsum(counts) - counts
+        sums[~empty] = np.add.reduceat(x[order], starts[~empty], axis=0)
+        # Empty clusters restart from a random point
+        sums[empty] = x[rng.choice(len(x), empty.sum(), replace=False)]
+        centroids = l2_normalize(sums)
+    return centroids
+
+
+@dataclass
+class IVFIndex:
+    """
+    Args:
+        centroids (np.ndarray): (n_lists, d) unit-length centroids.
+        offsets (np.ndarray): (n_lists + 1,) list i is rows offsets[i]:offsets[i+1].
+        ids (np.ndarray): Row id in the artifact of each stored vector.
+        vectors (np.ndarray): Normalized vectors, ordered by list.
+    """
+
+    centroids: np.ndarray
+    offsets: np.ndarray
+    ids: np.ndarray
+    vectors: np.ndarray
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search_ids(
+        self,
+        queries: np.ndarray,
+        k: int = 10,
+        nprobe: int = 8,
+        candidates: np.ndarray | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Row ids and cosine similarities, both (n_queries, k). Queries with fewer
+        than k candidates in their probed lists are padded with id -1. With
+        `candidates`, other row ids are skipped.
+        """
+        queries = l2_normalize(np.atleast_2d(queries))
+        nprobe = min(nprobe, self.n_lists)
+        probes, _ = topk(queries @ self.centroids.T, nprobe)
+        if candidates is not None:
+            allowed = np.zeros(len(self), dtype=bool)
+            allowed[candidates] = True
+
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for qi, lists in enumerate(probes):
+            slices = [slice(self.offsets[i], self.offsets[i + 1]) for i in lists]
+            cand = np.concatenate([self.vectors[s] for s in slices])
+            cand_ids = np.concatenate([self.ids[s] for s in slices])
+            if candidates is not None:
+                keep = allowed[cand_ids]
+                cand, cand_ids = cand[keep], cand_ids[keep]
+            idx, top = topk(cand @ queries[qi], k)
+            ids[qi, : idx.shape[1]] = cand_ids[idx[0]]
+            scores[qi, : idx.shape[1]] = top[0]
+        return ids, scores
+
+
+def build_ivf(
+    matrix: np.ndarray,
+    n_lists: int | None = None,
+    n_iter: int = 10,
+    sample_size: int | None = None,
+    seed: int = 0,
+) -> IVFIndex:
+    """
+    Trains the centroids on a sample of the rows and files every row under
+    its closest centroid. By default n_lists is about 4 * sqrt(n_rows) and
+    the sample has 64 rows per list.
+    """
+    n_rows = len(matrix)
+    n_lists = n_lists or max(1, int(4 * np.sqrt(n_rows)))
+    n_lists = min(n_lists, n_rows)
+    sample_size = min(sample_size or 64 * n_lists, n_rows)
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(matrix[np.sort(rng.choice(n_rows, sample_size, replace=False))])
+    centroids = kmeans(sample, n_lists, n_iter=n_iter, seed=seed)
+
+    labels = _assign(matrix, centroids)
+    ids = np.argsort(labels, kind="stable")
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(labels, minlength=n_lists))
+    return IVFIndex(centroids, offsets, ids, l2_normalize(matrix[ids]))
+
+
+def save_ivf(index: IVFIndex, directory: Path, meta: dict | None = None) -> Path:
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for name in IVF_FILES:
+        tmp = directory / f"{name}.tmp.npy"
+        np.save(tmp, np.ascontiguousarray(getattr(index, name)))
+        os.replace(tmp, directory / f"{name}.npy")
+    # Manifest last: an index with a manifest is complete
+    manifest = {"n_lists": index.n_lists, "n_rows": len(index), **(meta or {})}
+    tmp = directory / "manifest.json.tmp"
+    tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp, directory / "manifest.json")
+    return directory
+
+
+def load_ivf(directory: Path, artifact_directory: Path | None = None) -> IVFIndex:
+    """
+    Maps the stored vectors read-only; the small arrays are read into memory.
+
+    Args:
+        directory (Path): The index, e.g. data/embeddings/<model>/ivf.
+        artifact_directory (Path, optional): The artifact the index belongs to;
+            a ValueError is raised if the index was built from another version.
+    """
+    directory = Path(directory)
+    if not (directory / "manifest.json").exists():
+        raise FileNotFoundError(f"No IVF index in {directory}")
+    if artifact_directory is not None:
+        check_built_from(directory, artifact_directory, "IVF index", "ann")
+    arrays = {
+        name: np.load(
+            directory / f"{name}.npy", mmap_mode="r" if name == "vectors" else None
+        )
+        for name in IVF_FILES
+    }
+    return IVFIndex(**arrays)
+
+
+class IVFRetriever(Retriever):
+    """
+    Retriever backed by an IVF index instead of a full scan.
+
+    Args:
+        index (IVFIndex): The index.
+        rows (pl.DataFrame, optional): Metadata of each row, by row id.
+        encoder (callable, optional): Turns query texts into vectors, for `query`.
+        nprobe (int): Number of lists scored per query; more is slower but
+            closer to exact search.
+    """
+
+    def __init__(
+        self,
+        index: IVFIndex,
+        rows: pl.DataFrame | None = None,
+        encoder=None,
+        nprobe: int = 8,
+    ):
+        self.index = index
+        self.rows = rows
+        self.encoder = encoder
+        self.nprobe = nprobe
+
+    @classmethod
+    def from_artifact(
+        cls, directory: Path, encoder=None, nprobe: int = 8
+    ) -> "IVFRetriever":
+        rows = load_artifact(directory).rows
+        index = load_ivf(Path(directory) / IVF_DIR, artifact_directory=directory)
+        return cls(index, rows, encoder, nprobe)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def search_ids(
+        self, queries: np.ndarray, k: int = 10, candidates: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        return self.index.search_ids(queries, k, self.nprobe, candidates)
+
+
+def recall_at_k(found: np.ndarray, exact: np.ndarray) -> float:
+    """Share of the exact top-k ids that were found, averaged over queries"""
+    k = exact.shape[1]
+    hits = [len(np.intersect1d(f, e)) for f, e in zip(found, exact)]
+    return float(np.mean(hits) / k)
+
+
+def main(argv: list[str] | None = None):
+    parser = ArgumentParser(description="Build an IVF index next to an artifact")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--lists", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    proj_dir = Path(__file__).parents[2]
+    directory = artifact_dir(proj_dir, args.model)
+    artifact = load_artifact(directory, with_rows=False)
+    start = time.perf_counter()
+    index = build_ivf(artifact.matrix, n_lists=args.lists)
+    save_ivf(index, directory / IVF_DIR, artifact_meta(directory))
+    sizes = np.diff(index.offsets)
+    print(
+        f"Built {index.n_lists} lists over {len(index)} rows in "
+        f"{time.perf_counter() - start:.1f}s, list sizes {sizes.min()}-{sizes.max()}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+# Okapi BM25 over a sparse term-document matrix
+# The BM25 weight of every (term, document) pair is computed once at build time,
+# IDF and length normalization included, so scoring a batch of queries is one
+# sparse matrix product of query term counts with the weight matrix
+# Scores match rank_bm25's BM25Okapi, which scores every document in Python
+import json
+import os
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+from scipy import sparse
+
+from app.retrieval.dense import results_frame, topk
+
+MATRIX_FILE = "bm25.npz"
+VOCAB_FILE = "vocab.json"
+MANIFEST_FILE = "manifest.json"
+
+
+def tokenize(texts: list[str]) -> list[list[str]]:
+    """Tokens of raw texts, tokenized like the tokenized_abstract column"""
+    from app.data_prep.clean import clean_text_expr
+
+    cleaned = pl.DataFrame({"text": texts}, schema={"text": pl.String})
+    cleaned = cleaned.select(clean_text_expr("text").str.split(" "))["text"]
+    return [[t for t in tokens if t] for tokens in cleaned.to_list()]
+
+
+class BM25Index:
+    """
+    Args:
+        weights (sparse.csr_matrix): (n_terms, n_docs) BM25 weight of each term in
+            each document.
+        vocab (list[str]): Term of each row of `weights`.
+        rows (pl.DataFrame, optional): Metadata of each document, for `search`.
+    """
+
+    def __init__(
+        self,
+        weights: sparse.csr_matrix,
+        vocab: list[str],
+        rows: pl.DataFrame | None = None,
+    ):
+        self.weights = weights
+        self.vocab = vocab
+        self.term_ids = {t: i for i, t in enumerate(vocab)}
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return self.weights.shape[1]
+
+    def query_matrix(self, queries: list[list[str]]) -> sparse.csr_matrix:
+        """(n_queries, n_terms) term counts; terms not in the vocabulary are dropped"""
+        row, col = [], []
+        for i, tokens in enumerate(queries):
+            ids = [self.term_ids[t] for t in tokens if t in self.term_ids]
+            row += [i] * len(ids)
+            col += ids
+        data = np.ones(len(row), dtype=np.float32)
+        shape = (len(queries), len(self.vocab))
+        # Duplicate (row, col) pairs are summed, a term twice in a query counts twice
+        return sparse.csr_matrix((data, (row, col)), shape=shape)
+
+    def scores(self, queries: list[str] | list[list[str]]) -> sparse.csr_matrix:
+        """
+        (n_queries, n_docs) BM25 scores, only documents sharing a term with the
+        query are stored. Queries are raw texts or lists of tokens.
+        """
+        if queries and isinstance(queries[0], str):
+            queries = tokenize(queries)
+        return (self.query_matrix(queries) @ self.weights).tocsr()
+
+    def search_ids(
+        self,
+        queries: list[str] | list[list[str]],
+        k: int = 10,
+        candidates: np.ndarray | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Document ids and scores, both (n_queries, k). Queries matching fewer than
+        k documents are padded with id -1. With `candidates`, other document ids
+        are skipped.
+        """
+        scores = self.scores(queries)
+        if candidates is not None:
+            allowed = np.zeros(len(self), dtype=bool)
+            allowed[candidates] = True
+        ids = np.full((scores.shape[0], k), -1, dtype=np.int64)
+        top = np.full((scores.shape[0], k), -np.inf, dtype=np.float32)
+        for i in range(scores.shape[0]):
+            start, stop = scores.indptr[i], scores.indptr[i + 1]
+            docs, values = scores.indices[start:stop], scores.data[start:stop]
+            if candidates is not None:
+                keep = allowed[docs]
+                docs, values = docs[keep], values[keep]
+            idx, values = topk(values, k)
+            ids[i, : idx.shape[1]] = docs[idx[0]]
+            top[i, : idx.shape[1]] = values[0]
+        return ids, top
+
+    def search(
+        self,
+        queries: list[str] | list[list[str]],
+        k: int = 10,
+        candidates: np.ndarray | None = None,
+    ) -> list[pl.DataFrame]:
+        """One DataFrame per query: rank, row_id, score and the row metadata"""
+        ids, scores = self.search_ids(queries, k, candidates)
+        return [results_frame(i, s, self.rows) for i, s in zip(ids, scores)]
+
+
+def build_bm25(
+    tokenized: pl.Series | list[str],
+    k1: float = 1.5,
+    b: float = 0.75,
+    epsilon: float = 0.25,
+    rows: pl.DataFrame | None = None,
+) -> BM25Index:
+    """
+    Builds the index from space separated tokens, e.g. the tokenized_abstract
+    column. Parameters and IDF are those of rank_bm25's BM25Okapi: terms in
+    more than half of the documents get epsilon times the average IDF.
+    """
+    docs = pl.Series("tokens", tokenized, dtype=pl.String).str.split(" ")
+    docs = docs.list.eval(pl.element().filter(pl.element() != ""))
+    doc_len = docs.list.len().to_numpy().astype(np.float32)
+    n_docs = len(docs)
+
+    tf = (
+        docs.to_frame()
+        .with_row_index("doc")
+        .explode("tokens")
+        .drop_nulls()
+        .group_by("doc", "tokens")
+        .len("tf")
+    )
+    vocab = tf["tokens"].unique().sort()
+    tf = tf.join(vocab.to_frame().with_row_index("term"), on="tokens")
+    term, doc = tf["term"].to_numpy(), tf["doc"].to_numpy()
+    freq = tf["tf"].to_numpy().astype(np.float32)
+
+    df = np.bincount(term, minlength=len(vocab))
+    idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+    if len(vocab):
+        idf[idf < 0] = epsilon * idf.mean()
+
+    # No documents, or only empty ones: no term weights to normalize, and the
+    # mean length must not be 0
+    avg_len = max(float(doc_len.mean()), 1.0) if n_docs else 1.0
+    norm = k1 * (1 - b + b * doc_len / avg_len)
+    weights = idf[term] * freq * (k1 + 1) / (freq + norm[doc])
+    matrix = sparse.csr_matrix(
+        (weights.astype(np.float32), (term, doc)), shape=(len(vocab), n_docs)
+    )
+    return BM25Index(matrix, vocab.to_list(), rows)
+
+
+def save_bm25(index: BM25Index, directory: Path, meta: dict | None = None) -> Path:
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    tmp = directory / f"{MATRIX_FILE}.tmp.npz"
+    sparse.save_npz(tmp, index.weights, compressed=False)
+    os.replace(tmp, directory / MATRIX_FILE)
+    tmp = directory / f"{VOCAB_FILE}.tmp"
+    tmp.write_text(json.dumps(index.vocab))
+    os.replace(tmp, directory / VOCAB_FILE)
+    # Manifest last: an index with a manifest is complete
+    manifest = {"n_docs": len(index), "n_terms": len(index.vocab), **(meta or {})}
+    tmp = directory / f"{MANIFEST_FILE}.tmp"
+    tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp, directory / MANIFEST_FILE)
+    return directory
+
+
+def load_bm25(directory: Path, rows: pl.DataFrame | None = None) -> BM25Index:
+    directory = Path(directory)
+    if not (directory / MANIFEST_FILE).exists():
+        raise FileNotFoundError(f"No BM25 index in {directory}")
+    weights = sparse.load_npz(directory / MATRIX_FILE).tocsr()
+    vocab = json.loads((directory / VOCAB_FILE).read_text())
+    return BM25Index(weights, vocab, rows)
+
+
+def main(argv: list[str] | None = None):
+    parser = ArgumentParser(description="Build the BM25 index of the abstracts")
+    parser.add_argument("--k1", type=float, default=1.5)
+    parser.add_argument("--b", type=float, default=0.75)
+    args = parser.parse_args(argv)
+
+    proj_dir = Path(__file__).parents[2]
+    df = pl.read_parquet(proj_dir / "data" / "abstracts_clean.parquet")
+    start = time.perf_counter()
+    index = build_bm25(df["tokenized_abstract"], k1=args.k1, b=args.b)
+    out_dir = save_bm25(index, proj_dir / "data" / "bm25", vars(args))
+    print(
+        f"Indexed {len(index)} abstracts, {len(index.vocab)} terms, "
+        f"in {time.perf_counter() - start:.1f}s -> {out_dir}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# Dense retrieval over an embedding matrix
+# The matrix is L2-normalized once, when the artifact is written (or when the
+# retriever is built from other vectors), so cosine similarity for a batch of
+# queries is a single matrix multiply, and top-k uses argpartition instead of
+# sorting every score. A normalized artifact is scored straight from its memmap;
+# float16 rows are converted in blocks, never as a whole copy in RAM
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from app.embeddings.artifact import l2_normalize, load_artifact
+
+# Rows converted to float32 at a time when scoring a float16 matrix
+SCORE_BLOCK = 65_536
+
+
+def similarities(queries: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    """(q, n) dot products; a matrix that is not float32 is converted by blocks"""
+    if matrix.dtype == np.float32:
+        return queries @ matrix.T
+    scores = np.empty((len(queries), len(matrix)), dtype=np.float32)
+    for i in range(0, len(matrix), SCORE_BLOCK):
+        block = np.asarray(matrix[i : i + SCORE_BLOCK], dtype=np.float32)
+        scores[:, i : i + SCORE_BLOCK] = queries @ block.T
+    return scores
+
+
+def topk(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Indices and values of the k largest scores per row, best first.
+    Works on a (n,) or (q, n) array; returns (q, k) arrays.
+    """
+    scores = np.atleast_2d(scores)
+    k = min(k, scores.shape[1])
+    if k == 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(scores.dtype)
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(scores, idx, axis=1)
+    order = np.argsort(-top, axis=1, kind="stable")
+    idx = np.take_along_axis(idx, order, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    return idx, top
+
+
+def results_frame(
+    ids: np.ndarray, scores: np.ndarray, rows: pl.DataFrame | None = None
+) -> pl.DataFrame:
+    """rank, row_id, score and the row metadata of one query; ids < 0 are padding"""
+    found = ids >= 0
+    ids, scores = ids[found], scores[found]
+    df = pl.DataFrame(
+        {
+            "rank": np.arange(1, len(ids) + 1),
+            "row_id": ids.astype(np.uint32),
+            "score": scores.astype(np.float32),
+        }
+    )
+    if rows is None:
+        return df
+    meta = rows[ids].drop("row_id", strict=False)
+    return pl.concat([df, meta], how="horizontal")
+
+
+class Retriever:
+    """
+    Exact cosine similarity search.
+
+    Args:
+        matrix (np.ndarray): (n, d) embeddings, e.g. the memmap of an artifact.
+        rows (pl.DataFrame, optional): Metadata of each row, in matrix order.
+        encoder (callable, optional): Turns query texts into vectors, for `query`.
+        normalized (bool): The rows are already L2-normalized, and `matrix` is
+            used as it is (no copy); otherwise a normalized float32 copy.
+    """
+
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        rows: pl.DataFrame | None = None,
+        encoder=None,
+        normalized: bool = False,
+    ):
+        self.matrix = matrix if normalized else l2_normalize(matrix)
+        self.rows = rows
+        self.encoder = encoder
+
+    @classmethod
+    def from_artifact(cls, directory: Path, encoder=None) -> "Retriever":
+        artifact = load_artifact(directory)
+        normalized = artifact.manifest.get("normalized", False)
+        return cls(artifact.matrix, artifact.rows, encoder, normalized)
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def search_ids(
+        self, queries: np.ndarray, k: int = 10, candidates: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Row ids and cosine similarities, both (n_queries, k). With `candidates`,
+        only those row ids are scored.
+        """
+        queries = l2_normalize(np.atleast_2d(queries))
+        if candidates is None:
+            return topk(similarities(queries, self.matrix), k)
+        idx, scores = topk(similarities(queries, self.matrix[candidates]), k)
+        return candidates[idx], scores
+
+    def search(
+        self, queries: np.ndarray, k: int = 10, candidates: np.ndarray | None = None
+    ) -> list[pl.DataFrame]:
+        """One DataFrame per query: rank, row_id, score and the row metadata"""
+        ids, scores = self.search_ids(queries, k, candidates)
+        return [self._results(i, s) for i, s in zip(ids, scores)]
+
+    def query(
+        self, texts: list[str], k: int = 10, candidates: np.ndarray | None = None
+    ) -> list[pl.DataFrame]:
+        return self.search(self.encode(texts), k, candidates)
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        if self.encoder is None:
+            raise ValueError("Retriever has no encoder, use search() with vectors")
+        return self.encoder(texts)
+
+    def _results(self, ids: np.ndarray, scores: np.ndarray) -> pl.DataFrame:
+        return results_frame(ids, scores, self.rows)
+
+
+# Indexes `load_retriever` can search: the full matrix, an IVF index of it
+# (`econ-rag index ann`) that scores only the closest lists, or quantized codes
+# of it (`econ-rag index quantize`) that shortlist rows for exact rescoring
+INDEX_KINDS = ("flat", "ivf", "int8", "binary")
+
+
+def load_retriever(
+    directory: Path,
+    encoder=None,
+    index: str = "flat",
+    rescore: int = 10,
+    nprobe: int = 8,
+) -> Retriever:
+    """
+    Retriever of an artifact over one of its indexes.
+
+    Args:
+        directory (Path): The artifact, see `artifact_dir`.
+        encoder (callable, optional): Turns query texts into vectors, for `query`.
+        index (str): One of `INDEX_KINDS`.
+        rescore (int): Shortlist size of the quantized indexes as a multiple of k.
+        nprobe (int): Lists of the IVF index scored per query.
+    """
+    if index not in INDEX_KINDS:
+        raise ValueError(f"Unknown index {index}, choose one of {INDEX_KINDS}")
+    if index == "flat":
+        return Retriever.from_artifact(directory, encoder)
+    # Both modules import this one
+    if index == "ivf":
+        from app.retrieval.ann import IVFRetriever
+
+        return IVFRetriever.from_artifact(directory, encoder, nprobe)
+    from app.retrieval.quantize import QuantizedRetriever
+
+    return QuantizedRetriever.from_artifact(directory, encoder, index, rescore)
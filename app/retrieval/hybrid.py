@@ -0,0 +1,160 @@
+# Hybrid retrieval: BM25 and dense results fused by reciprocal rank
+# Metadata filters (journal, year, author) are turned into row ids before
+# scoring, so both retrievers only look at matching rows. The two retrievers run
+# in parallel threads; NumPy and torch release the GIL while they compute
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from app.embeddings.artifact import load_artifact
+from app.retrieval.bm25 import BM25Index, load_bm25
+from app.retrieval.dense import Retriever, results_frame
+
+
+@dataclass(frozen=True)
+class MetadataFilter:
+    """
+    Row predicates on the columns of abstracts_clean.parquet. Journals and
+    authors match case-insensitively; an author matches on any part of a name.
+    """
+
+    journals: tuple[str, ...] | None = None
+    year_from: int | None = None
+    year_to: int | None = None
+    authors: tuple[str, ...] | None = None
+
+    def expr(self) -> pl.Expr:
+        predicates = [pl.lit(True)]
+        if self.journals:
+            journals = [j.lower() for j in self.journals]
+            predicates.append(pl.col("journal").str.to_lowercase().is_in(journals))
+        if self.year_from is not None:
+            predicates.append(pl.col("year") >= self.year_from)
+        if self.year_to is not None:
+            predicates.append(pl.col("year") <= self.year_to)
+        if self.authors:
+            pattern = "|".join(re.escape(a.lower()) for a in self.authors)
+            predicates.append(
+                pl.col("authors")
+                .list.eval(pl.element().str.to_lowercase().str.contains(pattern))
+                .list.any()
+            )
+        return pl.all_horizontal(predicates)
+
+    def row_ids(self, rows: pl.DataFrame) -> np.ndarray:
+        """Sorted ids of the matching rows"""
+        if "row_id" not in rows.columns:
+            rows = rows.with_row_index("row_id")
+        return rows.filter(self.expr())["row_id"].to_numpy().astype(np.int64)
+
+
+def reciprocal_rank_fusion(
+    rankings: list[np.ndarray], k: int = 10, k_rrf: int = 60
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Fuses (n_queries, depth) id rankings: a row scores sum(1 / (k_rrf + rank))
+    over the rankings it appears in. Ids < 0 are padding and ignored.
+
+    Returns:
+        Ids and fused scores, both (n_queries, k), padded with id -1.
+    """
+    n_queries = rankings[0].shape[0]
+    ids = np.full((n_queries, k), -1, dtype=np.int64)
+    scores = np.zeros((n_queries, k), dtype=np.float32)
+    for qi in range(n_queries):
+        ranked = [r[qi] for r in rankings]
+        found = np.concatenate(ranked)
+        weight = np.concatenate(
+            [1 / (k_rrf + np.arange(1, len(r) + 1)) for r in ranked]
+        )
+        keep = found >= 0
+        unique, inverse = np.unique(found[keep], return_inverse=True)
+        fused = np.bincount(inverse, weights=weight[keep])
+        # Ties go to the lower row id, like a stable sort
+        order = np.argsort(-fused, kind="stable")[:k]
+        ids[qi, : len(order)] = unique[order]
+        scores[qi, : len(order)] = fused[order]
+    return ids, scores
+
+
+class HybridRetriever:
+    """
+    Args:
+        dense (Retriever): Embedding retriever, exact or IVF, with an encoder.
+        bm25 (BM25Index): Lexical index over the same rows in the same order.
+        rows (pl.DataFrame): Metadata of each row, used by the filters.
+        depth (int): Results taken from each retriever before fusion.
+        k_rrf (int): Rank offset of reciprocal rank fusion.
+    """
+
+    def __init__(
+        self,
+        dense: Retriever,
+        bm25: BM25Index,
+        rows: pl.DataFrame,
+        depth: int = 100,
+        k_rrf: int = 60,
+    ):
+        if not len(dense) == len(bm25) == len(rows):
+            raise ValueError(
+                f"Dense ({len(dense)}), BM25 ({len(bm25)}) and rows ({len(rows)}) "
+                "must index the same rows"
+            )
+        self.dense = dense
+        self.bm25 = bm25
+        self.rows = rows
+        self.depth = depth
+        self.k_rrf = k_rrf
+        self._pool = ThreadPoolExecutor(max_workers=2)
+
+    @classmethod
+    def from_dirs(
+        cls, artifact: Path, bm25: Path, encoder, **kwargs
+    ) -> "HybridRetriever":
+        """Exact dense retriever over an embedding artifact plus a saved BM25 index"""
+        rows = load_artifact(artifact).rows
+        dense = Retriever.from_artifact(artifact, encoder)
+        return cls(dense, load_bm25(bm25), rows, **kwargs)
+
+    def search_ids(
+        self,
+        texts: list[str],
+        k: int = 10,
+        filters: MetadataFilter | None = None,
+        vectors: np.ndarray | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Fused row ids and RRF scores, both (n_queries, k). `vectors` are the
+        query embeddings if they are already known, otherwise the dense
+        retriever's encoder embeds `texts`.
+        """
+        candidates = filters.row_ids(self.rows) if filters else None
+        if candidates is not None and len(candidates) == 0:
+            return (
+                np.full((len(texts), k), -1, dtype=np.int64),
+                np.zeros((len(texts), k), dtype=np.float32),
+            )
+
+        def dense_ids():
+            queries = self.dense.encode(texts) if vectors is None else vectors
+            return self.dense.search_ids(queries, self.depth, candidates)[0]
+
+        dense = self._pool.submit(dense_ids)
+        lexical = self._pool.submit(self.bm25.search_ids, texts, self.depth, candidates)
+        rankings = [dense.result(), lexical.result()[0]]
+        return reciprocal_rank_fusion(rankings, k, self.k_rrf)
+
+    def search(
+        self,
+        texts: list[str],
+        k: int = 10,
+        filters: MetadataFilter | None = None,
+        vectors: np.ndarray | None = None,
+    ) -> list[pl.DataFrame]:
+        """One DataFrame per query: rank, row_id, RRF score and the row metadata"""
+        ids, scores = self.search_ids(texts, k, filters, vectors)
+        return [results_frame(i, s, self.rows) for i, s in zip(ids, scores)]
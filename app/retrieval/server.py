@@ -0,0 +1,388 @@
+# Local retrieval service
+# Loads the encoder, the embedding matrix and the metadata once and answers
+# queries over HTTP:
+# * POST /query {"query": "...", "k": 10, "filters": {...}, "hybrid": false}
+# * GET /health, GET /metrics
+# Concurrent queries are collected for a few milliseconds into one batch, which
+# shares one encoder forward pass and one matrix multiply
+# Run with: uv run -m app.retrieval.server --model all-MiniLM-L6-v2
+import json
+import queue
+import threading
+import time
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+from app.embeddings.artifact import artifact_dir
+from app.embeddings.encoders import BACKENDS, load_encoder
+from app.embeddings.query_cache import CachedEncoder
+from app.retrieval.bm25 import load_bm25
+from app.retrieval.dense import INDEX_KINDS, Retriever, load_retriever, results_frame
+from app.retrieval.hybrid import HybridRetriever, MetadataFilter
+
+RESULT_COLUMNS = [
+    "rank",
+    "row_id",
+    "score",
+    "title",
+    "doi",
+    "journal",
+    "year",
+    "authors",
+]
+
+
+class MicroBatcher:
+    """
+    Calls `fn(items) -> results` on batches of submitted items from one worker
+    thread. A batch starts with the first waiting item and closes after
+    `window_ms` or at `max_batch` items. A result that is an exception is
+    raised to the caller of its item only; if `fn` raises, every item fails.
+    """
+
+    def __init__(self, fn, window_ms: float = 5.0, max_batch: int = 64):
+        self.fn = fn
+        self.window = window_ms / 1e3
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        fut = Future()
+        self._queue.put((item, fut))
+        return fut
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            items, futures = zip(*batch)
+            try:
+                results = self.fn(list(items))
+            except Exception as e:
+                for fut in futures:
+                    fut.set_exception(e)
+                continue
+            for fut, result in zip(futures, results):
+                if isinstance(result, Exception):
+                    fut.set_exception(result)
+                else:
+                    fut.set_result(result)
+
+
+class LatencyMetrics:
+    """Request counts, and batch sizes and latencies of the last `window` requests"""
+
+    def __init__(self, window: int = 10_000):
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.latencies_ms = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, latency_ms: float, error: bool = False):
+        with self._lock:
+            self.requests += 1
+            self.errors += error
+            self.latencies_ms.append(latency_ms)
+
+    def observe_batch(self, size: int):
+        with self._lock:
+            self.batches += 1
+            self.batch_sizes.append(size)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = np.array(self.latencies_ms)
+            sizes = np.array(self.batch_sizes)
+            uptime = time.time() - self.started
+            snapshot = {
+                "uptime_s": round(uptime, 1),
+                "requests": self.requests,
+                "errors": self.errors,
+                "batches": self.batches,
+                "requests_per_sec": round(self.requests / uptime, 2),
+                "mean_batch_size": round(float(sizes.mean()), 2) if len(sizes) else 0,
+            }
+        for p in (50, 95, 99):
+            value = np.percentile(latencies, p) if len(latencies) else 0.0
+            snapshot[f"p{p}_ms"] = round(float(value), 2)
+        return snapshot
+
+
+@dataclass
+class Query:
+    text: str
+    k: int = 10
+    filters: MetadataFilter | None = None
+    hybrid: bool = False
+
+    @classmethod
+    def from_json(cls, body: dict) -> "Query":
+        """Raises a ValueError on a malformed body, answered with a 400"""
+        if not isinstance(body, dict):
+            raise ValueError("Body must be a JSON object")
+        if not isinstance(body.get("query"), str) or not body["query"].strip():
+            raise ValueError("Body needs a non-empty 'query' string")
+        k = body.get("k", 10)
+        if not _is_int(k) or k < 1:
+            raise ValueError("'k' must be a positive integer")
+        filters = body.get("filters") or {}
+        if not isinstance(filters, dict):
+            raise ValueError("'filters' must be an object")
+        for name in ("year_from", "year_to"):
+            if filters.get(name) is not None and not _is_int(filters[name]):
+                raise ValueError(f"'filters.{name}' must be an integer")
+        for name in ("journals", "authors"):
+            values = filters.get(name)
+            if values is not None and not (
+                isinstance(values, list) and all(isinstance(v, str) for v in values)
+            ):
+                raise ValueError(f"'filters.{name}' must be a list of strings")
+        if filters:
+            filters = MetadataFilter(
+                journals=tuple(filters.get("journals") or ()) or None,
+                year_from=filters.get("year_from"),
+                year_to=filters.get("year_to"),
+                authors=tuple(filters.get("authors") or ()) or None,
+            )
+        hybrid = bool(body.get("hybrid"))
+        return cls(body["query"], k, filters or None, hybrid)
+
+
+def _is_int(value) -> bool:
+    # JSON true and false are bools, a subclass of int
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class QueryService:
+    """
+    Args:
+        retriever (Retriever): Dense retriever with an encoder and row metadata.
+        hybrid (HybridRetriever, optional): For queries with "hybrid": true.
+        window_ms (float): How long a batch waits for more queries.
+        max_batch (int): Largest batch.
+    """
+
+    def __init__(
+        self,
+        retriever: Retriever,
+        hybrid: HybridRetriever | None = None,
+        window_ms: float = 5.0,
+        max_batch: int = 64,
+        model: str | None = None,
+    ):
+        self.retriever = retriever
+        self.hybrid = hybrid
+        self.model = model
+        self.metrics = LatencyMetrics()
+        self.batcher = MicroBatcher(self._run_batch, window_ms, max_batch)
+
+    def query(self, query: Query) -> list[dict]:
+        if query.hybrid and self.hybrid is None:
+            raise ValueError("Server was started without a BM25 index")
+        return self.batcher.submit(query).result()
+
+    def _run_batch(self, queries: list[Query]) -> list[list[dict] | Exception]:
+        """
+        Results of each query, or the exception it raised: a query that fails
+        does not fail the others of its batch
+        """
+        self.metrics.observe_batch(len(queries))
+        results = [None] * len(queries)
+        texts = [q.text for q in queries]
+        try:
+            # One forward pass for the whole batch
+            vectors = list(self.retriever.encode(texts))
+        except Exception:
+            # Find the queries the encoder fails on
+            vectors = [self._try(self.retriever.encode, [text]) for text in texts]
+            vectors = [v if isinstance(v, Exception) else v[0] for v in vectors]
+            for i, vector in enumerate(vectors):
+                if isinstance(vector, Exception):
+                    results[i] = vector
+        plain = [
+            i
+            for i, q in enumerate(queries)
+            if results[i] is None and not q.filters and not q.hybrid
+        ]
+        if plain:
+            # One matrix multiply for all unfiltered dense queries
+            k = max(queries[i].k for i in plain)
+            found = self._try(
+                self.retriever.search_ids, np.stack([vectors[i] for i in plain]), k
+            )
+            # Should the batch fail, its queries are searched one by one below
+            if not isinstance(found, Exception):
+                ids, scores = found
+                for j, i in enumerate(plain):
+                    k_i = queries[i].k
+                    results[i] = self._to_json(ids[j, :k_i], scores[j, :k_i])
+        for i, q in enumerate(queries):
+            if results[i] is None:
+                results[i] = self._try(self._search_one, q, vectors[i])
+        return results
+
+    def _search_one(self, q: Query, vector: np.ndarray) -> list[dict]:
+        if q.hybrid:
+            ids, scores = self.hybrid.search_ids([q.text], q.k, q.filters, vector[None])
+        else:
+            candidates = q.filters.row_ids(self.retriever.rows) if q.filters else None
+            ids, scores = self.retriever.search_ids(vector, q.k, candidates)
+        return self._to_json(ids[0], scores[0])
+
+    @staticmethod
+    def _try(fn, *args):
+        try:
+            return fn(*args)
+        except Exception as e:
+            return e
+
+    def _to_json(self, ids: np.ndarray, scores: np.ndarray) -> list[dict]:
+        df = results_frame(ids, scores, self.retriever.rows)
+        return df.select(c for c in RESULT_COLUMNS if c in df.columns).to_dicts()
+
+    def metrics_snapshot(self) -> dict:
+        snapshot = self.metrics.snapshot()
+        encoder = self.retriever.encoder
+        if hasattr(encoder, "stats"):
+            snapshot["query_cache"] = encoder.stats()
+        return snapshot
+
+    def health(self) -> dict:
+        return {"status": "ok", "model": self.model, "rows": len(self.retriever)}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    server: "QueryServer"
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == "/health":
+            self._send(200, service.health())
+        elif self.path == "/metrics":
+            self._send(200, service.metrics_snapshot())
+        else:
+            self._send(404, {"error": f"No route {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/query":
+            self._send(404, {"error": f"No route {self.path}"})
+            return
+        start = time.perf_counter()
+        service = self.server.service
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            query = Query.from_json(json.loads(self.rfile.read(length)))
+            results = service.query(query)
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {"error": str(e)})
+            return
+        except Exception as e:
+            service.metrics.observe((time.perf_counter() - start) * 1e3, error=True)
+            self._send(500, {"error": str(e)})
+            return
+        took_ms = (time.perf_counter() - start) * 1e3
+        service.metrics.observe(took_ms)
+        self._send(200, {"results": results, "took_ms": round(took_ms, 2)})
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], service: QueryService):
+        super().__init__(address, QueryHandler)
+        self.service = service
+
+
+def main(argv: list[str] | None = None):
+    parser = ArgumentParser(description="Serve retrieval queries over HTTP")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--backend", default="torch", choices=BACKENDS)
+    parser.add_argument(
+        "--index",
+        default="flat",
+        choices=INDEX_KINDS,
+        help="flat scans the embeddings; ivf scores the closest lists of econ-rag "
+        "index ann; int8 and binary scan the quantized codes of econ-rag index "
+        "quantize and rescore a shortlist",
+    )
+    parser.add_argument(
+        "--nprobe", type=int, default=8, help="Lists scored per query with ivf"
+    )
+    parser.add_argument(
+        "--rescore", type=int, default=10, help="Shortlist of int8/binary, x k"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--window-ms", type=float, default=5.0)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--cache-size", type=int, default=10_000)
+    parser.add_argument("--no-disk-cache", action="store_true")
+    args = parser.parse_args(argv)
+
+    proj_dir = Path(__file__).parents[2]
+    start = time.perf_counter()
+    encoder = load_encoder(args.model, args.backend)
+    encoder(["warm up"])
+    cache_dir = None if args.no_disk_cache else proj_dir / "data" / "query_cache"
+    encoder = CachedEncoder(
+        encoder,
+        args.model,
+        args.cache_size,
+        cache_dir,
+        backend=args.backend,
+    )
+    retriever = load_retriever(
+        artifact_dir(proj_dir, args.model),
+        encoder,
+        args.index,
+        rescore=args.rescore,
+        nprobe=args.nprobe,
+    )
+    hybrid = None
+    bm25_dir = proj_dir / "data" / "bm25"
+    if (bm25_dir / "manifest.json").exists():
+        hybrid = HybridRetriever(retriever, load_bm25(bm25_dir), retriever.rows)
+    service = QueryService(
+        retriever, hybrid, args.window_ms, args.max_batch, model=args.model
+    )
+    server = QueryServer((args.host, args.port), service)
+    print(
+        f"Loaded {len(retriever)} rows ({args.index}) in "
+        f"{time.perf_counter() - start:.1f}s, "
+        f"hybrid {'on' if hybrid else 'off'}, serving on http://{args.host}:{args.port}"
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
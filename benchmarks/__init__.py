@@ -0,0 +1 @@
+# Offline benchmarks of the pipeline, see benchmarks/__main__.py
@@ -0,0 +1,229 @@
+# Benchmark runner
+# python -m benchmarks run --items 100000 runs the scenarios of benchmarks.scenarios
+# on a synthetic Crossref corpus and writes wall time, throughput and peak memory
+# of each to benchmarks/results/<time>.json. Every scenario runs in its own process,
+# so its peak memory is its own and nothing stays warm between scenarios; the
+# scenarios of a run share a work directory, later ones reuse what earlier ones
+# wrote (the raw dataset, abstracts_clean.parquet). A temp work directory is
+# removed at the end of the run; one given with --workdir is kept.
+# python -m benchmarks compare BASE NEW prints both runs side by side and exits
+# with 1 if a scenario got slower, or took more memory, than the thresholds allow.
+# Everything runs offline: no Crossref, no model download
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from importlib.util import find_spec
+from pathlib import Path
+
+proj_dir = Path(__file__).parents[1]
+results_dir = proj_dir / "benchmarks" / "results"
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=proj_dir,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def run_scenario(name: str, workdir: Path, n_items: int, seed: int, embed_items: int):
+    """Runs one scenario in this process, returns its measurements"""
+    from app.profiling import peak_rss_mb
+    from benchmarks.scenarios import SCENARIOS, Context, Timer
+
+    scenario = SCENARIOS[name]
+    missing = [m for m in scenario.requires if find_spec(m) is None]
+    if missing:
+        return {"skipped": f"{', '.join(missing)} not installed"}
+    ctx = Context(Path(workdir), n_items, seed, embed_items)
+    timer = Timer()
+    units = scenario.run(ctx, timer)
+    return {
+        "seconds": round(timer.seconds, 4),
+        "units": units,
+        "unit": scenario.unit,
+        "throughput": round(units / timer.seconds, 1) if timer.seconds else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def run(args) -> dict:
+    from benchmarks.scenarios import SCENARIOS
+
+    names = args.scenario or list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    # In run order, whatever the order of --scenario
+    names = [name for name in SCENARIOS if name in names]
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="econ-rag-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    results = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "items": args.items,
+            "seed": args.seed,
+            "embed_items": args.embed_items,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "scenarios": {},
+    }
+    try:
+        for name in names:
+            print(f"{name}...", end=" ", file=sys.stderr, flush=True)
+            command = [sys.executable, "-m", "benchmarks", "_scenario", name]
+            command += ["--workdir", str(workdir), "--items", str(args.items)]
+            command += ["--seed", str(args.seed)]
+            command += ["--embed-items", str(args.embed_items)]
+            out = subprocess.run(command, cwd=proj_dir, capture_output=True, text=True)
+            if out.returncode:
+                result = {"failed": out.stderr.strip().splitlines()[-1:]}
+            else:
+                result = json.loads(out.stdout.strip().splitlines()[-1])
+            results["scenarios"][name] = result
+            print(_describe(result), file=sys.stderr)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    out_file = args.out or results_dir / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_file.with_suffix(".tmp")
+    tmp.write_text(json.dumps(results, indent=2))
+    os.replace(tmp, out_file)
+    print(f"Results in {out_file}", file=sys.stderr)
+    return results
+
+
+def _describe(result: dict) -> str:
+    if "skipped" in result:
+        return f"skipped ({result['skipped']})"
+    if "failed" in result:
+        return f"failed: {' '.join(result['failed'])}"
+    return (
+        f"{result['seconds']:.2f}s, {result['throughput']} {result['unit']}/s, "
+        f"{result['peak_rss_mb']:.0f} MB"
+    )
+
+
+def compare(
+    base: dict,
+    new: dict,
+    threshold: float = 0.10,
+    memory_threshold: float = 0.20,
+) -> tuple[list[str], list[str]]:
+    """
+    Compares two runs scenario by scenario.
+
+    Args:
+        base (dict): Results of the run to compare against.
+        new (dict): Results of the new run.
+        threshold (float): Relative drop of throughput counted as a regression.
+        memory_threshold (float): Relative growth of peak memory counted as a
+            regression.
+
+    Returns:
+        list[str]: One line per scenario of both runs.
+        list[str]: The regressions.
+    """
+    lines = [
+        f"{'scenario':<16} {'base/s':>12} {'new/s':>12} {'change':>8} "
+        f"{'base MB':>8} {'new MB':>8}"
+    ]
+    regressions = []
+    if base["meta"]["items"] != new["meta"]["items"]:
+        lines.append(
+            f"Runs of {base['meta']['items']} and {new['meta']['items']} items, "
+            "throughputs may not be comparable"
+        )
+    for name, b in base["scenarios"].items():
+        n = new["scenarios"].get(name)
+        if n is None or not b.get("throughput"):
+            continue
+        if not n.get("throughput"):
+            lines.append(f"{name:<16} {b['throughput']:>12} {_describe(n):>12}")
+            if "failed" in n:
+                regressions.append(f"{name}: {_describe(n)}")
+            continue
+        change = n["throughput"] / b["throughput"] - 1
+        lines.append(
+            f"{name:<16} {b['throughput']:>12} {n['throughput']:>12} "
+            f"{change:>+8.1%} {b['peak_rss_mb']:>8.0f} {n['peak_rss_mb']:>8.0f}"
+        )
+        if change < -threshold:
+            regressions.append(f"{name}: throughput {change:+.1%}")
+        memory = n["peak_rss_mb"] / b["peak_rss_mb"] - 1
+        if memory > memory_threshold:
+            regressions.append(f"{name}: peak memory {memory:+.1%}")
+    return lines, regressions
+
+
+def main(argv: list[str] | None = None):
+    parser = ArgumentParser(
+        prog="python -m benchmarks", description="Offline benchmarks of the pipeline"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run benchmark scenarios")
+    scenario_parser = commands.add_parser("_scenario")
+    for p in (run_parser, scenario_parser):
+        p.add_argument("--items", type=int, default=10_000, help="Synthetic works")
+        p.add_argument("--seed", type=int, default=0)
+        p.add_argument(
+            "--embed-items", type=int, default=2000, help="Abstracts to embed"
+        )
+        p.add_argument(
+            "--workdir", type=Path, help="Where inputs are generated, a temp dir"
+        )
+    run_parser.add_argument(
+        "--scenario", action="append", help="Repeat for several, all by default"
+    )
+    run_parser.add_argument("--out", type=Path, help="benchmarks/results/<time>.json")
+    scenario_parser.add_argument("name")
+
+    compare_parser = commands.add_parser("compare", help="Compare two runs")
+    compare_parser.add_argument("base", type=Path)
+    compare_parser.add_argument("new", type=Path)
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.10, help="Throughput drop, 0.10 = 10%%"
+    )
+    compare_parser.add_argument(
+        "--memory-threshold", type=float, default=0.20, help="Peak memory growth"
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "_scenario":
+        result = run_scenario(
+            args.name, args.workdir, args.items, args.seed, args.embed_items
+        )
+        print(json.dumps(result))
+    elif args.command == "run":
+        run(args)
+    else:
+        base = json.loads(args.base.read_text())
+        new = json.loads(args.new.read_text())
+        lines, regressions = compare(base, new, args.threshold, args.memory_threshold)
+        print("\n".join(lines))
+        if regressions:
+            print("Regressions:\n" + "\n".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# Synthetic Crossref corpus
+# Pages look like what the harvester stores: `message` dicts with up to 1000 items
+# of one journal and year, under the cache keys of CrossrefQuery. Like the real API:
+# * abstracts are JATS (<jats:title>Abstract</jats:title><jats:p>...), sometimes
+#   plain, sometimes empty; titles, authors, dates and container-title go missing
+# * the online ISSN page of a query repeats most items of the print ISSN page
+# * a few papers appear twice under two DOIs, with different markup and spacing
+# Generation is deterministic per seed and streams page by page, so 5M items
+# never have to be in memory at once
+import random
+from collections.abc import Iterator
+from itertools import accumulate
+
+from app.data_prep.utils import get_issns, make_hive_cache_key
+
+ROWS_PER_PAGE = 1000
+# Share of the items of a print ISSN page that its online page returns as well
+ONLINE_OVERLAP = 0.8
+# Share of items that are re-issued under a second DOI
+REISSUED = 0.01
+
+_SYLLABLES = (
+    "mon et ar y pol ic lab or mar ket wage price de mand sup ply fir m tr ade "
+    "cap it al in vest ment risk as set bank cred it tax gro wth in fla tion em "
+    "ploy ment house hold con sump tion pro duc tiv ity"
+).split()
+_CONNECTIVES = "we the of and in a to that on for with is are by this from as".split()
+
+
+def _vocabulary(rng: random.Random, size: int = 8000) -> list[str]:
+    words = {
+        "".join(rng.choices(_SYLLABLES, k=rng.randint(1, 4))) for _ in range(size * 2)
+    }
+    return sorted(words)[:size]
+
+
+class SyntheticCrossref:
+    """
+    Fake Crossref pages for benchmarks.
+
+    Args:
+        n_items (int): Distinct works, before online duplicates and re-issues.
+        seed (int): Same seed, same corpus.
+    """
+
+    def __init__(self, n_items: int, seed: int = 0):
+        self.n_items = n_items
+        self.seed = seed
+        rng = random.Random(seed)
+        vocabulary = _vocabulary(rng)
+        # Abstracts are drawn from a pool of sentences, which keeps generating
+        # millions of them fast and gives a Zipf-like word distribution
+        cum_weights = list(
+            accumulate(1 / (rank + 1) for rank in range(len(vocabulary)))
+        )
+        self.sentences = []
+        for _ in range(20_000):
+            words = rng.choices(
+                vocabulary, cum_weights=cum_weights, k=rng.randint(6, 20)
+            )
+            words += rng.choices(_CONNECTIVES, k=len(words) // 3)
+            rng.shuffle(words)
+            sentence = " ".join(words).capitalize()
+            if rng.random() < 0.1:
+                sentence += f" ({rng.randint(1, 99)}.{rng.randint(0, 9)}%)"
+            self.sentences.append(sentence + ".")
+        self.journals = list(get_issns().items())
+
+    def abstract(self, rng: random.Random) -> str:
+        text = " ".join(rng.choices(self.sentences, k=rng.randint(4, 12)))
+        style = rng.random()
+        if style < 0.6:
+            return f"<jats:title>Abstract</jats:title><jats:p>{text}</jats:p>"
+        if style < 0.8:
+            return f"<jats:p>{text}</jats:p>"
+        if style < 0.95:
+            return text
+        return ""
+
+    def item(self, i: int, journal: str, year: int, rng: random.Random) -> dict:
+        item = {
+            "DOI": f"10.9999/synthetic.{self.seed}.{i}",
+            "title": [" ".join(rng.choice(self.sentences).split()[:8]).rstrip(".")],
+            "author": [
+                {"given": f"Given{rng.randint(0, 999)}", "family": f"Family{j}"}
+                for j in range(rng.randint(0, 5))
+            ],
+            "issued": {"date-parts": [[year, rng.randint(1, 12)]]},
+            "abstract": self.abstract(rng),
+            "container-title": [journal],
+        }
+        if rng.random() < 0.02:
+            del item["container-title"]
+        if rng.random() < 0.01:
+            item["issued"] = {"date-parts": [[None]]}
+        return item
+
+    def reissue(self, item: dict, rng: random.Random) -> dict:
+        """The same paper under another DOI, with other markup and spacing"""
+        copy = dict(item, DOI=item["DOI"] + ".r")
+        text = item.get("abstract", "").replace("<jats:title>Abstract</jats:title>", "")
+        copy["abstract"] = (
+            "<jats:sec><jats:p>" + text.replace(". ", ".  ") + "</jats:p>"
+        )
+        return copy
+
+    def pages(self) -> Iterator[tuple[str, dict]]:
+        """
+        (cache key, page) of every query page, print ISSN pages first. Each
+        page is one journal and year, like the yearly queries of get_data.
+        """
+        rng = random.Random(self.seed + 1)
+        for page_no, start in enumerate(range(0, self.n_items, ROWS_PER_PAGE)):
+            journal, issns = self.journals[page_no % len(self.journals)]
+            year = 2000 + (page_no // len(self.journals)) % 26
+            items = [
+                self.item(i, journal, year, rng)
+                for i in range(start, min(start + ROWS_PER_PAGE, self.n_items))
+            ]
+            items += [self.reissue(x, rng) for x in items if rng.random() < REISSUED]
+            online = [x for x in items if rng.random() < ONLINE_OVERLAP]
+            for issn, page_items in (
+                (issns["print"], items),
+                (issns["online"], online),
+            ):
+                key = make_hive_cache_key(
+                    issn=issn,
+                    date_from=f"{year}-01-01",
+                    date_to=f"{year}-12-31",
+                    # Pages of the same query differ by cursor
+                    cursor=f"page-{page_no}",
+                    prefix=None,
+                )
+                yield key, {"items": page_items, "next-cursor": None}
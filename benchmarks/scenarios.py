@@ -0,0 +1,242 @@
+# Timed benchmark scenarios
+# Each scenario prepares its input (untimed) in a work directory that the
+# scenarios of one run share, then times only its stage with `Timer`:
+# * parse, parse_columnar: Crossref pages -> rows, Python loop / polars
+# * records: pages into the record store, then the raw Parquet dataset
+# * clean: the cleaning plan of process_data (polars, streaming)
+# * near_duplicates: MinHash/LSH over the cleaned abstracts
+# * embed: a tiny randomly initialized BERT (torch), no model download
+# * dense, bm25: top-10 retrieval for a batch of queries
+import shutil
+import time
+import zlib
+from collections.abc import Callable
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from benchmarks.corpus import SyntheticCrossref
+
+N_QUERIES = 1000
+K = 10
+# Rows of the dense scenario's matrix at most, 1.5 GB of float32
+MAX_DENSE_ROWS = 1_000_000
+
+
+class Timer:
+    """Adds up the seconds of the timed blocks"""
+
+    def __init__(self):
+        self.seconds = 0.0
+
+    @contextmanager
+    def __call__(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+@dataclass(frozen=True)
+class Context:
+    workdir: Path
+    n_items: int
+    seed: int = 0
+    # Texts embedded by the embed scenario, a CPU forward pass is slow
+    embed_items: int = 2000
+
+
+@dataclass(frozen=True)
+class Scenario:
+    # What `units` counts, for throughput: units per second
+    unit: str
+    run: Callable[[Context, Timer], int]
+    # Modules the scenario needs; it is skipped if one is missing
+    requires: tuple[str, ...] = ()
+
+
+def corpus(ctx: Context) -> SyntheticCrossref:
+    return SyntheticCrossref(ctx.n_items, ctx.seed)
+
+
+def parse(ctx: Context, timer: Timer) -> int:
+    from app.data_prep.process_data import parse_crossref_cache_entry
+
+    n = 0
+    for _, page in corpus(ctx).pages():
+        with timer():
+            n += len(parse_crossref_cache_entry(page, "Econometrica"))
+    return n
+
+
+def parse_columnar(ctx: Context, timer: Timer) -> int:
+    from app.data_prep.process_data import parse_crossref_page
+
+    n = 0
+    for _, page in corpus(ctx).pages():
+        with timer():
+            n += parse_crossref_page(page, "Econometrica").height
+    return n
+
+
+def raw_dataset(ctx: Context, timer: Timer | None = None) -> Path:
+    """data/raw of the corpus, made once per work directory"""
+    from app.data_prep.parquet_sink import stream_records_to_parquet
+    from app.data_prep.record_store import RecordStore
+
+    raw_dir = ctx.workdir / "raw"
+    if raw_dir.exists() and timer is None:
+        return raw_dir
+    timer = timer or Timer()
+    shutil.rmtree(ctx.workdir / "records", ignore_errors=True)
+    store = RecordStore(ctx.workdir / "records" / "records.sqlite")
+    for key, page in corpus(ctx).pages():
+        with timer():
+            store.put_page(key, page)
+    with timer():
+        stream_records_to_parquet(store, raw_dir)
+    store.close()
+    return raw_dir
+
+
+def records(ctx: Context, timer: Timer) -> int:
+    raw_dir = raw_dataset(ctx, timer)
+    return (
+        pl.scan_parquet(raw_dir / "**" / "*.parquet").select(pl.len()).collect().item()
+    )
+
+
+def clean_file(ctx: Context, timer: Timer | None = None) -> Path:
+    """abstracts_clean.parquet of the corpus, made once per work directory"""
+    from app.data_prep.parquet_sink import scan_raw
+    from app.data_prep.process_data import sink_clean_abstracts
+
+    out_file = ctx.workdir / "abstracts_clean.parquet"
+    if out_file.exists() and timer is None:
+        return out_file
+    raw = scan_raw(raw_dataset(ctx))
+    with (timer or Timer())():
+        # The regex tokenizer; nltk needs the punkt download
+        sink_clean_abstracts(raw, out_file, "regex")
+    return out_file
+
+
+def clean(ctx: Context, timer: Timer) -> int:
+    from app.data_prep.parquet_sink import scan_raw
+
+    clean_file(ctx, timer)
+    return scan_raw(raw_dataset(ctx)).select(pl.len()).collect().item()
+
+
+def near_duplicates(ctx: Context, timer: Timer) -> int:
+    from app.data_prep.near_duplicates import remove_near_duplicates
+
+    parquet_file = ctx.workdir / "near_duplicates.parquet"
+    shutil.copy(clean_file(ctx), parquet_file)
+    with timer():
+        stats = remove_near_duplicates(parquet_file)
+    return stats.rows
+
+
+def _tiny_encoder(vocab_size: int = 8192):
+    """A 2-layer BERT with random weights and hashed word ids"""
+    import torch
+    from transformers import BertConfig, BertModel
+
+    from app.embeddings.batching import length_batches
+
+    torch.manual_seed(0)
+    config = BertConfig(
+        vocab_size=vocab_size,
+        hidden_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=256,
+        max_position_embeddings=512,
+    )
+    model = BertModel(config).eval()
+
+    def encode(texts: list[str]) -> np.ndarray:
+        ids = [
+            [zlib.crc32(w.encode()) % vocab_size for w in t.split()[:510]]
+            for t in texts
+        ]
+        out = np.empty((len(texts), config.hidden_size), np.float32)
+        with torch.inference_mode():
+            for batch in length_batches([len(x) for x in ids], max_tokens=8192):
+                longest = max(len(ids[i]) for i in batch) or 1
+                input_ids = torch.zeros((len(batch), longest), dtype=torch.long)
+                mask = torch.zeros((len(batch), longest), dtype=torch.long)
+                for row, i in enumerate(batch):
+                    input_ids[row, : len(ids[i])] = torch.tensor(ids[i])
+                    mask[row, : len(ids[i])] = 1
+                hidden = model(input_ids=input_ids, attention_mask=mask)[0]
+                pooled = (hidden * mask[..., None]).sum(1) / mask.sum(1, keepdim=True)
+                out[batch] = pooled.numpy()
+        return out
+
+    return encode
+
+
+def embed(ctx: Context, timer: Timer) -> int:
+    texts = (
+        pl.scan_parquet(clean_file(ctx))
+        .select("abstract")
+        .head(ctx.embed_items)
+        .collect()["abstract"]
+        .to_list()
+    )
+    encode = _tiny_encoder()
+    with timer():
+        encode(texts)
+    return len(texts)
+
+
+def dense(ctx: Context, timer: Timer) -> int:
+    from app.retrieval.dense import Retriever
+
+    rng = np.random.default_rng(ctx.seed)
+    # One 384-dimensional vector per item, like all-MiniLM-L6-v2
+    n_rows = min(ctx.n_items, MAX_DENSE_ROWS)
+    matrix = rng.standard_normal((n_rows, 384), dtype=np.float32)
+    queries = rng.standard_normal((N_QUERIES, 384), dtype=np.float32)
+    retriever = Retriever(matrix)
+    with timer():
+        for start in range(0, N_QUERIES, 100):
+            retriever.search_ids(queries[start : start + 100], K)
+    return N_QUERIES
+
+
+def bm25(ctx: Context, timer: Timer) -> int:
+    from app.retrieval.bm25 import build_bm25
+
+    tokenized = pl.read_parquet(clean_file(ctx), columns=["tokenized_abstract"])
+    index = build_bm25(tokenized["tokenized_abstract"])
+    # Queries of 4 to 8 words of the abstracts
+    rng = np.random.default_rng(ctx.seed)
+    docs = tokenized["tokenized_abstract"].filter(
+        tokenized["tokenized_abstract"].str.len_chars() > 0
+    )
+    docs = docs.sample(N_QUERIES, with_replacement=True, seed=ctx.seed)
+    queries = [" ".join(rng.choice(doc.split(), rng.integers(4, 9))) for doc in docs]
+    with timer():
+        for start in range(0, N_QUERIES, 100):
+            index.search_ids(queries[start : start + 100], K)
+    return N_QUERIES
+
+
+# In the order a run executes them; later scenarios reuse earlier outputs
+SCENARIOS = {
+    "parse": Scenario("items", parse),
+    "parse_columnar": Scenario("items", parse_columnar),
+    "records": Scenario("rows", records),
+    "clean": Scenario("rows", clean),
+    "near_duplicates": Scenario("rows", near_duplicates),
+    "embed": Scenario("abstracts", embed, requires=("torch", "transformers")),
+    "dense": Scenario("queries", dense),
+    "bm25": Scenario("queries", bm25),
+}
@@ -0,0 +1,67 @@
+# Recall@k and latency of the IVF index against exact search
+# Builds the index if it is missing, then sweeps nprobe
+# Needs an artifact: uv run -m app.embeddings.artifact --model all-MiniLM-L6-v2
+# Run with: uv run -m experiments.bench_ann
+# %%
+import time
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from app.embeddings.artifact import artifact_dir, load_artifact
+from app.retrieval.ann import (
+    IVF_DIR,
+    artifact_meta,
+    build_ivf,
+    load_ivf,
+    recall_at_k,
+    save_ivf,
+)
+from app.retrieval.dense import Retriever
+from experiments.bench_retrieval import sample_queries
+
+proj_dir = Path(__file__).parents[1]
+MODEL = "all-MiniLM-L6-v2"
+NPROBES = [1, 2, 4, 8, 16, 32, 64]
+N_QUERIES = 500
+K = 10
+
+
+def ms_per_query(search, queries: np.ndarray) -> tuple[np.ndarray, float]:
+    start = time.perf_counter()
+    ids, _ = search(queries)
+    return ids, (time.perf_counter() - start) / len(queries) * 1e3
+
+
+# %%
+if __name__ == "__main__":
+    directory = artifact_dir(proj_dir, MODEL)
+    matrix = load_artifact(directory, with_rows=False).matrix
+    if not (directory / IVF_DIR / "manifest.json").exists():
+        start = time.perf_counter()
+        save_ivf(build_ivf(matrix), directory / IVF_DIR, artifact_meta(directory))
+        print(f"Built index in {time.perf_counter() - start:.1f}s")
+    index = load_ivf(directory / IVF_DIR, artifact_directory=directory)
+
+    queries = sample_queries(matrix, N_QUERIES)
+    # One query at a time, the way the IVF index answers them
+    exact_retriever = Retriever(matrix)
+    exact, exact_ms = ms_per_query(
+        lambda q: tuple(
+            np.vstack(a) for a in zip(*(exact_retriever.search_ids(x, K) for x in q))
+        ),
+        queries,
+    )
+    results = [{"nprobe": "exact", "recall@10": 1.0, "ms_per_query": exact_ms}]
+    for nprobe in NPROBES:
+        ids, ms = ms_per_query(lambda q: index.search_ids(q, K, nprobe), queries)
+        results.append(
+            {
+                "nprobe": str(nprobe),
+                "recall@10": recall_at_k(ids, exact),
+                "ms_per_query": ms,
+            }
+        )
+    print(f"{len(index)} rows, {index.n_lists} lists")
+    print(pl.DataFrame(results))
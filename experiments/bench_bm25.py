@@ -0,0 +1,65 @@
+# BM25 engine vs rank_bm25 on the tokenized abstracts
+# Reports build time and ms per query for both, and checks the scores agree
+# Needs data/abstracts_clean.parquet (just process-data)
+# Run with: uv run -m experiments.bench_bm25
+# %%
+import time
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+from rank_bm25 import BM25Okapi
+
+from app.retrieval.bm25 import build_bm25, tokenize
+
+proj_dir = Path(__file__).parents[1]
+QUERIES = [
+    "randomized controlled trial",
+    "demand elasticities for differentiated products",
+    "instrumental variables with weak instruments",
+    "monetary policy and inflation expectations",
+    "labor supply of married women",
+    "difference in differences with staggered adoption",
+    "auction design and bidder collusion",
+    "minimum wage employment effects",
+]
+N_OLD = 8
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    out = f(*args)
+    return out, time.perf_counter() - start
+
+
+def bench(tokenized: pl.Series, queries: list[list[str]]) -> pl.DataFrame:
+    corpus = [t.split(" ") for t in tokenized.to_list()]
+    old, old_build = timed(BM25Okapi, corpus)
+    old_scores, old_time = timed(
+        lambda: np.array([old.get_scores(q) for q in queries[:N_OLD]])
+    )
+
+    index, build = timed(build_bm25, tokenized)
+    scores, new_time = timed(lambda: index.scores(queries[:N_OLD]).toarray())
+    np.testing.assert_allclose(scores, old_scores, rtol=1e-4, atol=1e-5)
+    _, batch_time = timed(index.search_ids, queries, 10)
+
+    return pl.DataFrame(
+        {
+            "engine": ["rank_bm25", "sparse", "sparse, batched top-10"],
+            "build_s": [old_build, build, build],
+            "ms_per_query": [
+                old_time / N_OLD * 1e3,
+                new_time / N_OLD * 1e3,
+                batch_time / len(queries) * 1e3,
+            ],
+        }
+    )
+
+
+# %%
+if __name__ == "__main__":
+    df = pl.read_parquet(proj_dir / "data" / "abstracts_clean.parquet")
+    queries = tokenize(QUERIES) * 32
+    print(f"{len(df)} abstracts, {len(queries)} queries")
+    print(bench(df["tokenized_abstract"], queries))
@@ -0,0 +1,78 @@
+# Latency of hybrid retrieval: dense (query encoding included), BM25, both in
+# sequence and both in parallel, with and without a metadata filter
+# Needs an artifact and the BM25 index: just embed-sharded, just bm25-index
+# Run with: uv run -m experiments.bench_hybrid
+# %%
+import time
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from app.embeddings.artifact import artifact_dir
+from app.embeddings.encoders import load_encoder
+from app.retrieval.hybrid import HybridRetriever, MetadataFilter, reciprocal_rank_fusion
+
+proj_dir = Path(__file__).parents[1]
+MODEL = "all-MiniLM-L6-v2"
+N_QUERIES = 64
+FILTERS = {
+    "none": None,
+    "Econometrica after 2015": MetadataFilter(
+        journals=("Econometrica",), year_from=2015
+    ),
+}
+
+
+def ms_per_query(f, n: int) -> float:
+    start = time.perf_counter()
+    for i in range(n):
+        f(i)
+    return (time.perf_counter() - start) / n * 1e3
+
+
+def bench(hybrid: HybridRetriever, texts: list[str]) -> pl.DataFrame:
+    results = []
+    for name, filters in FILTERS.items():
+        candidates = filters.row_ids(hybrid.rows) if filters else None
+        depth = hybrid.depth
+
+        def dense(i):
+            vectors = hybrid.dense.encode(texts[i : i + 1])
+            return hybrid.dense.search_ids(vectors, depth, candidates)[0]
+
+        def lexical(i):
+            return hybrid.bm25.search_ids(texts[i : i + 1], depth, candidates)[0]
+
+        def sequential(i):
+            return reciprocal_rank_fusion([dense(i), lexical(i)], 10, hybrid.k_rrf)
+
+        def parallel(i):
+            return hybrid.search_ids(texts[i : i + 1], 10, filters)
+
+        for engine, f in [
+            ("dense", dense),
+            ("bm25", lexical),
+            ("hybrid, sequential", sequential),
+            ("hybrid, parallel", parallel),
+        ]:
+            results.append(
+                {
+                    "filter": name,
+                    "engine": engine,
+                    "ms_per_query": ms_per_query(f, len(texts)),
+                }
+            )
+    return pl.DataFrame(results)
+
+
+# %%
+if __name__ == "__main__":
+    hybrid = HybridRetriever.from_dirs(
+        artifact_dir(proj_dir, MODEL), proj_dir / "data" / "bm25", load_encoder(MODEL)
+    )
+    # Titles as queries
+    picks = np.random.default_rng(0).integers(0, len(hybrid.rows), N_QUERIES)
+    texts = hybrid.rows[picks]["title"].to_list()
+    with pl.Config(tbl_rows=20):
+        print(bench(hybrid, texts))
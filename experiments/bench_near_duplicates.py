@@ -0,0 +1,104 @@
+# Benchmarks near-duplicate detection (MinHash + LSH) on synthetic abstracts
+# A share of the abstracts is copied with a few words changed, like versions of a
+# paper from two feeds; the rest are unrelated. Reports recall and precision of
+# the clusters and the time per corpus size, and the time of the exact pairwise
+# Jaccard similarity on the smallest corpus for comparison
+# Run with: uv run -m experiments.bench_near_duplicates
+# %%
+import random
+import time
+from itertools import combinations
+
+import polars as pl
+
+from app.data_prep.near_duplicates import (
+    SHINGLE_SIZE,
+    THRESHOLD,
+    find_near_duplicates,
+    parallel_signatures,
+)
+
+SIZES = (5_000, 20_000, 100_000)
+DUPLICATE_SHARE = 0.05
+# A vocabulary large enough that unrelated abstracts share few shingles
+VOCABULARY = [f"w{i}" for i in range(5_000)]
+
+
+def synthetic_abstracts(n: int, seed: int = 0) -> tuple[pl.DataFrame, set]:
+    """Abstracts and the (original, copy) row pairs of the near-duplicates"""
+    rng = random.Random(seed)
+    texts, pairs = [], set()
+    while len(texts) < n:
+        if texts and rng.random() < DUPLICATE_SHARE:
+            original = rng.randrange(len(texts))
+            words = texts[original].split()
+            # Up to 2% of the words change
+            for _ in range(rng.randint(1, max(1, len(words) // 50))):
+                words[rng.randrange(len(words))] = rng.choice(VOCABULARY)
+            pairs.add((original, len(texts)))
+            texts.append(" ".join(words))
+        else:
+            texts.append(" ".join(rng.choices(VOCABULARY, k=rng.randint(80, 250))))
+    df = pl.DataFrame(
+        {
+            "tokenized_abstract": texts,
+            "doi": [f"10.9999/{i}" for i in range(n)],
+            "journal": "Econometrica",
+            "desired_journal": "Econometrica",
+        }
+    )
+    return df, pairs
+
+
+def shingles(text: str) -> set[tuple[str, ...]]:
+    words = text.split()
+    return {
+        tuple(words[i : i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b)
+
+
+# %%
+if __name__ == "__main__":
+    results = []
+    for n in SIZES:
+        df, truth = synthetic_abstracts(n)
+        start = time.perf_counter()
+        signatures = parallel_signatures(df["tokenized_abstract"])
+        minhash_s = time.perf_counter() - start
+        clusters, stats = find_near_duplicates(df, signatures)
+        found = {
+            tuple(sorted((row, canonical)))
+            for row, canonical in clusters.select("row", "canonical").iter_rows()
+            if row != canonical
+        }
+        # Copies of copies point to the first original, count them as found
+        true_rows = {copy for _, copy in truth}
+        found_rows = {max(pair) for pair in found}
+        results.append(
+            {
+                "rows": n,
+                "near_duplicates": len(truth),
+                "recall": round(len(found_rows & true_rows) / len(true_rows), 4),
+                "precision": round(len(found_rows & true_rows) / len(found_rows), 4),
+                "candidate_pairs": stats.candidate_pairs,
+                "minhash_s": round(minhash_s, 2),
+                "lsh_and_clusters_s": round(stats.seconds, 2),
+            }
+        )
+    print(pl.DataFrame(results))
+
+    # Exact pairwise similarity of shingle sets, for comparison
+    df, _ = synthetic_abstracts(2_000)
+    sets = [shingles(text) for text in df["tokenized_abstract"]]
+    start = time.perf_counter()
+    n_similar = sum(jaccard(a, b) >= THRESHOLD for a, b in combinations(sets, 2))
+    seconds = time.perf_counter() - start
+    print(
+        f"Exact pairwise Jaccard of 2000 abstracts: {seconds:.1f}s, "
+        f"{n_similar} similar pairs; {SIZES[-1]} abstracts would take about "
+        f"{seconds * (SIZES[-1] / 2000) ** 2 / 3600:.0f} hours"
+    )
@@ -0,0 +1,50 @@
+# Encoder throughput on CPU: torch fp32 against ONNX Runtime fp32 and int8
+# Needs the onnx extra and exported models: uv run -m app.embeddings.onnx_backend
+# Run with: uv run --extra onnx -m experiments.bench_onnx --model all-MiniLM-L6-v2
+# %%
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import polars as pl
+
+from app.embeddings.encoders import load_encoder
+from app.retrieval.dense import l2_normalize
+
+proj_dir = Path(__file__).parents[1]
+
+
+def bench(model: str, texts: list[str]) -> pl.DataFrame:
+    results = []
+    reference = None
+    for backend in ("torch", "onnx", "onnx-int8"):
+        encoder = load_encoder(model, backend)
+        encoder(texts[:8])  # warm up
+        start = time.perf_counter()
+        vectors = l2_normalize(encoder(texts))
+        took = time.perf_counter() - start
+        if reference is None:
+            reference = vectors
+        cosine = (vectors * reference).sum(axis=1)
+        results.append(
+            {
+                "backend": backend,
+                "abstracts_per_sec": len(texts) / took,
+                "min_cosine_to_torch": float(cosine.min()),
+                "mean_cosine_to_torch": float(cosine.mean()),
+            }
+        )
+    return pl.DataFrame(results)
+
+
+# %%
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compare encoder backends")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--n", type=int, default=512)
+    args = parser.parse_args()
+
+    df = pl.read_parquet(proj_dir / "data" / "abstracts_clean.parquet")
+    texts = df["abstract"].sample(args.n, seed=0).to_list()
+    print(f"{args.model}, {len(texts)} abstracts")
+    print(bench(args.model, texts))
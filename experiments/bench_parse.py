@@ -0,0 +1,68 @@
+# Benchmarks parse_crossref_cache_entry (Python loop) against the columnar
+# parse_crossref_page on a synthetic corpus of 1M Crossref items
+# Run with: uv run -m experiments.bench_parse
+# %%
+import random
+import time
+
+import polars as pl
+
+from app.data_prep.process_data import parse_crossref_cache_entry, parse_crossref_page
+
+N_ITEMS = 1_000_000
+ROWS_PER_PAGE = 1000
+JOURNALS = ["Econometrica", "American Economic Review", "Journal of Political Economy"]
+
+
+def synthetic_item(i: int, rng: random.Random) -> dict:
+    n_authors = rng.randint(1, 5)
+    return {
+        "DOI": f"10.9999/synthetic.{i}",
+        "title": [f"Synthetic paper number {i}"],
+        "author": [
+            {"given": f"Given{j}", "family": f"Family{j}", "sequence": "additional"}
+            for j in range(n_authors)
+        ],
+        "issued": {"date-parts": [[rng.randint(2000, 2025), rng.randint(1, 12)]]},
+        "abstract": "<jats:p>"
+        + " ".join(["word"] * rng.randint(80, 250))
+        + "</jats:p>",
+        "container-title": [rng.choice(JOURNALS)],
+    }
+
+
+def synthetic_pages(n_items: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    items = [synthetic_item(i, rng) for i in range(n_items)]
+    return [
+        {"items": items[i : i + ROWS_PER_PAGE]}
+        for i in range(0, n_items, ROWS_PER_PAGE)
+    ]
+
+
+def bench(name, fn, pages):
+    start = time.perf_counter()
+    df = fn(pages)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10} {elapsed:6.2f}s  {df.height / elapsed:12,.0f} rows/sec")
+    return df
+
+
+def python_parser(pages):
+    # What process_data used to do: dicts per page, one DataFrame per page, concat
+    return pl.concat(
+        [pl.DataFrame(parse_crossref_cache_entry(p, "Econometrica")) for p in pages]
+    )
+
+
+def columnar_parser(pages):
+    return pl.concat([parse_crossref_page(p, "Econometrica") for p in pages])
+
+
+# %%
+if __name__ == "__main__":
+    print(f"Generating {N_ITEMS:,} items")
+    pages = synthetic_pages(N_ITEMS)
+    want = bench("python", python_parser, pages)
+    got = bench("columnar", columnar_parser, pages)
+    assert got.equals(want), "Parsers disagree"
@@ -0,0 +1,156 @@
+# Benchmarks the cleaning of process_data: the previous eager DataFrame passes
+# against the single LazyFrame plan sunk with the streaming engine
+# Each version runs in its own process on the same synthetic raw dataset, so
+# peak RSS (ru_maxrss) is measured separately
+# Run with: uv run -m experiments.bench_process --rows 300000
+# %%
+import json
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import polars as pl
+
+from app.data_prep.parquet_sink import NULL_YEAR, RAW_SCHEMA, make_hive_path, scan_raw
+from app.data_prep.process_data import sink_clean_abstracts
+
+JOURNALS = ["Econometrica", "The Review of Economic Studies", "Journal of Finance"]
+WORDS = (
+    "we study the effect of monetary policy on labor markets using a panel of "
+    "firms . our estimates , e.g. of the elasticity , are large ( 0.4 ) and "
+    "robust ; we don't find evidence for pre-trends in u.s. data"
+).split()
+# Like a Crossref page of a yearly query: up to 1000 items of one journal and year
+ROWS_PER_PAGE = 1000
+
+
+def synthetic_page(start: int, n: int, rng: random.Random) -> tuple[Path, pl.DataFrame]:
+    """Raw rows of one page; about 5% are incremental updates of an earlier DOI"""
+    journal = rng.choice(JOURNALS)
+    year = rng.choice([NULL_YEAR, *range(2000, 2025)])
+    rows = []
+    for i in range(start, start + n):
+        update = i > 1000 and rng.random() < 0.05
+        doi = rng.randrange(i) if update else i
+        words = " ".join(rng.choices(WORDS, k=rng.randint(80, 250)))
+        rows.append(
+            {
+                "title": f"Synthetic paper {doi}",
+                "doi": f"10.9999/{doi}",
+                "authors": [f"Author {j}" for j in range(rng.randint(0, 4))],
+                "abstract": f"<jats:p>Abstract {words}</jats:p>",
+                "desired_journal": journal,
+                "harvested_until": "2025-01-01" if update else None,
+            }
+        )
+    part_dir = make_hive_path(journal=journal, year=year)
+    return part_dir, pl.DataFrame(rows, schema=RAW_SCHEMA)
+
+
+def write_synthetic_raw(out_dir: Path, n_rows: int, seed: int = 0):
+    """Hive-partitioned like data/raw, one file per page"""
+    rng = random.Random(seed)
+    for start in range(0, n_rows, ROWS_PER_PAGE):
+        part_dir, page = synthetic_page(start, min(ROWS_PER_PAGE, n_rows - start), rng)
+        (out_dir / part_dir).mkdir(parents=True, exist_ok=True)
+        page.write_parquet(out_dir / part_dir / f"part-{start}.parquet")
+
+
+def clean_eager(raw_dir: Path, out_file: Path):
+    """process_data before the lazy plan: every pass materializes a DataFrame"""
+    from app.data_prep.clean import clean_text_expr
+
+    df = (
+        scan_raw(raw_dir)
+        .sort("harvested_until", nulls_last=False, maintain_order=True)
+        .unique(subset=["doi"], keep="last", maintain_order=True)
+        .select(
+            "title",
+            pl.col("year").replace(NULL_YEAR, None),
+            "doi",
+            "authors",
+            "abstract",
+            "journal",
+            "desired_journal",
+        )
+        .collect()
+    )
+    df = df.sort("journal", "year").filter(
+        pl.col("authors").list.len() > 0, pl.col("abstract") != ""
+    )
+    df = df.with_columns(
+        pl.col("abstract").alias("abstract_original"),
+        pl.col("abstract")
+        .str.replace_all(r"<[^>]+>", "")
+        .str.strip_chars()
+        .str.replace(r"^\s*Abstract\b", "")
+        .str.replace(r"^\s*Abstract", "")
+        .str.replace(r"^\s*ABSTRACT\b", ""),
+    )
+    df = df.with_columns(
+        clean_text_expr("abstract", remove_abstract=True).alias("tokenized_abstract"),
+        pl.col("journal")
+        .replace("The Review of Economic Studies", "Review of Economic Studies")
+        .alias("journal"),
+    ).with_columns(pl.format("{}\n{}", "title", "abstract").alias("abstract"))
+    df = df.unique(subset=["abstract"])
+    df.group_by("journal", "desired_journal").len()
+    df.write_parquet(out_file)
+
+
+def run(version: str, raw_dir: Path, out_file: Path) -> dict:
+    start = time.perf_counter()
+    if version == "eager":
+        clean_eager(raw_dir, out_file)
+    else:
+        sink_clean_abstracts(scan_raw(raw_dir), out_file, "regex")
+    return {
+        "version": version,
+        "seconds": round(time.perf_counter() - start, 2),
+        # kB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024),
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--rows", type=int, default=300_000)
+    parser.add_argument("--run", choices=["eager", "lazy"], help="One version only")
+    parser.add_argument("--raw")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run(args.run, Path(args.raw), Path(args.out))))
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        start = time.perf_counter()
+        write_synthetic_raw(tmp / "raw", args.rows)
+        size = sum(f.stat().st_size for f in (tmp / "raw").rglob("*.parquet"))
+        print(
+            f"{args.rows} raw rows, {size / 2**20:.0f} MB of Parquet "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+        results = []
+        for version in ("eager", "lazy"):
+            out = subprocess.run(
+                [sys.executable, "-m", "experiments.bench_process", "--run", version,
+                 "--raw", str(tmp / "raw"), "--out", str(tmp / f"{version}.parquet")],
+                capture_output=True, text=True, check=True,
+            )  # fmt: skip
+            results.append(json.loads(out.stdout))
+        print(pl.DataFrame(results))
+
+        eager = pl.read_parquet(tmp / "eager.parquet")
+        lazy = pl.read_parquet(tmp / "lazy.parquet")
+        # Which of two rows with the same abstract survives is arbitrary in eager
+        for column in ("abstract", "tokenized_abstract", "journal"):
+            assert eager[column].sort().equals(lazy[column].sort()), column
+        print(f"Both versions clean the same {lazy.height} rows")
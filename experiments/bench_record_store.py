@@ -0,0 +1,114 @@
+# Compares the diskcache of whole pages with the record store on synthetic pages
+# where, like print and online ISSN queries, two ISSNs return the same articles
+# * disk size of both stores
+# * time to write the pages, and to convert them to the raw Parquet dataset
+# Run with: uv run -m experiments.bench_record_store
+# %%
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import polars as pl
+from diskcache import Cache
+
+from app.data_prep.parquet_sink import (
+    scan_raw,
+    stream_cache_to_parquet,
+    stream_records_to_parquet,
+)
+from app.data_prep.record_store import RecordStore, default_codec
+from app.data_prep.utils import make_hive_cache_key
+
+N_ITEMS = 100_000
+ROWS_PER_PAGE = 1000
+ISSNS = ("0012-9682", "1468-0262")
+WORDS = (
+    "we study the effect of monetary policy on labor markets using firm data".split()
+)
+
+
+def synthetic_pages(n_items: int, seed: int = 0) -> dict[str, dict]:
+    rng = random.Random(seed)
+    items = [
+        {
+            "DOI": f"10.9999/synthetic.{i}",
+            "title": [f"Synthetic paper number {i}"],
+            "author": [
+                {"given": f"Given{j}", "family": f"Family{j}", "sequence": "additional"}
+                for j in range(rng.randint(1, 5))
+            ],
+            "issued": {"date-parts": [[rng.randint(2000, 2025), rng.randint(1, 12)]]},
+            "abstract": "<jats:p>"
+            + " ".join(rng.choices(WORDS, k=rng.randint(80, 250)))
+            + "</jats:p>",
+            "container-title": ["Econometrica"],
+        }
+        for i in range(n_items)
+    ]
+    pages = {}
+    for issn in ISSNS:
+        for start in range(0, n_items, ROWS_PER_PAGE):
+            key = make_hive_cache_key(
+                issn=issn,
+                date_from="2000-01-01",
+                date_to="2025-12-31",
+                cursor=str(start),
+                prefix=None,
+            )
+            pages[key] = {"items": items[start : start + ROWS_PER_PAGE]}
+    return pages
+
+
+def dir_size(path: Path) -> float:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file()) / 2**20
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+# %%
+if __name__ == "__main__":
+    pages = synthetic_pages(N_ITEMS)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        stores = {
+            "diskcache": Cache(tmp / "cache"),
+            f"records ({default_codec()})": RecordStore(
+                tmp / "store" / "records.sqlite"
+            ),
+        }
+        if default_codec() == "zstd":
+            stores["records (zlib)"] = RecordStore(
+                tmp / "zlib" / "records.sqlite", codec="zlib"
+            )
+        for name, store in stores.items():
+
+            def write():
+                for key, page in pages.items():
+                    store[key] = page
+
+            _, write_s = timed(write)
+            out_dir = tmp / f"raw-{len(results)}"
+            if isinstance(store, Cache):
+                n_rows, parse_s = timed(stream_cache_to_parquet, store, out_dir)
+                size = dir_size(tmp / "cache")
+            else:
+                n_rows, parse_s = timed(stream_records_to_parquet, store, out_dir)
+                size = dir_size(store.path.parent)
+            assert scan_raw(out_dir).select("doi").unique().collect().height == N_ITEMS
+            results.append(
+                {
+                    "store": name,
+                    "mb": round(size, 1),
+                    "write_s": round(write_s, 2),
+                    "rows_to_parquet": n_rows,
+                    "to_parquet_s": round(parse_s, 2),
+                }
+            )
+    print(f"{len(pages)} pages, {N_ITEMS} distinct items on {len(ISSNS)} ISSNs")
+    print(pl.DataFrame(results))
@@ -0,0 +1,75 @@
+# Latency of the dense Retriever on the real corpus
+# Reports p50/p99 latency per query and queries/sec for batch sizes 1-256, and
+# compares against the old find_topk approach (re-stack, cosine, full argsort)
+# Needs an artifact: uv run -m app.embeddings.artifact --model all-MiniLM-L6-v2
+# Run with: uv run -m experiments.bench_retrieval
+# %%
+import time
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from app.embeddings.artifact import artifact_dir
+from app.retrieval.dense import Retriever, l2_normalize
+
+proj_dir = Path(__file__).parents[1]
+MODEL = "all-MiniLM-L6-v2"
+BATCH_SIZES = [1, 4, 16, 64, 256]
+N_QUERIES = 1024
+K = 10
+
+
+def sample_queries(matrix: np.ndarray, n: int, seed: int = 0) -> np.ndarray:
+    """Corpus vectors plus noise, so queries look like real embeddings"""
+    rng = np.random.default_rng(seed)
+    picks = np.asarray(matrix[rng.integers(0, len(matrix), n)], dtype=np.float32)
+    return picks + rng.normal(scale=0.05, size=picks.shape).astype(np.float32)
+
+
+def old_find_topk(df: pl.DataFrame, q_emb: np.ndarray, k: int) -> np.ndarray:
+    embeddings = np.vstack(df["embedding"].to_list()).astype("float32")
+    sims = l2_normalize(q_emb) @ l2_normalize(embeddings).T
+    return sims[0].argsort()[::-1][:k]
+
+
+def bench_batches(retriever: Retriever, queries: np.ndarray) -> pl.DataFrame:
+    results = []
+    for batch_size in BATCH_SIZES:
+        latencies = []
+        start = time.perf_counter()
+        for i in range(0, len(queries), batch_size):
+            t = time.perf_counter()
+            retriever.search_ids(queries[i : i + batch_size], K)
+            # Every query in the batch waits for the whole batch
+            latencies += [time.perf_counter() - t] * len(queries[i : i + batch_size])
+        total = time.perf_counter() - start
+        results.append(
+            {
+                "batch_size": batch_size,
+                "p50_ms": np.percentile(latencies, 50) * 1e3,
+                "p99_ms": np.percentile(latencies, 99) * 1e3,
+                "queries_per_sec": len(queries) / total,
+            }
+        )
+    return pl.DataFrame(results)
+
+
+# %%
+if __name__ == "__main__":
+    start = time.perf_counter()
+    retriever = Retriever.from_artifact(artifact_dir(proj_dir, MODEL))
+    print(
+        f"Built retriever over {len(retriever)} rows in {time.perf_counter() - start:.2f}s"
+    )
+
+    queries = sample_queries(retriever.matrix, N_QUERIES)
+    print(bench_batches(retriever, queries))
+
+    df = pl.read_parquet(proj_dir / "data" / f"embeddings_{MODEL}.parquet")
+    n_old = 20
+    start = time.perf_counter()
+    for q in queries[:n_old]:
+        old_find_topk(df, q[None, :], K)
+    old_ms = (time.perf_counter() - start) / n_old * 1e3
+    print(f"Old find_topk: {old_ms:.1f} ms/query")
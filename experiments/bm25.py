@@ -1,15 +1,13 @@
-# Tries out bm25 with the result that it doesnt really work
+# Tries out bm25
+# Passing the space separated tokenized_abstract strings straight to rank_bm25
+# indexed characters instead of words, which is why this used to look so bad
 # %%
 from pathlib import Path
 from pprint import pprint as print
-from sys import path
 
 import polars as pl
-from rank_bm25 import BM25Okapi
 
-path.append("../app")
-
-from data_prep.clean_data import clean_text
+from app.retrieval.bm25 import build_bm25
 
 proj_dir = Path(__file__).parents[1]
 
@@ -19,15 +17,10 @@ data_file = proj_dir / "data" / "abstracts_clean.parquet"
 df = pl.read_parquet(data_file)
 print(df)
 # %%
-corpus = df.get_column("tokenized_abstract").to_list()
-bm25 = BM25Okapi(corpus)
+bm25 = build_bm25(df["tokenized_abstract"], rows=df.select("title", "abstract"))
 query = "Randomized controlled trial"
-tokenized_query = clean_text(query)
-doc_scores = bm25.get_scores(tokenized_query)
 
 # %%
 n = 3
-topn = bm25.get_top_n(tokenized_query, corpus, n=n)
-print(topn)  # Seems really bad
-
-# %%
+topn = bm25.search([query], k=n)[0]
+print(topn["abstract"].to_list())
@@ -0,0 +1,68 @@
+# Compares the tokenizers for tokenized_abstract on the real corpus
+# * parity: clean_text_expr (polars regex) vs clean_text (nltk), mismatches are printed
+# * speed: map_elements (old pipeline), process pool, polars regex
+# Run with: uv run -m experiments.check_clean_text
+# %%
+import time
+from pathlib import Path
+
+import nltk
+import polars as pl
+
+from app.data_prep.clean import clean_text_expr, clean_texts_parallel
+from app.data_prep.process_data import clean_text
+
+proj_dir = Path(__file__).parents[1]
+data_file = proj_dir / "data" / "abstracts_clean.parquet"
+
+
+def timed(name, fn):
+    start = time.perf_counter()
+    out = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<14} {elapsed:7.2f}s")
+    return out, elapsed
+
+
+# %%
+if __name__ == "__main__":
+    nltk.download("punkt")
+    df = pl.read_parquet(data_file).select(
+        pl.col("abstract_original")
+        .str.replace_all(r"<[^>]+>", "")
+        .str.strip_chars()
+        .alias("text")
+    )
+    print(f"{df.height} abstracts")
+    texts = df["text"].to_list()
+
+    want, t_old = timed(
+        "map_elements",
+        lambda: df.select(
+            pl.col("text").map_elements(lambda x: clean_text(x, True), return_dtype=str)
+        )["text"].to_list(),
+    )
+    parallel, t_pool = timed(
+        "process pool", lambda: clean_texts_parallel(texts, remove_abstract=True)
+    )
+    got, t_regex = timed(
+        "polars regex",
+        lambda: df.select(clean_text_expr("text", remove_abstract=True))[
+            "text"
+        ].to_list(),
+    )
+    print(f"Speedup process pool: {t_old / t_pool:.1f}x, regex: {t_old / t_regex:.1f}x")
+
+    assert parallel == want, "Process pool must match clean_text exactly"
+    mismatches = [(t, w, g) for t, w, g in zip(texts, want, got) if w != g]
+    share = len(mismatches) / max(len(texts), 1)
+    print(f"Regex mismatches: {len(mismatches)} ({share:.2%})")
+    for text, w, g in mismatches[:10]:
+        w_tokens, g_tokens = w.split(), g.split()
+        diff = next(
+            (i for i, (a, b) in enumerate(zip(w_tokens, g_tokens)) if a != b),
+            min(len(w_tokens), len(g_tokens)),
+        )
+        print("nltk :", " ".join(w_tokens[max(0, diff - 5) : diff + 5]))
+        print("regex:", " ".join(g_tokens[max(0, diff - 5) : diff + 5]))
+        print()
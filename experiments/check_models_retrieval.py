@@ -3,15 +3,13 @@
 from pathlib import Path
 from pprint import pprint as print
 
-import numpy as np
 import polars as pl
 import torch
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-from sys import path
 
-path.append("../app")
-from data_prep.save_embeddings2 import SpecterEmbeddings
+from app.data_prep.save_embeddings2 import SpecterEmbeddings
+from app.embeddings.artifact import artifact_dir
+from app.retrieval.dense import Retriever
 
 # %%
 device = (
@@ -22,12 +20,11 @@ model = SentenceTransformer(model_name, device=device)
 # %%
 proj_dir = Path(__file__).parents[1]
 
-data_file = proj_dir / "data" / f"embeddings_{model_name}.parquet"
-print(data_file)
-assert data_file.exists()
-df = pl.read_parquet(data_file)
-assert "embedding" in df.columns
-print(df)
+data_dir = artifact_dir(proj_dir, model_name)
+print(data_dir)
+assert data_dir.exists(), "uv run -m app.embeddings.artifact --model ..."
+retriever = Retriever.from_artifact(data_dir)
+print(retriever.rows)
 # %%
 
 
@@ -36,24 +33,16 @@ def print_abstracts(df):
         print(a)
 
 
-def find_topk(df, query, model, k=10, verbose=True):
-    """Simple function to get top 5 queries"""
-    abstracts = df["abstract"].to_list()
-    embeddings = np.vstack(df["embedding"].to_list()).astype("float32")
+def find_topk(retriever, query, model, k=10, verbose=True):
+    """Simple function to get top k queries"""
     try:
         q_emb = model.encode([query], convert_to_numpy=True)
     except AttributeError:
         q_emb = model.embed([query])
-    sims = cosine_similarity(q_emb, embeddings)[0]
-    top_idx = sims.argsort()[::-1][:k]
-
-    qrs = []
     print(f"{k} closest queries")
-    for rank, idx in enumerate(top_idx, start=1):
-        row = (rank, sims[idx], abstracts[idx])
-        qrs.append(row)
-
-    matches = pl.DataFrame(qrs, schema=("rank", "distance", "abstract"))
+    matches = retriever.search(q_emb, k)[0].select(
+        "rank", pl.col("score").alias("distance"), "abstract"
+    )
     if verbose:
         print_abstracts(matches)
 
@@ -61,15 +50,15 @@ def find_topk(df, query, model, k=10, verbose=True):
 
 
 query = "What are reasonable values for demand elasticities? I need numbers"
-find_topk(df, query, model)
+find_topk(retriever, query, model)
 # %%
 specter_model = SpecterEmbeddings(6)
 # %%
 model_name = specter_model.name
-file = proj_dir / "data" / f"embeddings_{model_name.replace('/', '-')}.parquet"
-assert file.exists(), f"{file} not there"
-df_allen = pl.read_parquet(file)
+data_dir = artifact_dir(proj_dir, model_name)
+assert data_dir.exists(), f"{data_dir} not there"
+retriever_allen = Retriever.from_artifact(data_dir)
 # %%
 # These seem better
-find_topk(df_allen, query, specter_model)
+find_topk(retriever_allen, query, specter_model)
 # %%
@@ -0,0 +1,74 @@
+# Load test of the retrieval server
+# Closed loop: every client sends its next query as soon as the last one returns
+# Start the server first: uv run -m app.retrieval.server
+# Run with: uv run -m experiments.load_test --clients 16 --seconds 20
+# %%
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import polars as pl
+import requests
+
+QUERIES = [
+    "What are reasonable values for demand elasticities?",
+    "randomized controlled trial in development economics",
+    "instrumental variables with weak instruments",
+    "monetary policy and inflation expectations",
+    "labor supply of married women",
+    "difference in differences with staggered adoption",
+    "auction design and bidder collusion",
+    "minimum wage employment effects",
+]
+
+
+def client(url: str, seconds: float, seed: int, k: int, hybrid: bool) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    session = requests.Session()
+    results = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        body = {"query": QUERIES[rng.integers(len(QUERIES))], "k": k, "hybrid": hybrid}
+        start = time.perf_counter()
+        r = session.post(f"{url}/query", json=body)
+        results.append(
+            {"ms": (time.perf_counter() - start) * 1e3, "ok": r.status_code == 200}
+        )
+    return results
+
+
+def load_test(
+    url: str, clients: int, seconds: float, k: int = 10, hybrid: bool = False
+) -> dict:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        futures = [
+            pool.submit(client, url, seconds, i, k, hybrid) for i in range(clients)
+        ]
+        df = pl.DataFrame([r for f in futures for r in f.result()])
+    elapsed = time.perf_counter() - start
+    return {
+        "clients": clients,
+        "requests": len(df),
+        "errors": int((~df["ok"]).sum()),
+        "requests_per_sec": len(df) / elapsed,
+        **{f"p{p}_ms": df["ms"].quantile(p / 100) for p in (50, 95, 99)},
+    }
+
+
+# %%
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Load test the retrieval server")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--hybrid", action="store_true")
+    args = parser.parse_args()
+
+    print(requests.get(f"{args.url}/health").json())
+    report = [
+        load_test(args.url, n, args.seconds, hybrid=args.hybrid) for n in args.clients
+    ]
+    print(pl.DataFrame(report))
+    print("Server metrics:", requests.get(f"{args.url}/metrics").json())
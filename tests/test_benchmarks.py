@@ -0,0 +1,91 @@
+import json
+
+from app.data_prep.process_data import parse_crossref_cache_entry
+from benchmarks.__main__ import compare, main, run_scenario
+from benchmarks.corpus import ONLINE_OVERLAP, SyntheticCrossref
+
+
+def test_corpus_pages_parse():
+    pages = list(SyntheticCrossref(1500, seed=1).pages())
+    # Two queries of a journal and year, print and online ISSN each
+    assert len(pages) == 4
+    assert len({key for key, _ in pages}) == 4
+    print_items = pages[0][1]["items"]
+    assert len(print_items) >= 1000
+    rows = parse_crossref_cache_entry(pages[0][1], "Econometrica")
+    assert len(rows) == len(print_items)
+    assert any("<jats:p>" in item["abstract"] for item in print_items)
+    # Deterministic per seed
+    assert list(SyntheticCrossref(1500, seed=1).pages())[0] == pages[0]
+
+
+def test_corpus_online_pages_repeat_print_items():
+    (_, print_page), (_, online_page), *_ = SyntheticCrossref(1000).pages()
+    print_dois = {item["DOI"] for item in print_page["items"]}
+    online_dois = {item["DOI"] for item in online_page["items"]}
+    assert online_dois <= print_dois
+    assert abs(len(online_dois) / len(print_dois) - ONLINE_OVERLAP) < 0.05
+
+
+def result(throughput: float, peak_rss_mb: float) -> dict:
+    return {
+        "seconds": 1.0,
+        "units": throughput,
+        "unit": "rows",
+        "throughput": throughput,
+        "peak_rss_mb": peak_rss_mb,
+    }
+
+
+def test_compare_flags_regressions():
+    meta = {"items": 10_000}
+    base = {
+        "meta": meta,
+        "scenarios": {
+            "parse": result(1000, 100),
+            "clean": result(1000, 100),
+            "bm25": result(1000, 100),
+            "embed": {"skipped": "torch not installed"},
+        },
+    }
+    new = {
+        "meta": meta,
+        "scenarios": {
+            # Within the thresholds
+            "parse": result(950, 110),
+            "clean": result(800, 100),
+            "bm25": result(1000, 150),
+            "embed": {"skipped": "torch not installed"},
+        },
+    }
+    lines, regressions = compare(base, new, threshold=0.1, memory_threshold=0.2)
+    assert len(lines) == 4
+    assert regressions == ["clean: throughput -20.0%", "bm25: peak memory +50.0%"]
+    assert compare(base, base)[1] == []
+
+
+def test_run_scenario(tmp_path):
+    out = run_scenario("parse", tmp_path, n_items=200, seed=0, embed_items=0)
+    # Print and online pages
+    pages = SyntheticCrossref(200).pages()
+    assert out["units"] == sum(len(page["items"]) for _, page in pages)
+    assert out["unit"] == "items"
+    assert out["throughput"] > 0
+    assert out["peak_rss_mb"] > 0
+
+
+def test_run_removes_temp_workdir(tmp_path, monkeypatch):
+    workdir = tmp_path / "bench"
+    monkeypatch.setattr(
+        "benchmarks.__main__.tempfile.mkdtemp",
+        lambda prefix: str(workdir.mkdir() or workdir),
+    )
+    out = tmp_path / "results.json"
+    argv = ["run", "--scenario", "parse", "--items", "200", "--out", str(out)]
+    main(argv)
+    assert "units" in json.loads(out.read_text())["scenarios"]["parse"]
+    assert not workdir.exists()
+
+    # A given work directory is kept
+    main([*argv, "--workdir", str(tmp_path / "kept")])
+    assert (tmp_path / "kept").is_dir()
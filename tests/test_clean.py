@@ -0,0 +1,70 @@
+import re
+
+import polars as pl
+import pytest
+
+from app.data_prep.clean import clean_pool, clean_text_expr, clean_texts_parallel
+from app.data_prep.process_data import clean_text
+
+SENTENCES = [
+    "Good muffins cost $3.88 (roughly 3,36 euros) in New York",
+    "hello    world\n\n\n",
+    "",
+    "hello-world",
+    "We don't know; they can't (really) say: \"it's 'fine'\" -- or is it?",
+    "<jats:p>We study the U.S. economy, e.g. GDP... and more.</jats:p>",
+    "He said \"yes\" and 'a' thing at 5:30, 1,000 times!",
+    "I wanna go gonna gimme cannot 'tis 'twas",
+    "price*quantity @home #1 50% & more «quoted» “this” ‘that’",
+]
+
+
+def clean(texts, remove_abstract=False):
+    df = pl.DataFrame({"text": texts})
+    return df.select(clean_text_expr("text", remove_abstract))["text"].to_list()
+
+
+def test_clean_text_expr_matches_nltk_tokenizer():
+    # Within a sentence the rules are the same as nltk's word tokenizer
+    from nltk.tokenize import word_tokenize
+
+    want = [
+        " ".join(word_tokenize(re.sub(r"<[^>]+>", "", s.lower()), preserve_line=True))
+        for s in SENTENCES
+    ]
+    assert clean(SENTENCES) == want
+
+
+def test_clean_text_expr_sentences():
+    got = clean(["In New York. Please buy two, e.g. apples etc. Thanks."])
+    assert got == ["in new york . please buy two , e.g. apples etc. thanks ."]
+
+
+def test_clean_text_expr_remove_abstract():
+    got = clean(
+        ["Abstract We study X", "ABSTRACTWe study X", "Abstract", "Our abstract"], True
+    )
+    assert got == ["we study x", "we study x", "", "our abstract"]
+
+
+def test_clean_texts_parallel_needs_str():
+    with pytest.raises(AssertionError):
+        clean_texts_parallel([None], n_workers=1)
+    assert clean_texts_parallel([], n_workers=1) == []
+
+
+def test_clean_texts_parallel_process_pool():
+    # Several chunks on two workers; a worker's error reaches the caller
+    with pytest.raises(AssertionError):
+        clean_texts_parallel([None, "a", "b", "c"], n_workers=2, chunk_size=2)
+    with clean_pool(2) as pool, pytest.raises(AssertionError):
+        clean_texts_parallel([None, "a", "b", "c"], chunk_size=2, pool=pool)
+    try:
+        want = [clean_text(s) for s in SENTENCES]
+    except LookupError:
+        pytest.skip("needs the punkt corpus")
+    assert clean_texts_parallel(SENTENCES, n_workers=2, chunk_size=2) == want
+    # One pool for several calls, as for the batches of a run
+    with clean_pool(2) as pool:
+        for _ in range(2):
+            assert clean_texts_parallel(SENTENCES, chunk_size=2, pool=pool) == want
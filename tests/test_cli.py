@@ -0,0 +1,106 @@
+import json
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from app import cli
+
+proj_dir = Path(__file__).parents[1]
+
+# Libraries that take from 100 ms (polars) to seconds (torch, nltk) to import
+HEAVY = {
+    "adapters",
+    "nltk",
+    "numpy",
+    "polars",
+    "pyarrow",
+    "scipy",
+    "sentence_transformers",
+    "torch",
+    "transformers",
+}
+
+
+def import_times(*args: str) -> tuple[float, set[str]]:
+    """Seconds spent importing and the top-level packages imported by a command"""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        capture_output=True,
+        text=True,
+        cwd=proj_dir,
+        check=True,
+    )
+    seconds = 0.0
+    packages = set()
+    for line in out.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)", line)
+        if match:
+            packages.add(match[3].split(".")[0])
+            # Unindented imports are the roots, their cumulative times add up
+            if not match[2]:
+                seconds += int(match[1]) / 1e6
+    return seconds, packages
+
+
+def test_help_is_light():
+    seconds, packages = import_times("-m", "app.cli", "--help")
+    assert not packages & HEAVY
+    assert seconds < 0.5
+
+
+def test_collection_import_budget():
+    # test_onnx needs torch by design, its importorskip loads it
+    seconds, packages = import_times(
+        "-m", "pytest", "--collect-only", "-q", "-s", "-p", "no:cacheprovider",
+        "tests", "--ignore=tests/test_onnx.py",
+    )  # fmt: skip
+    assert not packages & {"nltk", "torch", "transformers", "sentence_transformers"}
+    assert seconds < 5
+
+
+def forward(argv):
+    return argv
+
+
+def test_forwards_options(monkeypatch):
+    monkeypatch.setitem(cli.INDEXES, "bm25", "tests.test_cli:forward")
+    monkeypatch.setattr(sys, "argv", ["econ-rag"])
+    assert cli.main(["index", "bm25", "--k1", "1.2", "-h"]) == ["--k1", "1.2", "-h"]
+    assert sys.argv[0] == "econ-rag index bm25"
+
+
+def test_unknown_command():
+    with pytest.raises(SystemExit):
+        cli.main(["bogus"])
+
+
+def test_unknown_backend_is_rejected_before_loading(capsys):
+    from app import pipeline
+
+    with pytest.raises(SystemExit):
+        cli.main(["query", "growth", "--backend", "onnx_int8"])
+    with pytest.raises(SystemExit):
+        pipeline.main(["--backend", "onnx_int8"])
+    assert "invalid choice: 'onnx_int8'" in capsys.readouterr().err
+    # The choices come with no heavy import
+    _, packages = import_times("-m", "app.cli", "query", "--help")
+    assert not packages & HEAVY
+
+
+def counting(argv):
+    from app import profiling
+
+    with profiling.span("step"):
+        profiling.count(rows=len(argv))
+
+
+def test_report(monkeypatch, tmp_path):
+    monkeypatch.setitem(cli.COMMANDS, "process", ("tests.test_cli:counting", ""))
+    cli.main(["--report", "--runs-dir", str(tmp_path), "process", "a", "b"])
+    (path,) = tmp_path.glob("process-*.json")
+    report = json.loads(path.read_text())
+    assert report["counters"] == {"rows": 2}
+    assert report["spans"]["step"]["calls"] == 1
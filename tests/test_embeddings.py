@@ -0,0 +1,211 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from app.data_prep.utils import make_hive_cache_key
+from app.embeddings.artifact import artifact_from_parquet, load_artifact, save_artifact
+from app.embeddings.batching import length_batches, padding_waste
+from app.embeddings.query_cache import CachedEncoder, normalize_query
+from app.embeddings.revisions import model_revision
+from app.embeddings.shards import plan_shards, run_sharded, shard_path, stitch_shards
+from app.embeddings.store import EmbeddingStore, text_hash
+
+
+class FakeEncoder:
+    """Deterministic 4-d embeddings that record what they were asked to encode"""
+
+    def __init__(self, offset=0.0):
+        self.offset = offset
+        self.seen = []
+
+    def __call__(self, texts):
+        self.seen.extend(texts)
+        return np.array(
+            [[len(t), t.count("a"), t.count(" "), self.offset] for t in texts],
+            dtype=np.float32,
+        )
+
+
+def test_embedding_store_only_encodes_misses(tmp_path):
+    encoder = FakeEncoder()
+    store = EmbeddingStore(tmp_path, "fake", "rev1")
+    texts = ["a paper", "another paper", "a paper"]
+    first = store.embed(texts, encoder, batch_size=1)
+    assert first.shape == (3, 4)
+    assert encoder.seen == ["a paper", "another paper"]
+    np.testing.assert_array_equal(first, encoder(texts))
+
+    encoder.seen = []
+    store = EmbeddingStore(tmp_path, "fake", "rev1")
+    second = store.embed(["a paper", "a new paper"], encoder)
+    assert encoder.seen == ["a new paper"]
+    assert (store.hits, store.misses) == (1, 1)
+    np.testing.assert_array_equal(second[0], first[0])
+
+
+def test_cached_encoder(tmp_path):
+    assert normalize_query("  Demand\u00a0elasticities \n") == "Demand elasticities"
+    encoder = FakeEncoder()
+    cached = CachedEncoder(encoder, "fake", max_size=2, directory=tmp_path)
+
+    first = cached(["a paper", " a  paper", "b paper"])
+    assert encoder.seen == ["a paper", "b paper"]
+    np.testing.assert_array_equal(first[1], first[0])
+    cached(["a paper", "c paper"])  # "b paper" is the oldest and goes
+    assert cached.stats() == {
+        "size": 2,
+        "hits": 1,
+        "disk_hits": 0,
+        "misses": 3,
+        "evictions": 1,
+        "hit_rate": 0.25,
+    }
+
+    # Evicted from memory, still on disk, and on disk for a new process
+    encoder.seen = []
+    second = CachedEncoder(encoder, "fake", max_size=2, directory=tmp_path)
+    np.testing.assert_array_equal(second(["b paper"])[0], first[2])
+    assert encoder.seen == []
+    assert second.disk_hits == 1
+    # Another model, backend or revision never shares vectors
+    CachedEncoder(encoder, "other", directory=tmp_path)(["b paper"])
+    CachedEncoder(encoder, "fake", directory=tmp_path, backend="onnx")(["b paper"])
+    CachedEncoder(encoder, "fake", directory=tmp_path, revision="abc")(["b paper"])
+    assert encoder.seen == ["b paper"] * 3
+
+
+def test_cached_encoder_reads_disk_without_the_lock(tmp_path):
+    disk = CachedEncoder(FakeEncoder(), "fake", directory=tmp_path)
+    disk(["a paper"])
+    cached = CachedEncoder(FakeEncoder(), "fake")
+
+    class UnlockedDisk:
+        def get(self, key):
+            assert not cached._lock.locked()
+            return disk.disk.get(key)
+
+        def __setitem__(self, key, value):
+            assert not cached._lock.locked()
+            disk.disk[key] = value
+
+    cached.disk = UnlockedDisk()
+    cached(["a paper", "b paper"])
+    assert (cached.disk_hits, cached.misses) == (1, 1)
+
+
+def test_model_revision(tmp_path, monkeypatch):
+    monkeypatch.setenv("HF_HUB_CACHE", str(tmp_path))
+    refs = tmp_path / "models--allenai--specter2_base" / "refs"
+    refs.mkdir(parents=True)
+    (refs / "main").write_text("abc123\n")
+    assert model_revision("allenai-specter2_base") == "abc123+unknown"
+    assert model_revision("all-MiniLM-L6-v2") == "unknown"
+    assert model_revision("tests.test_embeddings:FakeEncoder") == "unknown"
+    # The embedding store and the query cache key on the same revision
+    name = "allenai-specter2_base"
+    store = EmbeddingStore(tmp_path / "store", name)
+    cached = CachedEncoder(FakeEncoder(), name)
+    assert store.revision == cached.revision == "abc123+unknown"
+
+
+def test_embedding_store_evicts_old_revision(tmp_path):
+    store = EmbeddingStore(tmp_path, "fake", "rev1")
+    store.embed(["a paper"], FakeEncoder())
+    other_model = EmbeddingStore(tmp_path, "other", "rev1")
+    other_model.embed(["a paper"], FakeEncoder())
+
+    encoder = FakeEncoder(offset=1.0)
+    store = EmbeddingStore(tmp_path, "fake", "rev2")
+    assert store.evicted == 1
+    got = store.embed(["a paper"], encoder)
+    assert encoder.seen == ["a paper"]
+    assert got[0, 3] == 1.0
+    # Only the entries of the old revision of this model are gone
+    assert other_model.key("a paper") in store.cache
+    old_key = make_hive_cache_key(
+        model="fake", revision="rev1", sha=text_hash("a paper")
+    )
+    assert old_key not in store.cache
+
+
+def test_length_batches():
+    lengths = [5, 100, 7, 100, 50, 6]
+    batches = length_batches(lengths, max_tokens=200, max_batch_size=3)
+    assert [b.tolist() for b in batches] == [[1, 3], [4, 2, 5], [0]]
+    # Every index exactly once, budget respected
+    assert sorted(np.concatenate(batches).tolist()) == list(range(len(lengths)))
+    for b in batches:
+        assert len(b) * max(lengths[i] for i in b) <= 200
+    assert padding_waste(lengths, batches) < padding_waste(lengths, [np.arange(6)])
+    # A text longer than the budget still gets its own batch
+    assert [b.tolist() for b in length_batches([300, 1], max_tokens=200)] == [[0], [1]]
+    assert length_batches([], max_tokens=200) == []
+
+
+def test_run_sharded_resumes(tmp_path):
+    texts = [f"paper {'a' * i}" for i in range(10)]
+    parq_file = tmp_path / "abstracts.parquet"
+    pl.DataFrame({"abstract": texts}).write_parquet(parq_file)
+    out_dir = tmp_path / "shards"
+    encoder = "tests.test_embeddings:FakeEncoder"
+
+    shards = run_sharded(parq_file, out_dir, encoder, shard_size=4, n_workers=2)
+    assert shards == plan_shards(10, 4) == [(0, 4), (4, 8), (8, 10)]
+    np.testing.assert_array_equal(stitch_shards(out_dir, shards), FakeEncoder()(texts))
+
+    # Only the missing shard is embedded again
+    shard_path(out_dir, 4, 8).unlink()
+    mtime = shard_path(out_dir, 0, 4).stat().st_mtime_ns
+    run_sharded(parq_file, out_dir, encoder, shard_size=4, n_workers=1)
+    assert shard_path(out_dir, 4, 8).exists()
+    assert shard_path(out_dir, 0, 4).stat().st_mtime_ns == mtime
+
+    # A different shard size starts over
+    run_sharded(parq_file, out_dir, encoder, shard_size=5, n_workers=1)
+    assert sorted(p.name for p in out_dir.glob("shard-*.npy")) == [
+        shard_path(out_dir, 0, 5).name,
+        shard_path(out_dir, 5, 10).name,
+    ]
+
+
+class ThreadsEncoder:
+    """Embeds each text as the thread counts its worker process runs with"""
+
+    def __call__(self, texts):
+        import os
+
+        threads = [int(os.environ["OMP_NUM_THREADS"]), pl.thread_pool_size()]
+        return np.array([threads] * len(texts), dtype=np.float32)
+
+
+def test_run_sharded_pins_worker_threads(tmp_path):
+    parq_file = tmp_path / "abstracts.parquet"
+    pl.DataFrame({"abstract": ["a", "b", "c"]}).write_parquet(parq_file)
+    out_dir = tmp_path / "shards"
+    encoder = "tests.test_embeddings:ThreadsEncoder"
+    shards = run_sharded(
+        parq_file, out_dir, encoder, shard_size=2, n_workers=1, threads_per_worker=3
+    )
+    np.testing.assert_array_equal(stitch_shards(out_dir, shards), np.full((3, 2), 3))
+    assert stitch_shards(out_dir, [], dim=2).shape == (0, 2)
+
+
+def test_embedding_artifact_roundtrip(tmp_path):
+    embeddings = np.random.default_rng(0).normal(size=(5, 3)).astype(np.float32)
+    df = pl.DataFrame({"doi": list("abcde"), "embedding": embeddings})
+    df.write_parquet(tmp_path / "embeddings.parquet")
+
+    out_dir = artifact_from_parquet(
+        tmp_path / "embeddings.parquet", tmp_path / "fp16", "fake", dtype="float16"
+    )
+    artifact = load_artifact(out_dir)
+    assert isinstance(artifact.matrix, np.memmap)
+    assert artifact.matrix.dtype == np.float16
+    assert (artifact.model, artifact.dim) == ("fake", 3)
+    assert artifact.rows.columns == ["row_id", "doi"]
+    assert artifact.manifest["normalized"]
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    np.testing.assert_allclose(artifact.matrix, embeddings / norms, atol=1e-3)
+
+    with pytest.raises(ValueError):
+        save_artifact(tmp_path / "bad", embeddings, df.head(2), "fake")
@@ -0,0 +1,282 @@
+import json
+import threading
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from diskcache import Cache
+
+from app.data_prep.harvest import (
+    CrossrefHarvester,
+    CrossrefQuery,
+    RateLimiter,
+    parse_rate_limit,
+    parse_retry_after,
+)
+from app.data_prep.incremental import (
+    HarvestManifest,
+    advance_watermarks,
+    plan_incremental_queries,
+)
+from app.data_prep.planner import (
+    HarvestPlan,
+    fetch_year_counts,
+    plan_harvest,
+    plan_windows,
+    reusable_queries,
+)
+from app.data_prep.record_store import RecordStore
+from app.data_prep.utils import make_hive_cache_key
+
+N_ITEMS = 5
+
+
+class StubCrossref(BaseHTTPRequestHandler):
+    """Serves N_ITEMS fake works per filter, paginated by cursor"""
+
+    requests_seen = []
+    fail_first = set()
+
+    def do_GET(self):
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        self.requests_seen.append(params)
+        if params["filter"] in self.fail_first:
+            self.fail_first.discard(params["filter"])
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+
+        if "facet" in params:
+            # Works per year, the same for every filter
+            values = {"2020": 300, "2021": 400, "2022": 400, "2023": 250}
+            message = {"items": [], "facets": {"published": {"values": values}}}
+            self._send(message)
+            return
+
+        rows = int(params["rows"])
+        start = 0 if params["cursor"] == "*" else int(params["cursor"])
+        items = [
+            {"DOI": f"10.1/{params['filter']}/{i}", "title": [f"Paper {i}"]}
+            for i in range(start, min(start + rows, N_ITEMS))
+        ]
+        self._send({"items": items, "next-cursor": str(start + rows)})
+
+    def _send(self, message: dict):
+        body = json.dumps({"message": message}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Rate-Limit-Limit", "1000")
+        self.send_header("X-Rate-Limit-Interval", "1s")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_url():
+    StubCrossref.requests_seen = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubCrossref)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/works"
+    server.shutdown()
+
+
+def test_parse_headers():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("garbage") is None
+    assert (
+        parse_rate_limit({"X-Rate-Limit-Limit": "50", "X-Rate-Limit-Interval": "1s"})
+        == 50
+    )
+    assert parse_rate_limit({}) is None
+
+
+def test_rate_limiter_pause(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("app.data_prep.harvest.time.sleep", sleeps.append)
+    limiter = RateLimiter(rate=1000)
+    limiter.wait()
+    assert sleeps == []
+    limiter.pause(0.05)
+    limiter.wait()
+    # The next request waits out the pause, later ones are spaced by the rate
+    assert sleeps == [pytest.approx(0.05, abs=0.01)]
+    limiter.wait()
+    assert sleeps[1] == pytest.approx(0.051, abs=0.01)
+
+
+@pytest.mark.parametrize("store", ["diskcache", "records"])
+def test_harvest_writes_cache(stub_url, tmp_path, store):
+    if store == "diskcache":
+        cache = Cache(tmp_path / "cache")
+    else:
+        cache = RecordStore(tmp_path / "records.sqlite")
+    queries = [
+        CrossrefQuery("2020-01-01", "2020-12-31", issn="0033-5533"),
+        CrossrefQuery("2021-01-01", "2021-12-31", issn="0033-5533"),
+        CrossrefQuery("2021-01-01", "2021-12-31", issn="0022-3808", prefix="10.1086"),
+    ]
+    StubCrossref.fail_first = {",".join(queries[0].filters())}
+    harvester = CrossrefHarvester(
+        cache, "me@example.com", max_workers=4, rows=2, backoff=0, base_url=stub_url
+    )
+    counts = harvester.harvest(queries)
+
+    assert all(n == N_ITEMS for n in counts.values())
+    # 3 pages per query (2 + 2 + 1 items) plus one retried 429
+    assert harvester.stats.pages_fetched == 9
+    assert harvester.stats.retries == 1
+    assert harvester.stats.pages_per_sec > 0
+
+    key = make_hive_cache_key(
+        issn="0033-5533",
+        date_from="2020-01-01",
+        date_to="2020-12-31",
+        cursor="*",
+        prefix=None,
+    )
+    assert key in cache
+    assert len(cache[key]["items"]) == 2
+
+    # Second run is served from cache only
+    n_requests = len(StubCrossref.requests_seen)
+    harvester.harvest(queries)
+    assert len(StubCrossref.requests_seen) == n_requests
+    assert harvester.stats.cache_hits == 9
+
+
+def test_incremental_plan(tmp_path):
+    issns = {"Econometrica": {"print": "0012-9682", "online": "1468-0262"}}
+    date_ranges = [
+        {"year": 2023, "date_from": "2023-01-01", "date_to": "2023-12-31"},
+        {"year": 2024, "date_from": "2024-01-01", "date_to": "2024-06-30"},
+    ]
+    manifest = HarvestManifest(tmp_path / "manifest.json")
+    manifest.set("Econometrica", "0012-9682", "2024-06-01")
+
+    today = date(2024, 6, 30)
+    queries = plan_incremental_queries(manifest, issns, date_ranges, today=today)
+    # Online ISSN has no watermark -> full backfill, print ISSN -> one delta query
+    assert len(queries) == 3
+    delta = [q for q in queries if q.date_field == "index"]
+    assert delta == [
+        CrossrefQuery("2024-06-01", "2024-06-30", issn="0012-9682", date_field="index")
+    ]
+    assert "from-index-date:2024-06-01" in delta[0].filters()
+    assert "date_field=index" in delta[0].cache_key("*")
+    # Full harvest keys are unchanged
+    backfill = [q for q in queries if q.date_field == "pub"][0]
+    assert "date_field" not in backfill.cache_key("*")
+
+    advance_watermarks(manifest, queries, today=today)
+    manifest.save()
+    reloaded = HarvestManifest(tmp_path / "manifest.json")
+    assert reloaded.get("Econometrica", "1468-0262") == "2024-06-30"
+    assert len(plan_incremental_queries(reloaded, issns, date_ranges, today=today)) == 2
+
+
+YEARS = [
+    {"year": y, "date_from": f"{y}-01-01", "date_to": f"{y}-12-31"}
+    for y in range(2020, 2024)
+]
+
+
+def test_plan_windows():
+    counts = {2020: 300, 2021: 400, 2022: 400, 2023: 9000}
+    windows = plan_windows(YEARS, counts, rows=1000, max_pages=4)
+    # 2020-2021 fit a page, 2022 would not fit with them, 2023 is split in 3
+    assert windows[:2] == [
+        ("2020-01-01", "2021-12-31", 700),
+        ("2022-01-01", "2022-12-31", 400),
+    ]
+    assert [w[:2] for w in windows[2:]] == [
+        ("2023-01-01", "2023-04-30"),
+        ("2023-05-01", "2023-08-31"),
+        ("2023-09-01", "2023-12-31"),
+    ]
+    # Unknown counts: one window per year
+    assert len(plan_windows(YEARS, None)) == len(YEARS)
+    # Neither across a gap nor into a year that has not ended
+    this_year = {"year": 2024, "date_from": "2024-01-01", "date_to": "2024-06-01"}
+    ranges = [YEARS[0], YEARS[2], this_year]
+    assert plan_windows(ranges, {2020: 1, 2022: 1, 2024: 1}) == [
+        ("2020-01-01", "2020-12-31", 1),
+        ("2022-01-01", "2022-12-31", 1),
+        ("2024-01-01", "2024-06-01", 1),
+    ]
+
+
+def test_plan_harvest_halves_requests(stub_url, tmp_path):
+    issns = {
+        "Econometrica": {"print": "0012-9682", "online": "1468-0262"},
+        "Journal of Political Economy": {"print": "0022-3808", "online": "1537-534X"},
+    }
+    prefixes = {"Journal of Political Economy": "10.1086"}
+    harvester = CrossrefHarvester(
+        RecordStore(tmp_path / "records.sqlite"), "me@example.com", base_url=stub_url
+    )
+    year_counts = fetch_year_counts(harvester, issns, YEARS, prefixes)
+    assert year_counts["Econometrica"][2021] == 400
+    facet_filter = StubCrossref.requests_seen[0]["filter"]
+    assert facet_filter.startswith("issn:0012-9682,issn:1468-0262,")
+
+    plan = plan_harvest(issns, YEARS, prefixes, year_counts)
+    assert plan.expected_requests * 2 <= plan.baseline_requests
+    queries = plan.to_queries()
+    # Per journal 2020-2021 and 2022-2023, instead of 2 ISSNs x 4 years
+    assert len(queries) == 2 * 2
+    jpe = [q for q in queries if q.prefix]
+    assert [q.filters()[0] for q in jpe] == ["prefix:10.1086"] * 2
+
+    plan.save(tmp_path / "plan.json")
+    reloaded = HarvestPlan.load(tmp_path / "plan.json")
+    assert reloaded.to_queries() == queries
+    assert reloaded.expected_requests == plan.expected_requests
+
+    manifest = HarvestManifest(tmp_path / "manifest.json")
+    advance_watermarks(manifest, queries, today=date(2024, 1, 1))
+    assert manifest.get("Econometrica", "1468-0262") == "2024-01-01"
+
+
+def test_plan_harvest_reuses_windows_of_past_years(tmp_path):
+    issns = {"Econometrica": {"print": "0012-9682", "online": "1468-0262"}}
+    this_year = {"year": 2024, "date_from": "2024-01-01", "date_to": "2024-06-01"}
+    counts = {2020: 300, 2021: 400, 2022: 400, 2023: 9000, 2024: 10}
+    first = plan_harvest(
+        issns,
+        [*YEARS, this_year],
+        year_counts={"Econometrica": counts},
+        today=date(2024, 6, 1),
+    )
+    first.save(tmp_path / "plan.json")
+    saved = HarvestPlan.load(tmp_path / "plan.json")
+    assert saved.planned_on == "2024-06-01"
+
+    # Late works of 2021 would pack the years differently; a new start year
+    later = {"year": 2024, "date_from": "2024-01-01", "date_to": "2024-09-01"}
+    ranges = [{"year": 2019, "date_from": "2019-01-01", "date_to": "2019-12-31"}]
+    ranges += [*YEARS, later]
+    reused, todo = reusable_queries(saved, issns, ranges)["Econometrica"]
+    assert [r["year"] for r in todo] == [2019, 2024]
+    counts = {**counts, 2019: 50, 2021: 800}
+    second = plan_harvest(
+        issns, ranges, year_counts={"Econometrica": counts}, reuse=saved
+    )
+    windows = [(p.query.date_from, p.query.date_to) for p in second.queries]
+    past = [(p.query.date_from, p.query.date_to) for p in first.queries[:-1]]
+    assert windows[: len(past)] == past
+    assert windows[len(past) :] == [
+        ("2019-01-01", "2019-12-31"),
+        ("2024-01-01", "2024-09-01"),
+    ]
+    assert second.reused == len(past)
+    assert "reused from the saved plan" in second.summary()
+    # A plan without a date reuses nothing
+    saved.planned_on = None
+    assert len(reusable_queries(saved, issns, ranges)["Econometrica"][1]) == 6
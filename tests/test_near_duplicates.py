@@ -0,0 +1,88 @@
+import numpy as np
+import polars as pl
+
+from app.data_prep.near_duplicates import (
+    candidate_pairs,
+    find_near_duplicates,
+    minhash_signatures,
+    parallel_signatures,
+    remove_near_duplicates,
+)
+
+WORDS = [f"w{i}" for i in range(1000)]
+
+
+def abstract(seed: int, n_words: int = 150) -> list[str]:
+    rng = np.random.default_rng(seed)
+    return list(rng.choice(WORDS, n_words))
+
+
+def edited(words: list[str], positions: list[int]) -> str:
+    words = list(words)
+    for i in positions:
+        words[i] = "changed"
+    return " ".join(words)
+
+
+def corpus() -> pl.DataFrame:
+    paper, other = abstract(0), abstract(1)
+    texts = [
+        " ".join(paper),
+        " ".join(other),
+        # The first paper from the other feed, one and two words edited
+        edited(paper, [10]),
+        edited(paper, [10, 90]),
+        "",
+        None,
+    ]
+    return pl.DataFrame(
+        {
+            "title": [f"Paper {i}" for i in range(6)],
+            "doi": ["", "10.1/b", "10.1/c", "10.1/d", "10.1/e", "10.1/f"],
+            "journal": [
+                "Econometrica",
+                "Econometrica",
+                "Econometrica",
+                "Other",
+                "",
+                "",
+            ],
+            "desired_journal": "Econometrica",
+            "tokenized_abstract": texts,
+        }
+    )
+
+
+def test_signatures():
+    df = corpus()
+    signatures = minhash_signatures(df["tokenized_abstract"])
+    assert signatures.shape == (6, 128)
+    assert (minhash_signatures(df["tokenized_abstract"]) == signatures).all()
+    assert (parallel_signatures(df["tokenized_abstract"]) == signatures).all()
+    # Empty and missing texts are never candidates
+    pairs = candidate_pairs(signatures)
+    assert set(pairs.ravel()) <= {0, 1, 2, 3}
+
+
+def test_find_near_duplicates():
+    df = corpus()
+    clusters, stats = find_near_duplicates(
+        df, minhash_signatures(df["tokenized_abstract"])
+    )
+    assert stats.clusters == 1
+    assert stats.removed == 2
+    assert sorted(clusters["row"]) == [0, 2, 3]
+    # Row 0 has no DOI, row 3 is from another journal
+    assert clusters.filter("keep")["row"].to_list() == [2]
+    assert set(clusters["canonical"]) == {2}
+
+
+def test_remove_near_duplicates(tmp_path):
+    parquet_file = tmp_path / "abstracts_clean.parquet"
+    corpus().write_parquet(parquet_file)
+    stats = remove_near_duplicates(parquet_file, tmp_path / "clusters.parquet")
+    assert stats.removed == 2
+    kept = pl.read_parquet(parquet_file)
+    assert kept["title"].to_list() == ["Paper 1", "Paper 2", "Paper 4", "Paper 5"]
+    clusters = pl.read_parquet(tmp_path / "clusters.parquet")
+    assert clusters.columns == ["row", "cluster", "canonical", "keep", "doi", "title"]
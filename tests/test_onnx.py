@@ -0,0 +1,28 @@
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("onnx")
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("adapters")
+
+from app.embeddings.encoders import ENCODERS  # noqa: E402
+from app.embeddings.onnx_backend import OnnxEncoder, export_onnx  # noqa: E402
+from app.retrieval.dense import l2_normalize  # noqa: E402
+
+TEXTS = [
+    "We estimate demand elasticities for differentiated products.",
+    "A randomized controlled trial of microfinance in India.",
+    "Weak instruments",
+    "Abstract " + "Monetary policy shocks and inflation expectations. " * 60,
+]
+
+
+@pytest.mark.parametrize("model", list(ENCODERS))
+def test_onnx_parity_with_torch(tmp_path, model):
+    want = l2_normalize(ENCODERS[model]()(TEXTS))
+    export_onnx(model, tmp_path, quantize=True)
+    for int8, min_cosine in [(False, 0.9999), (True, 0.98)]:
+        got = l2_normalize(OnnxEncoder(tmp_path, int8=int8, batch_size=2)(TEXTS))
+        cosine = (got * want).sum(axis=1)
+        assert cosine.min() > min_cosine, (int8, cosine)
@@ -0,0 +1,104 @@
+import polars as pl
+from diskcache import Cache
+
+from app.data_prep.parquet_sink import (
+    NULL_YEAR,
+    make_hive_path,
+    scan_raw,
+    stream_cache_to_parquet,
+    stream_records_to_parquet,
+)
+from app.data_prep.record_store import RecordStore
+from app.data_prep.utils import make_hive_cache_key
+
+
+def make_item(doi, year, journal="Econometrica"):
+    return {
+        "DOI": doi,
+        "title": [f"Title {doi}"],
+        "author": [{"given": "Ada", "family": "Lovelace"}],
+        "issued": {"date-parts": [[year]]},
+        "abstract": "<jats:p>Some abstract</jats:p>",
+        "container-title": [journal],
+    }
+
+
+def test_make_hive_path():
+    assert str(make_hive_path(year=2020, journal="Econometrica")) == (
+        "journal=Econometrica/year=2020"
+    )
+
+
+def test_stream_cache_to_parquet(tmp_path):
+    cache = Cache(tmp_path / "cache")
+    key = make_hive_cache_key(
+        issn="0012-9682",
+        date_from="2020-01-01",
+        date_to="2021-12-31",
+        cursor="*",
+        prefix=None,
+    )
+    cache[key] = {"items": [make_item("10.1/a", 2020), make_item("10.1/b", 2021)]}
+    delta_key = make_hive_cache_key(
+        issn="0012-9682",
+        date_from="2024-01-01",
+        date_to="2024-02-01",
+        cursor="*",
+        prefix=None,
+        date_field="index",
+    )
+    cache[delta_key] = {
+        "items": [make_item("10.1/c", None, journal=None), make_item("10.1/b", 2021)]
+    }
+
+    out_dir = tmp_path / "raw"
+    assert stream_cache_to_parquet(cache, out_dir) == 4
+    assert (out_dir / "journal=Econometrica" / "year=2020").is_dir()
+    assert (out_dir / "journal=Econometrica" / f"year={NULL_YEAR}").is_dir()
+
+    df = scan_raw(out_dir).filter(pl.col("year") == 2021).collect()
+    assert df["doi"].sort().to_list() == ["10.1/b", "10.1/b"]
+    assert df["harvested_until"].sort(nulls_last=True).to_list() == [
+        "2024-02-01",
+        None,
+    ]
+
+    # Re-running overwrites the same files instead of adding new ones
+    n_files = len(list(out_dir.rglob("*.parquet")))
+    stream_cache_to_parquet(cache, out_dir)
+    assert len(list(out_dir.rglob("*.parquet"))) == n_files
+
+
+def test_stream_records_to_parquet(tmp_path):
+    store = RecordStore(tmp_path / "records.sqlite")
+    items = [make_item("10.1/a", 2020), make_item("10.1/b", None, journal=None)]
+    for issn in ("0012-9682", "1468-0262"):
+        key = make_hive_cache_key(
+            issn=issn,
+            date_from="2020-01-01",
+            date_to="2021-12-31",
+            cursor="*",
+            prefix=None,
+        )
+        store[key] = {"items": items}
+    delta_key = make_hive_cache_key(
+        issn="0012-9682",
+        date_from="2024-01-01",
+        date_to="2024-02-01",
+        cursor="*",
+        prefix=None,
+        date_field="index",
+    )
+    store[delta_key] = {"items": [make_item("10.1/a", 2021)]}
+
+    out_dir = tmp_path / "raw"
+    (out_dir / "stale").mkdir(parents=True)
+    # Print and online pages share their records
+    assert stream_records_to_parquet(store, out_dir, batch_size=1) == 2
+    assert not (out_dir / "stale").exists()
+    df = scan_raw(out_dir).sort("doi").collect()
+    assert df["doi"].to_list() == ["10.1/a", "10.1/b"]
+    assert df["year"].to_list() == [2021, NULL_YEAR]
+    assert df["harvested_until"].to_list() == ["2024-02-01", None]
+    assert df["journal"].to_list() == ["Econometrica"] * 2
+    assert df["desired_journal"].to_list() == ["Econometrica"] * 2
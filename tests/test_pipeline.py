@@ -0,0 +1,105 @@
+from pathlib import Path
+
+import pytest
+
+from app.pipeline import PipelineState, Stage, data_stages, run_pipeline
+
+CALLS = []
+
+
+def upper(argv):
+    source, out = map(Path, argv)
+    CALLS.append("upper")
+    out.write_text(source.read_text().strip().upper())
+
+
+def count_words(argv):
+    source, out = map(Path, argv)
+    CALLS.append("count")
+    out.write_text(str(len(source.read_text().split())))
+
+
+def fail(argv):
+    raise RuntimeError("stage failed")
+
+
+def stages(root: Path, target: str = "tests.test_pipeline:count_words"):
+    source, clean, counts = root / "source.txt", root / "clean.txt", root / "n.txt"
+    modules = ("tests.test_pipeline",)
+    return [
+        Stage(
+            "clean",
+            "tests.test_pipeline:upper",
+            argv=(str(source), str(clean)),
+            modules=modules,
+            inputs=(source,),
+            outputs=(clean,),
+        ),
+        Stage(
+            "count",
+            target,
+            argv=(str(clean), str(counts)),
+            modules=modules,
+            inputs=(clean,),
+            outputs=(counts,),
+        ),
+    ]
+
+
+def run(root: Path, **kwargs) -> dict[str, str]:
+    CALLS.clear()
+    state = PipelineState(root / "state.json", root)
+    return run_pipeline(kwargs.pop("stages", None) or stages(root), state, **kwargs)
+
+
+def test_skips_unchanged_stages(tmp_path):
+    source = tmp_path / "source.txt"
+    source.write_text("a b c")
+    assert run(tmp_path) == {"clean": "ran", "count": "ran"}
+    assert run(tmp_path) == {"clean": "unchanged", "count": "unchanged"}
+    assert CALLS == []
+
+    # Same bytes, new mtime
+    source.write_text("a b c")
+    assert run(tmp_path) == {"clean": "unchanged", "count": "unchanged"}
+    # New input, but the same output of the first stage
+    source.write_text("a b c\n")
+    assert run(tmp_path) == {"clean": "ran", "count": "unchanged"}
+    source.write_text("a b c d")
+    assert run(tmp_path) == {"clean": "ran", "count": "ran"}
+    assert (tmp_path / "n.txt").read_text() == "4"
+
+
+def test_reruns_missing_outputs_and_forced_stages(tmp_path):
+    (tmp_path / "source.txt").write_text("a b")
+    run(tmp_path)
+    (tmp_path / "n.txt").unlink()
+    assert run(tmp_path) == {"clean": "unchanged", "count": "ran"}
+    assert run(tmp_path, force=("clean",)) == {"clean": "ran", "count": "unchanged"}
+    assert CALLS == ["upper"]
+    assert run(tmp_path, skip=("clean",), dry_run=True, force=("all",)) == {
+        "clean": "skipped",
+        "count": "would run",
+    }
+    assert CALLS == []
+
+
+def test_failed_stage_runs_again(tmp_path):
+    (tmp_path / "source.txt").write_text("a b")
+    with pytest.raises(RuntimeError):
+        run(tmp_path, stages=stages(tmp_path, "tests.test_pipeline:fail"))
+    # The first stage is recorded, the failed one is not
+    assert run(tmp_path) == {"clean": "unchanged", "count": "ran"}
+
+
+def test_embed_stage_follows_the_model_revision(tmp_path, monkeypatch):
+    monkeypatch.setenv("HF_HUB_CACHE", str(tmp_path / "hub"))
+    refs = tmp_path / "hub" / "models--sentence-transformers--all-MiniLM-L6-v2"
+    embed = data_stages(root=tmp_path)[-1]
+    assert "app.data_prep.save_embeddings2" in embed.modules
+    # A change to how the revision is derived also reruns the stage
+    assert "app.embeddings.revisions" in embed.modules
+    assert embed.params == {"revision": "unknown"}
+    (refs / "refs").mkdir(parents=True)
+    (refs / "refs" / "main").write_text("abc123")
+    assert data_stages(root=tmp_path)[-1].params == {"revision": "abc123"}
@@ -0,0 +1,112 @@
+import polars as pl
+
+from app.data_prep.parquet_sink import NULL_YEAR
+from app.data_prep.process_data import (
+    clean_abstracts,
+    parse_crossref_cache_entry,
+    parse_crossref_page,
+    read_crossref_items,
+    select_crossref_fields,
+    sink_clean_abstracts,
+)
+
+ITEMS = [
+    {
+        "DOI": "10.3982/ECTA1",
+        "title": ["Demand Estimation"],
+        "author": [
+            {"given": "Steven", "family": "Berry", "sequence": "first"},
+            {"family": "Pakes"},
+            {"given": "", "family": "Levinsohn"},
+            {"name": "Some Consortium"},
+        ],
+        "issued": {"date-parts": [[1995, 7]]},
+        "abstract": "<jats:p>We estimate demand.</jats:p>",
+        "container-title": ["Econometrica"],
+    },
+    # Missing and empty fields everywhere
+    {"DOI": "10.3982/ECTA2", "title": [], "container-title": []},
+    {"issued": {"date-parts": [[None]]}, "author": []},
+]
+
+
+def test_parse_crossref_page_matches_dicts():
+    entry = {"items": ITEMS, "next-cursor": "abc"}
+    want = parse_crossref_cache_entry(entry, "Econometrica")
+    got = parse_crossref_page(entry, "Econometrica")
+    assert got.to_dicts() == want
+    assert want[0]["authors"] == ["Steven Berry", "Pakes", "Levinsohn", ""]
+
+
+def test_parse_crossref_page_empty():
+    got = parse_crossref_page({"items": []}, "Econometrica")
+    assert got.is_empty()
+    assert got.columns == [
+        "title",
+        "year",
+        "doi",
+        "authors",
+        "abstract",
+        "journal",
+        "desired_journal",
+    ]
+
+
+def test_read_crossref_items_from_json():
+    raw = '[{"DOI": "10.1/x", "title": ["T"], "issued": {"date-parts": [[2001]]}}]'
+    df = select_crossref_fields(read_crossref_items(raw))
+    assert df.row(0) == ("T", 2001, "10.1/x", [], "", "", None)
+    lazy = select_crossref_fields(read_crossref_items(raw).lazy())
+    assert isinstance(lazy, pl.LazyFrame)
+
+
+def test_clean_abstracts(tmp_path):
+    def row(doi, abstract, title="T", authors=("Ada",), until=None, year=2020):
+        return {
+            "title": title,
+            "doi": doi,
+            "authors": list(authors),
+            "abstract": abstract,
+            "desired_journal": "Review of Economic Studies",
+            "harvested_until": until,
+            "journal": "The Review of Economic Studies",
+            "year": year,
+        }
+
+    raw = pl.LazyFrame(
+        [
+            row("a", "<jats:p>Abstract Old.</jats:p>"),
+            # The incremental update wins
+            row("a", "<jats:p>New results.</jats:p>", until="2024-02-01"),
+            row("b", "Same text"),
+            # Same title and abstract as b under another DOI
+            row("c", "Same text"),
+            row("d", "Has authors"),
+            # The latest record of d has no authors, so d is dropped
+            row("d", "Has authors", authors=(), until="2024-02-01"),
+            row("e", "Unknown year", year=NULL_YEAR),
+            # Records without a DOI are not versions of one record
+            row("", "First without DOI", title="One"),
+            row("", "Second without DOI", title="Two"),
+            row("", "Second without DOI", title="Two"),
+        ]
+    )
+    df = clean_abstracts(raw, "regex").collect()
+    assert df["doi"].to_list() == ["a", "b", "e", "", ""]
+    assert df["title"].to_list()[-2:] == ["One", "Two"]
+    assert df.row(0, named=True) == {
+        "title": "T",
+        "year": 2020,
+        "doi": "a",
+        "authors": ["Ada"],
+        "abstract": "T\nNew results.",
+        "journal": "Review of Economic Studies",
+        "desired_journal": "Review of Economic Studies",
+        "abstract_original": "<jats:p>New results.</jats:p>",
+        "tokenized_abstract": "new results .",
+    }
+    assert df["year"].to_list() == [2020, 2020, None, 2020, 2020]
+
+    out_file = sink_clean_abstracts(raw, tmp_path / "abstracts_clean.parquet", "regex")
+    assert pl.read_parquet(out_file).equals(df)
+    assert list(tmp_path.iterdir()) == [out_file]
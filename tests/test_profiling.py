@@ -0,0 +1,59 @@
+import json
+import threading
+import time
+
+import pytest
+
+from app import profiling
+
+
+def test_span_and_count_without_profiler():
+    with profiling.span("noop"):
+        profiling.count(rows=1)
+    assert profiling.active() is None
+
+
+def test_profiler_collects_spans_and_counters(tmp_path):
+    with profiling.Profiler("test") as profiler:
+        with profiling.span("io"):
+            time.sleep(0.02)
+        for _ in range(3):
+            with profiling.span("cpu"):
+                sum(range(10_000))
+        threads = [
+            threading.Thread(target=profiling.count, kwargs={"requests": 1})
+            for _ in range(4)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        profiling.record("worker.forward", 1.5, 1.2)
+    assert profiling.active() is None
+
+    report = profiler.report()
+    assert report["counters"] == {"requests": 4}
+    assert report["spans"]["cpu"]["calls"] == 3
+    # Sleeping is wall time without CPU time
+    assert report["spans"]["io"]["seconds"] >= 0.02
+    assert report["spans"]["io"]["cpu_seconds"] < report["spans"]["io"]["seconds"]
+    # Slowest first
+    assert next(iter(report["spans"])) == "worker.forward"
+    assert report["peak_rss_mb"] > 0
+
+    path = profiler.save(tmp_path)
+    assert json.loads(path.read_text())["name"] == "test"
+
+
+def test_cprofile_dump(tmp_path):
+    with profiling.Profiler("test", profile="cprofile") as profiler:
+        sum(range(10_000))
+    path = profiler.save(tmp_path)
+    assert (tmp_path / json.loads(path.read_text())["profile"]).stat().st_size > 0
+
+
+def test_one_profiler_at_a_time():
+    with profiling.Profiler("outer"):
+        with pytest.raises(RuntimeError):
+            with profiling.Profiler("inner"):
+                pass
@@ -0,0 +1,95 @@
+import sqlite3
+
+import pytest
+from diskcache import Cache
+
+from app.data_prep.record_store import MAX_VARIABLES, RecordStore, open_record_store
+from app.data_prep.utils import make_hive_cache_key
+
+
+def page_key(issn, date_field=None, date_to="2020-12-31", cursor="*"):
+    fields = dict(
+        issn=issn, date_from="2020-01-01", date_to=date_to, cursor=cursor, prefix=None
+    )
+    if date_field:
+        fields["date_field"] = date_field
+    return make_hive_cache_key(**fields)
+
+
+def item(doi, abstract="Some abstract"):
+    return {"DOI": doi, "title": [f"Title {doi}"], "abstract": abstract}
+
+
+@pytest.mark.parametrize("codec", ["zlib", "zstd"])
+def test_pages_share_records(tmp_path, codec):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    store = RecordStore(tmp_path / "records.sqlite", codec=codec)
+    print_page = {"items": [item("10.1/a"), item("10.1/b")], "next-cursor": "abc"}
+    online_page = {"items": [item("10.1/b"), item("10.1/a"), {"title": ["No DOI"]}]}
+    store[page_key("0012-9682")] = print_page
+    store[page_key("1468-0262")] = online_page
+
+    assert page_key("0012-9682") in store
+    assert page_key("0012-9682", cursor="abc") not in store
+    assert store.get(page_key("0000-0000")) is None
+    # Pages come back in their own order, with their cursor
+    assert store[page_key("0012-9682")] == print_page
+    assert store[page_key("1468-0262")]["items"] == online_page["items"]
+    assert store.stats()["pages"] == 2
+    assert store.stats()["page_items"] == 5
+    # Each article once, the item without a DOI under a content hash
+    records = [r for batch in store.iter_records(batch_size=2) for r in batch]
+    assert [r.doi for r in records][:2] == ["10.1/a", "10.1/b"]
+    assert records[2].doi.startswith("sha1:")
+    assert store.stats()["records"] == 3
+
+
+def test_incremental_versions_win(tmp_path):
+    store = RecordStore(tmp_path / "records.sqlite")
+    store[page_key("0012-9682")] = {"items": [item("10.1/a", "Old")]}
+    delta = page_key("0012-9682", date_field="index", date_to="2024-02-01")
+    store[delta] = {"items": [item("10.1/a", "New")]}
+    # A full harvest page read later does not undo the update
+    store[page_key("1468-0262")] = {"items": [item("10.1/a", "Old")]}
+
+    (record,) = next(store.iter_records())
+    assert record.harvested_until == "2024-02-01"
+    assert record.issn == "0012-9682"
+    assert b'"abstract":"New"' in record.item
+    assert store[page_key("1468-0262")]["items"][0]["abstract"] == "New"
+
+
+def test_open_record_store_imports_cache(tmp_path):
+    cache = Cache(tmp_path / "data" / "cache")
+    cache[page_key("0012-9682")] = {"items": [item("10.1/a")]}
+    cache.close()
+
+    store = open_record_store(tmp_path)
+    assert store[page_key("0012-9682")]["items"] == [item("10.1/a")]
+    assert (tmp_path / "data" / "records.sqlite").exists()
+
+
+def test_digest_tracks_records_not_pages(tmp_path):
+    store = RecordStore(tmp_path / "records.sqlite")
+    page = {"items": [item("10.1/a"), item("10.1/b")]}
+    store[page_key("0012-9682")] = page
+    digest = store.digest()
+    # The online ISSN page returns the same records
+    store[page_key("1468-0262")] = {"items": page["items"][::-1]}
+    assert store.digest() == digest
+    store[page_key("0012-9682")] = {"items": [item("10.1/a", "New abstract")]}
+    assert store.digest() != digest
+
+
+def test_page_larger_than_the_variable_limit(tmp_path):
+    store = RecordStore(tmp_path / "records.sqlite")
+    # The limit of SQLite before 3.32; Crossref pages hold up to 1000 items
+    store._db.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+    page = {"items": [item(f"10.1/{i}") for i in range(2 * MAX_VARIABLES + 200)]}
+    assert store.put_page(page_key("0012-9682"), page) == len(page["items"])
+    assert store[page_key("0012-9682")]["items"] == page["items"]
+    # Every DOI is found across the chunks, so nothing is rewritten
+    assert store.put_page(page_key("1468-0262"), page) == 0
+    page["items"][-1]["abstract"] = "Changed"
+    assert store.put_page(page_key("1468-0262"), page) == 1
@@ -0,0 +1,259 @@
+import numpy as np
+import polars as pl
+import pytest
+from rank_bm25 import BM25Okapi
+
+from app.embeddings.artifact import save_artifact
+from app.retrieval.ann import (
+    IVF_DIR,
+    IVFRetriever,
+    artifact_meta,
+    build_ivf,
+    load_ivf,
+    recall_at_k,
+    save_ivf,
+)
+from app.retrieval.bm25 import build_bm25, load_bm25, save_bm25, tokenize
+from app.retrieval.dense import Retriever, l2_normalize, load_retriever, topk
+from app.retrieval.hybrid import (
+    HybridRetriever,
+    MetadataFilter,
+    reciprocal_rank_fusion,
+)
+from app.retrieval.quantize import (
+    QuantizedRetriever,
+    load_codes,
+    quantize,
+    save_codes,
+)
+
+
+def corpus(n=200, d=16, seed=0):
+    rng = np.random.default_rng(seed)
+    matrix = rng.normal(size=(n, d)).astype(np.float32)
+    rows = pl.DataFrame({"doi": [f"10.1/{i}" for i in range(n)]})
+    return matrix, rows
+
+
+def test_topk():
+    scores = np.array([[0.1, 0.9, 0.5, 0.7], [1.0, 0.0, 0.2, 0.3]])
+    idx, top = topk(scores, 2)
+    assert idx.tolist() == [[1, 3], [0, 3]]
+    np.testing.assert_allclose(top, [[0.9, 0.7], [1.0, 0.3]])
+    assert topk(scores[0], 10)[0].shape == (1, 4)
+
+
+def test_retriever_matches_brute_force(tmp_path):
+    matrix, rows = corpus()
+    save_artifact(tmp_path, matrix, rows, "fake")
+    retriever = load_retriever(tmp_path)
+    assert type(retriever) is Retriever
+    with pytest.raises(ValueError, match="Unknown index"):
+        load_retriever(tmp_path, index="hnsw")
+    queries = np.random.default_rng(1).normal(size=(5, 16))
+
+    ids, scores = retriever.search_ids(queries, k=10)
+    sims = l2_normalize(queries) @ l2_normalize(matrix).T
+    want = np.argsort(-sims, axis=1)[:, :10]
+    np.testing.assert_array_equal(ids, want)
+    np.testing.assert_allclose(scores, np.take_along_axis(sims, want, 1), rtol=1e-5)
+
+    # Single query, results with metadata
+    results = retriever.search(matrix[7], k=3)
+    assert len(results) == 1
+    assert results[0].columns == ["rank", "row_id", "score", "doi"]
+    assert results[0].row(0)[:2] == (1, 7)
+    assert results[0]["doi"][0] == "10.1/7"
+
+
+def test_retriever_scores_normalized_artifact_in_place(tmp_path, monkeypatch):
+    matrix, rows = corpus()
+    save_artifact(tmp_path, matrix, rows, "fake", dtype="float16")
+    retriever = Retriever.from_artifact(tmp_path)
+    # The memmap itself, not a float32 copy
+    assert isinstance(retriever.matrix, np.memmap)
+    assert retriever.matrix.dtype == np.float16
+    np.testing.assert_allclose(
+        np.linalg.norm(retriever.matrix.astype(np.float32), axis=1), 1, atol=1e-3
+    )
+
+    monkeypatch.setattr("app.retrieval.dense.SCORE_BLOCK", 7)
+    queries = np.random.default_rng(1).normal(size=(3, 16))
+    ids, scores = retriever.search_ids(queries, k=5)
+    exact_ids, exact_scores = Retriever(matrix).search_ids(queries, k=5)
+    np.testing.assert_array_equal(ids, exact_ids)
+    np.testing.assert_allclose(scores, exact_scores, atol=1e-2)
+
+
+def test_ivf_index(tmp_path):
+    # Clustered data, like real embeddings
+    rng = np.random.default_rng(2)
+    centers = rng.normal(size=(20, 16))
+    matrix = (
+        centers[rng.integers(0, 20, 2000)] + rng.normal(scale=0.3, size=(2000, 16))
+    ).astype(np.float32)
+    rows = pl.DataFrame({"doi": [f"10.1/{i}" for i in range(2000)]})
+    save_artifact(tmp_path, matrix, rows, "fake")
+
+    index = build_ivf(matrix, n_lists=32)
+    assert index.offsets[-1] == len(matrix)
+    assert sorted(index.ids.tolist()) == list(range(len(matrix)))
+
+    save_ivf(index, tmp_path / IVF_DIR, artifact_meta(tmp_path))
+    loaded = load_ivf(tmp_path / IVF_DIR, artifact_directory=tmp_path)
+    assert isinstance(loaded.vectors, np.memmap)
+
+    queries = matrix[:50] + rng.normal(scale=0.1, size=(50, 16))
+    exact, _ = Retriever(matrix).search_ids(queries, k=10)
+    # All lists probed: exact search
+    ids, _ = loaded.search_ids(queries, k=10, nprobe=32)
+    assert recall_at_k(ids, exact) == 1.0
+    few, _ = loaded.search_ids(queries, k=10, nprobe=4)
+    assert 0.5 < recall_at_k(few, exact) <= 1.0
+
+    retriever = load_retriever(tmp_path, index="ivf", nprobe=4)
+    assert isinstance(retriever, IVFRetriever) and retriever.nprobe == 4
+    results = retriever.search(matrix[7], k=3)
+    assert results[0]["row_id"][0] == 7
+    assert results[0]["doi"][0] == "10.1/7"
+
+    # Same rows, rewritten artifact
+    save_artifact(tmp_path, matrix, rows, "fake")
+    with pytest.raises(ValueError, match="econ-rag index ann --model fake"):
+        IVFRetriever.from_artifact(tmp_path)
+    save_artifact(tmp_path, matrix[:1000], rows.head(1000), "fake")
+    with pytest.raises(ValueError, match="stale"):
+        load_ivf(tmp_path / IVF_DIR, artifact_directory=tmp_path)
+
+
+def test_bm25_matches_rank_bm25(tmp_path):
+    rng = np.random.default_rng(3)
+    words = [f"w{i}" for i in range(50)]
+    # Zipf-like term frequencies, so some terms are in most documents
+    p = 1 / np.arange(1, 51)
+    docs = [
+        list(rng.choice(words, rng.integers(0, 30), p=p / p.sum())) for _ in range(300)
+    ]
+    queries = [["w0", "w3", "w3", "w17"], ["w45", "nope"], ["nope"]]
+
+    index = build_bm25([" ".join(d) for d in docs])
+    want = np.array([BM25Okapi(docs).get_scores(q) for q in queries])
+    np.testing.assert_allclose(
+        index.scores(queries).toarray(), want, rtol=1e-5, atol=1e-6
+    )
+
+    save_bm25(index, tmp_path)
+    rows = pl.DataFrame({"doc": range(300)})
+    loaded = load_bm25(tmp_path, rows)
+    ids, scores = loaded.search_ids(queries, k=5)
+    assert ids[0].tolist() == np.argsort(-want[0], kind="stable")[:5].tolist()
+    # Nothing matches: padding, and an empty result frame
+    assert (ids[2] == -1).all()
+    assert loaded.search(queries, k=5)[2].is_empty()
+    assert loaded.search(queries, k=5)[1]["doc"][0] == ids[1][0]
+
+
+@pytest.mark.filterwarnings("error")
+@pytest.mark.parametrize("docs", [[], ["", " "]])
+def test_bm25_without_terms(docs):
+    index = build_bm25(docs)
+    assert index.vocab == []
+    ids, scores = index.search_ids([["w0"]], k=3)
+    assert (ids == -1).all()
+
+
+def test_tokenize():
+    assert tokenize(["Randomized controlled trials, e.g. RCTs."]) == [
+        ["randomized", "controlled", "trials", ",", "e.g.", "rcts", "."]
+    ]
+
+
+def test_metadata_filter():
+    rows = pl.DataFrame(
+        {
+            "journal": ["Econometrica", "American Economic Review", "Econometrica"],
+            "year": [2010, 2020, None],
+            "authors": [["Jane Doe"], ["John Smith", "Ann Lee"], ["A. Smith"]],
+        }
+    )
+    assert MetadataFilter(journals=("econometrica",)).row_ids(rows).tolist() == [0, 2]
+    assert MetadataFilter(year_from=2015).row_ids(rows).tolist() == [1]
+    assert MetadataFilter(authors=("smith",), year_to=2015).row_ids(rows).tolist() == []
+    assert MetadataFilter(authors=("smith",)).row_ids(rows).tolist() == [1, 2]
+    assert MetadataFilter().row_ids(rows).tolist() == [0, 1, 2]
+
+
+def test_reciprocal_rank_fusion():
+    dense = np.array([[5, 1, 2], [0, -1, -1]])
+    lexical = np.array([[1, 7, -1], [-1, -1, -1]])
+    ids, scores = reciprocal_rank_fusion([dense, lexical], k=3, k_rrf=1)
+    # 1 is second and first: 1/3 + 1/2; 5 is first once: 1/2; 7 (1/3) beats 2 (1/4)
+    assert ids.tolist() == [[1, 5, 7], [0, -1, -1]]
+    np.testing.assert_allclose(scores[0], [1 / 3 + 1 / 2, 1 / 2, 1 / 3])
+
+
+def test_hybrid_retriever():
+    matrix, _ = corpus(n=6, d=8)
+    rows = pl.DataFrame(
+        {
+            "journal": ["Econometrica"] * 3 + ["Journal of Finance"] * 3,
+            "year": [2010, 2016, 2020] * 2,
+            "authors": [["X"]] * 6,
+            "tokenized_abstract": [
+                "demand elasticities",
+                "demand estimation",
+                "labor supply",
+                "demand elasticities",
+                "asset pricing",
+                "demand elasticities of demand",
+            ],
+        }
+    )
+    # Encodes every query as row 1
+    dense = Retriever(matrix, rows, encoder=lambda texts: matrix[[1] * len(texts)])
+    hybrid = HybridRetriever(dense, build_bm25(rows["tokenized_abstract"]), rows)
+
+    ids, _ = hybrid.search_ids(["demand elasticities"], k=6)
+    assert ids[0][0] == 1  # dense first, lexical top 3
+    filters = MetadataFilter(journals=("econometrica",), year_from=2015)
+    results = hybrid.search(["demand elasticities"], k=6, filters=filters)[0]
+    assert results["row_id"].to_list() == [1, 2]
+    assert results.columns[:3] == ["rank", "row_id", "score"]
+
+    # Candidates restrict every retriever
+    candidates = np.array([3, 4])
+    assert set(dense.search_ids(matrix[1], 6, candidates)[0][0]) == {3, 4}
+    bm25_ids = hybrid.bm25.search_ids([["demand"]], 6, candidates)[0][0]
+    assert bm25_ids.tolist() == [3, -1, -1, -1, -1, -1]
+
+
+@pytest.mark.parametrize("kind,ratio", [("int8", 4), ("binary", 32)])
+def test_quantized_retriever(tmp_path, kind, ratio):
+    rng = np.random.default_rng(4)
+    centers = rng.normal(size=(20, 64))
+    matrix = centers[rng.integers(0, 20, 1000)] + rng.normal(size=(1000, 64))
+    matrix = matrix.astype(np.float32)
+    save_artifact(tmp_path, matrix, pl.DataFrame({"i": range(1000)}), "fake")
+    codes = quantize(matrix, kind)
+    assert matrix.nbytes / codes.nbytes == ratio
+    save_codes(codes, tmp_path / kind, artifact_meta(tmp_path))
+    assert isinstance(load_codes(tmp_path / kind).codes, np.memmap)
+
+    queries = matrix[:20] + rng.normal(scale=0.1, size=(20, 64))
+    exact, exact_scores = Retriever(matrix).search_ids(queries, k=10)
+    retriever = load_retriever(tmp_path, index=kind, rescore=10)
+    assert isinstance(retriever, QuantizedRetriever)
+    ids, scores = retriever.search_ids(queries, k=10)
+    assert recall_at_k(ids, exact) >= 0.95
+    # Rescored with full precision
+    same = ids[:, 0] == exact[:, 0]
+    np.testing.assert_allclose(scores[same, 0], exact_scores[same, 0], rtol=1e-5)
+
+    candidates = np.arange(500, 1000)
+    ids, _ = retriever.search_ids(queries, k=10, candidates=candidates)
+    assert (ids >= 500).all()
+
+    # Codes of an older artifact would shortlist the wrong rows
+    save_artifact(tmp_path, matrix[::-1], pl.DataFrame({"i": range(1000)}), "fake")
+    with pytest.raises(ValueError, match="econ-rag index quantize --model fake"):
+        QuantizedRetriever.from_artifact(tmp_path, kind=kind)
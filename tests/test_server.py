@@ -0,0 +1,144 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import polars as pl
+import pytest
+import requests
+
+from app.retrieval.bm25 import build_bm25
+from app.retrieval.dense import Retriever
+from app.retrieval.hybrid import HybridRetriever
+from app.retrieval.server import MicroBatcher, Query, QueryServer, QueryService
+
+N_ROWS = 50
+
+
+class CountingEncoder:
+    """Embeds "row <i>" as the vector of row i, and records batch sizes"""
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(len(texts))
+        return self.matrix[[int(t.split()[-1]) for t in texts]]
+
+
+@pytest.fixture
+def server():
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(size=(N_ROWS, 8)).astype(np.float32)
+    rows = pl.DataFrame(
+        {
+            "title": [f"Paper {i}" for i in range(N_ROWS)],
+            "journal": ["Econometrica", "Journal of Finance"] * (N_ROWS // 2),
+            "year": list(range(2000, 2000 + N_ROWS)),
+            "authors": [["A"]] * N_ROWS,
+            "tokenized_abstract": [f"row {i}" for i in range(N_ROWS)],
+        }
+    )
+    encoder = CountingEncoder(matrix)
+    retriever = Retriever(matrix, rows, encoder)
+    hybrid = HybridRetriever(retriever, build_bm25(rows["tokenized_abstract"]), rows)
+    service = QueryService(retriever, hybrid, window_ms=50, max_batch=64)
+    server = QueryServer(("127.0.0.1", 0), service)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", encoder
+    server.shutdown()
+
+
+def test_micro_batcher():
+    seen = []
+
+    def double(items):
+        seen.append(len(items))
+        if "boom" in items:
+            raise RuntimeError("boom")
+        return [ValueError(i) if i < 0 else 2 * i for i in items]
+
+    batcher = MicroBatcher(double, window_ms=50)
+    futures = [batcher.submit(i) for i in range(5)]
+    assert [f.result() for f in futures] == [0, 2, 4, 6, 8]
+    assert seen == [5]
+    with pytest.raises(RuntimeError):
+        batcher.submit("boom").result()
+    # Only the item whose result is an exception fails
+    futures = [batcher.submit(i) for i in (1, -1, 2)]
+    assert futures[0].result() == 2 and futures[2].result() == 4
+    with pytest.raises(ValueError):
+        futures[1].result()
+
+
+def test_query_server(server):
+    url, encoder = server
+    assert requests.get(f"{url}/health").json()["rows"] == N_ROWS
+
+    def query(i):
+        return requests.post(f"{url}/query", json={"query": f"row {i}", "k": 3})
+
+    with ThreadPoolExecutor(8) as pool:
+        responses = list(pool.map(query, range(8)))
+    for i, r in enumerate(responses):
+        results = r.json()["results"]
+        assert r.status_code == 200
+        assert len(results) == 3
+        assert results[0]["row_id"] == i
+        assert results[0]["title"] == f"Paper {i}"
+    # Concurrent queries share encoder calls
+    assert len(encoder.batches) < 8
+
+    body = {
+        "query": "row 4",
+        "k": 5,
+        "hybrid": True,
+        "filters": {"journals": ["Econometrica"], "year_from": 2010},
+    }
+    results = requests.post(f"{url}/query", json=body).json()["results"]
+    assert all(r["journal"] == "Econometrica" and r["year"] >= 2010 for r in results)
+
+    assert requests.post(f"{url}/query", json={"k": 3}).status_code == 400
+    assert requests.get(f"{url}/nope").status_code == 404
+    metrics = requests.get(f"{url}/metrics").json()
+    assert metrics["requests"] == 9
+    assert metrics["batches"] == len(encoder.batches)
+    assert metrics["p99_ms"] > 0
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {"query": "row 1", "k": 0},
+        {"query": "row 1", "k": "3"},
+        {"query": "row 1", "k": True},
+        {"query": "row 1", "filters": ["Econometrica"]},
+        {"query": "row 1", "filters": {"journals": "Econometrica"}},
+        {"query": "row 1", "filters": {"authors": [1]}},
+        {"query": "row 1", "filters": {"year_from": "2010"}},
+        ["row 1"],
+    ],
+)
+def test_query_validation(server, body):
+    url, _ = server
+    response = requests.post(f"{url}/query", json=body)
+    assert response.status_code == 400
+    assert response.json()["error"]
+
+
+def test_failed_query_does_not_fail_its_batch():
+    matrix = np.random.default_rng(0).normal(size=(N_ROWS, 8)).astype(np.float32)
+    service = QueryService(Retriever(matrix, encoder=CountingEncoder(matrix)))
+    queries = [
+        Query("row 1", k=2),
+        # The encoder cannot embed it
+        Query("row x"),
+        Query("row 2", k=2),
+        # No BM25 index for a hybrid query
+        Query("row 3", hybrid=True),
+    ]
+    results = service._run_batch(queries)
+    assert [r[0]["row_id"] for r in results[::2]] == [1, 2]
+    assert isinstance(results[1], ValueError)
+    assert isinstance(results[3], Exception)
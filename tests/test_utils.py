@@ -1,6 +1,12 @@
 import pytest
 from data_prep.process_data import clean_text
-from data_prep.utils import get_issns, make_hive_cache_key, parse_hive_cache_key
+from data_prep.utils import (
+    get_issns,
+    get_journals_by_issn,
+    journal_for_issn,
+    make_hive_cache_key,
+    parse_hive_cache_key,
+)
 
 
 def test_make_hive_cache_key():
@@ -71,6 +77,14 @@ def test_get_issns():
     assert result["Review of Economic Studies"]["print"] == "0034-6527"
 
 
+def test_journal_for_issn():
+    journals = get_journals_by_issn()
+    assert journal_for_issn(journals, "0012-9682") == "Econometrica"
+    # Planned queries filter on all ISSNs of a journal
+    assert journal_for_issn(journals, "0012-9682,1468-0262") == "Econometrica"
+    assert journal_for_issn(journals, None) is None
+
+
 def test_clean_text():
     # Test basic functionality
     assert clean_text("  hello  world  ") == "hello world"